@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Startup time of a lookup run as a subprocess, as scripted flows do, through kdw6_lookup.py and through
+# the numpy-only `python -m kdw lookup`.  Run from the repository root: python examples/bench_startup.py
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIMULATED = ['Aex', '1.1e-11', 'Ku', '1110000.0', 'A', '0.01', 'Msat', '1200000', 'W', '1e-07']
+NOT_SIMULATED = ['Aex', '2.1e-11', 'Ku', '1110000.0', 'A', '0.03', 'Msat', '1200000', 'W', '1e-07']
+
+def time_command(command, repeats):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(REPO_FOLDER, 'src'), env.get('PYTHONPATH', '')])
+    subprocess.run(command, env=env, cwd=REPO_FOLDER, check=True, capture_output=True)  # Warm up file caches
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, cwd=REPO_FOLDER, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1e3
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    commands = {
+        'python (no imports)': [sys.executable, '-c', 'pass'],
+        'python -c "import numpy"': [sys.executable, '-c', 'import numpy'],
+        'kdw6_lookup.py, simulated corner': [sys.executable, 'src/kdw/kdw6_lookup.py', '.', '--params'] + SIMULATED,
+        'kdw6_lookup.py, interpolated': [sys.executable, 'src/kdw/kdw6_lookup.py', '.', '--params'] + NOT_SIMULATED,
+        'kdw lookup, simulated corner': [sys.executable, '-m', 'kdw', 'lookup', '.', '--json', '--params'] + SIMULATED,
+        'kdw lookup, interpolated': [sys.executable, '-m', 'kdw', 'lookup', '.', '--json', '--params'] + NOT_SIMULATED,
+    }
+
+    print(f"{'command':<36} {'median (ms)':>12} {'p90 (ms)':>10} {'min (ms)':>10}")
+    for name, command in commands.items():
+        times = time_command(command, repeats)
+        print(f"{name:<36} {np.median(times):>12.1f} {np.percentile(times, 90):>10.1f} {np.min(times):>10.1f}")
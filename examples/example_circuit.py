@@ -0,0 +1,25 @@
+import numpy as np
+import kdw.kdw6_lookup as kdw6_lookup
+import kdw.kdw7_circuit as kdw7_circuit
+
+# Flow for simulating a crossbar of DW_MTJ devices:
+
+if __name__ == '__main__':
+    # Lookup the model parameters for a given set of material parameters
+    model_params = kdw6_lookup.lookup('./KinematicDomainWallModel', {'Aex': 1.1e-11, 'Ku': 1110000.0, 'A': 0.01, 'Msat': 1200000, 'W': 1e-07})
+
+    # 100 x 100 crossbar, rows drive the left terminal of each device, columns read the MTJ terminal
+    rows, cols = 100, 100
+    netlist = kdw7_circuit.new_netlist()
+    kdw7_circuit.add_model(netlist, 'dw', **{k: model_params[k] for k in ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']})
+    for row in range(rows):
+        kdw7_circuit.add_vsource(netlist, f"V{row}", f"row{row}", '0', ('PULSE', [0, -0.2 - 0.002 * row, 1e-9, 0.1e-9, 0.1e-9, 20e-9]))
+        for col in range(cols):
+            kdw7_circuit.add_device(netlist, f"X{row}_{col}", f"row{row}", '0', f"col{col}", 'dw', X_init=60e-9)
+    for col in range(cols):
+        kdw7_circuit.add_resistor(netlist, f"R{col}", f"col{col}", '0', 100)
+
+    time = np.arange(0, 50e-9, 1e-11)
+    results = kdw7_circuit.simulate(netlist, time, save_every=10, save_nodes=[f"col{col}" for col in range(cols)])
+    print(f"Final DW positions (nm): {results['x'][-1, :5] * 1e9} ...")
+    # python kdw7_circuit.py crossbar.cir --tstop 50e-9 --tstep 1e-11 --save_every 10
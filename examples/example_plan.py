@@ -0,0 +1,41 @@
+import itertools
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.io as sio
+import kdw.kdw3_fit as kdw3_fit
+import kdw.kdw10_plan as kdw10_plan
+
+# Flow for planning new mumax simulations, demonstrated on synthetic marker tables:
+
+if __name__ == '__main__':
+    home_folder = tempfile.mkdtemp()
+    os.mkdir(os.path.join(home_folder, 'marker_tables'))
+    os.mkdir(os.path.join(home_folder, 'mx3'))
+    template = 'DWSim_V=centerWall_Geom=1_Aex=11e-12_Ku=4.05e+5_A=0.01_Msat=7.95e+5_u0Hke=NaN_DMI=NaN_J=8.0e+10_RT=100e-9_W=100e-9.mx3'
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mx3', template), os.path.join(home_folder, 'mx3'))
+
+    # Synthetic corners with a smooth dependence on the material parameters.  One corner gets noisy data
+    # and should be ranked first for new J values.
+    rng = np.random.default_rng(0)
+    noisy_corner = (11e-12, 4.05e5, 0.05, 7.95e5, 50e-9)
+    J = np.linspace(1e11, 8e11, 8)
+    for Aex, Ku, A, Msat, W in itertools.product([11e-12, 31e-12], [4.05e5, 1.11e6], [0.01, 0.05], [7.95e5, 1.2e6], [50e-9, 100e-9]):
+        slope = 1e-10 * (Aex / 11e-12) ** 0.5 * (W / 100e-9) ** -0.3 * (Ku / Msat) ** 0.2
+        d0 = 5e7 * (A / 0.01) ** 0.3
+        d1 = 7e-5 * (Msat / 7.95e5)
+        noise = 0.10 if (Aex, Ku, A, Msat, W) == noisy_corner else 0.005
+        max_vel = slope * J * (1 - 4e-13 * J) * (1 + noise * rng.standard_normal(len(J)))
+        data_table = np.column_stack([J, max_vel, 1 / (d0 + d1 * J), max_vel / d0])
+        name = f"dataTable_A={A:g}_Aex={Aex:g}_DMI=NaN_Geom=1_Ku={Ku:g}_Msat={Msat:g}_V=centerWall_W={W:g}_u0Hke=NaN.mat"
+        sio.savemat(os.path.join(home_folder, 'marker_tables', name), {"dataTable": data_table})
+
+    kdw3_fit.fit(home_folder)
+    j_plan, corner_plan = kdw10_plan.plan(home_folder, n_j=3, n_corners=1)
+    print(j_plan.head(3))
+    print(corner_plan.head(3))
+    first = kdw10_plan.parse_tokens(j_plan['corner'][0])
+    assert first['A'] == '0.05' and first['W'] == '5e-08', f"Expected the noisy corner to be ranked first, got {j_plan['corner'][0]}"
+    print("Noisy corner ranked first")
+    # python kdw10_plan.py ./completed_flow --n_j 5 --n_corners 2
@@ -0,0 +1,66 @@
+import argparse
+import threading
+import time
+import numpy as np
+import kdw.kdw13_daemon as kdw13_daemon
+import kdw.runtime.client as client
+import kdw.runtime.lookup as runtime_lookup
+
+# Load test of the kdw13_daemon lookup service.  Several client threads send single lookups of material
+# parameters drawn from a fixed pool so that some repeat and hit the cache, and the throughput and latency
+# percentiles are reported.  Starts a daemon in this process unless --url points to a running one.
+#   python examples/load_test_daemon.py . --threads 16 --requests 4000
+
+def parameter_pool(home_folder, size, seed = 0):
+    table = runtime_lookup.read_table(runtime_lookup.table_paths(home_folder)[0])
+    names = ['Aex', 'Ku', 'A', 'Msat', 'W']
+    points = np.column_stack([table[name] for name in names])
+    rng = np.random.default_rng(seed)
+
+    # Points between two random simulated corners lie within the convex hull of the lookup table
+    t = rng.uniform(0, 1, (size, 1))
+    values = t * points[rng.integers(0, len(points), size)] + (1 - t) * points[rng.integers(0, len(points), size)]
+    values[:size // 4] = points[rng.integers(0, len(points), size // 4)]  # Some simulated corners
+    return [dict(zip(names, row.tolist())) for row in values]
+
+def worker(url, pool, count, seed, latencies, errors):
+    rng = np.random.default_rng(seed)
+    for index in rng.integers(0, len(pool), count):
+        start = time.perf_counter()
+        try:
+            client.lookup(pool[index], url)
+        except ValueError:
+            errors.append(index)
+        latencies.append(time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test of the kdw13_daemon lookup service.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--url", type=str, default='', help="URL of a running daemon")  # Optional argument
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent clients")  # Optional argument
+    parser.add_argument("--requests", type=int, default=4000, help="Total requests")  # Optional argument
+    parser.add_argument("--pool", type=int, default=1000, help="Number of distinct parameter sets")  # Optional argument
+
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        server = kdw13_daemon.serve(args.home_folder, port=0, block=False)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    pool = parameter_pool(args.home_folder, args.pool)
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=worker, args=(url, pool, args.requests // args.threads, seed, latencies, errors)) for seed in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1e3
+    stats = client.stats(url)
+    print(f"{len(latencies)} requests from {args.threads} threads in {elapsed:.2f} s: {len(latencies) / elapsed:.0f} requests/s")
+    print(f"Latency (ms): p50 {np.percentile(latencies, 50):.2f}, p90 {np.percentile(latencies, 90):.2f}, p99 {np.percentile(latencies, 99):.2f}, max {latencies.max():.2f}")
+    print(f"Cache hits: {stats['cache_hits']} of {stats['queries']}, {stats['batched_queries']} queries in {stats['batches']} batches, {len(errors)} errors")
@@ -0,0 +1,52 @@
+import sys
+
+# Single entry point for the flow: python -m kdw <command> [arguments of that module]
+# Each command runs the command line of one module, so only that module and its own dependencies are imported.
+# lookup and simulate use kdw.runtime, which needs only numpy.
+
+COMMANDS = {
+    'extract': ('kdw.kdw1_extract', "Extract DW position from mumax tables"),
+    'analyze': ('kdw.kdw2_analyze', "Smooth DW motion and extract markers"),
+    'fit': ('kdw.kdw3_fit', "Fit the kinematic model constants of each corner"),
+    'evaluate': ('kdw.kdw4_evaluate', "Evaluate the fitted model on the simulations"),
+    'plot': ('kdw.kdw5_plot', "Plot aggregated error"),
+    'lookup': ('kdw.runtime.lookup', "Look up model parameters (numpy only)"),
+    'simulate': ('kdw.runtime.simulate', "Simulate a current pulse (numpy only)"),
+    'circuit': ('kdw.kdw7_circuit', "Simulate a netlist of DW_MTJ devices"),
+    'waveform': ('kdw.kdw8_waveform', "Simulate an arbitrary current waveform"),
+    'inverse': ('kdw.kdw9_inverse', "Solve for pulse amplitude or length"),
+    'plan': ('kdw.kdw10_plan', "Plan the next simulations"),
+    'watch': ('kdw.kdw11_watch', "Process simulations as they complete"),
+    'merge': ('kdw.kdw12_shard', "Merge sharded analyze or evaluate runs"),
+    'daemon': ('kdw.kdw13_daemon', "Serve lookups and simulations on localhost"),
+    'sweep': ('kdw.kdw14_sweep', "Sweep smoothing and derivative settings"),
+    'store': ('kdw.kdw15_store', "Convert trajectory files to full or compact storage"),
+    'bootstrap': ('kdw.kdw16_bootstrap', "Bootstrap confidence intervals of the model constants"),
+    'sensitivity': ('kdw.kdw17_sensitivity', "Sobol sensitivity to the material parameters"),
+    'schedule': ('kdw.kdw18_scheduler', "Memory-budgeted simulation of a Monte Carlo device population"),
+    'catalog': ('kdw.kdw19_catalog', "Query the catalog of simulations, corners, fits and errors"),
+}
+
+def usage():
+    lines = [f"usage: kdw <command> [arguments]", "", "commands:"]
+    lines += [f"  {command:<10} {description}" for command, (_, description) in COMMANDS.items()]
+    lines += ["", "Run kdw <command> -h for the arguments of a command."]
+    return '\n'.join(lines)
+
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"ERROR: Unknown command {argv[0]}.\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    import runpy
+    module, _ = COMMANDS[argv[0]]
+    sys.argv = [f"kdw {argv[0]}"] + argv[1:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import argparse
+import itertools
+import math
+import os
+import re
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+from scipy.interpolate import RBFInterpolator
+import kdw.kdw3_fit as kdw3_fit
+import kdw.kdw9_inverse as kdw9_inverse
+
+CORNER_PARAMS = ['Aex', 'Ku', 'A', 'Msat', 'W']
+MODEL_CONSTANTS = ['c0', 'c1', 'c2', 'c3', 'd0', 'd1']
+
+# Ranks candidate J values for existing corners and candidate new parameter corners by how much a new
+# mumax simulation is expected to improve the model, then writes .mx3 files for the best of each.
+def plan(home_folder, marker_folder = '', lookup_table_folder = '', template_file = '', mx3_folder = '',
+         n_j = 5, n_corners = 2, candidate_js = None, candidate_values = None, RT = None):
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if not marker_folder:
+        marker_folder = os.path.join(home_folder, 'marker_tables')
+    if not os.path.isdir(marker_folder):
+        raise FileNotFoundError(f"Error: The folder {marker_folder} does not exist.")
+
+    if not lookup_table_folder:
+        lookup_table_folder = os.path.join(home_folder, 'lookup_tables')
+    lookup_table_path = os.path.join(lookup_table_folder, 'lookup_all.csv')
+    if not os.path.isfile(lookup_table_path):
+        raise FileNotFoundError(f"Error: The file {lookup_table_path} does not exist.")
+
+    if not template_file:
+        template_folder = os.path.join(home_folder, 'mx3')
+        templates = sorted(f for f in os.listdir(template_folder) if f.endswith('.mx3')) if os.path.isdir(template_folder) else []
+        if not templates:
+            raise FileNotFoundError(f"Error: No .mx3 template found in {template_folder}.")
+        template_file = os.path.join(template_folder, templates[0])
+
+    if not mx3_folder:
+        mx3_folder = os.path.join(home_folder, 'planned_mx3')
+    if not os.path.isdir(mx3_folder):
+        os.mkdir(mx3_folder)
+
+    corners = load_marker_tables(marker_folder)
+    lookup_table = pd.read_csv(lookup_table_path)
+
+    template_tokens = parse_tokens(os.path.splitext(os.path.basename(template_file))[0])
+    if RT is None:
+        RT = float(template_tokens['RT'])
+
+    j_plan = rank_j_candidates(corners, candidate_js)
+    corner_plan = rank_corner_candidates(lookup_table, corners, candidate_values, RT=RT)
+    j_plan.to_csv(os.path.join(mx3_folder, 'plan_j.csv'), index=False)
+    corner_plan.to_csv(os.path.join(mx3_folder, 'plan_corners.csv'), index=False)
+
+    # New J values keep the token strings of their corner so kdw2_analyze groups them with it
+    written = []
+    for _, row in j_plan.head(n_j).iterrows():
+        tokens = dict(template_tokens, **corners[row['corner']]['tokens'])
+        tokens['J'], tokens['RT'] = format_value(row['J']), format_value(RT)
+        written.append(write_mx3(template_file, mx3_folder, tokens))
+
+    # New corners are swept over the J values of the nearest simulated corner
+    for _, row in corner_plan.head(n_corners).iterrows():
+        tokens = dict(template_tokens, **{param: format_value(row[param]) for param in CORNER_PARAMS})
+        for J in corners[row['nearest_corner']]['J']:
+            tokens['J'], tokens['RT'] = format_value(J), format_value(RT)
+            written.append(write_mx3(template_file, mx3_folder, tokens))
+
+    print(f"INFO: Wrote {len(written)} .mx3 files to {mx3_folder}")
+    return j_plan, corner_plan
+
+def parse_tokens(base_name):
+    params = {}
+    for param_string in base_name.split('_'):
+        match = re.match(r'^(.+)=(.+)$', param_string)
+        if match:
+            params[match.group(1)] = match.group(2)
+    return params
+
+def format_value(value):
+    return f"{value:.4g}"
+
+def load_marker_tables(marker_folder):
+    corners = {}
+    for file_name in sorted(f for f in os.listdir(marker_folder) if f.endswith('.mat')):
+        base_name = os.path.splitext(file_name)[0]
+        data_table = sio.loadmat(os.path.join(marker_folder, file_name))['dataTable']
+        tokens = parse_tokens(base_name)
+        corners[base_name] = {'tokens': tokens, 'params': {param: float(tokens[param]) for param in CORNER_PARAMS},
+                              'J': data_table[:, 0], 'max_vel': data_table[:, 1], 'time_constant': data_table[:, 2], 'drift_dist': data_table[:, 3]}
+    return corners
+
+# Predicted relative standard deviation of max_vel at each candidate J, from the covariance of the cubic
+# fit in kdw3_fit.  By default the candidates are the midpoints between the simulated J values.
+def rank_j_candidates(corners, candidate_js = None):
+    rows = []
+    for name, corner in corners.items():
+        J = corner['J']
+        candidates = np.asarray(candidate_js, dtype=float) if candidate_js is not None else (J[1:] + J[:-1]) / 2
+        candidates = candidates[~np.isin(candidates, J)]
+        try:
+            constants = kdw3_fit.fit_corner(J, corner['max_vel'], corner['time_constant'], corner['drift_dist'])
+            cov = constants['cubic_cov']
+        except (RuntimeError, TypeError, ValueError):
+            constants, cov = None, np.full((4, 4), np.inf)
+
+        for J_candidate in candidates:
+            if constants is None or not np.all(np.isfinite(cov)):
+                rows.append({'corner': name, 'J': J_candidate, 'rel_std': np.inf})
+                continue
+            s = J_candidate / constants['J_scale']
+            gradient = np.array([s**3, s**2, s, 1])
+            max_vel = constants['c3'] * J_candidate**3 + constants['c2'] * J_candidate**2 + constants['c1'] * J_candidate + constants['c0']
+            rows.append({'corner': name, 'J': J_candidate, 'rel_std': np.sqrt(max(gradient @ cov @ gradient, 0)) / abs(max_vel)})
+
+    return pd.DataFrame(rows, columns=['corner', 'J', 'rel_std']).sort_values('rel_std', ascending=False, kind='stable').reset_index(drop=True)
+
+def scaled_points(table, lt_min, lt_max):
+    return (table[CORNER_PARAMS].values - lt_min) / (lt_max - lt_min)
+
+def with_quartic_constants(model_params):
+    model_params = dict(model_params)
+    model_params['k0'] = model_params['d0'] * model_params['c0']
+    model_params['k1'] = model_params['d0'] * model_params['c1'] + model_params['d1'] * model_params['c0']
+    model_params['k2'] = model_params['d0'] * model_params['c2'] + model_params['d1'] * model_params['c1']
+    model_params['k3'] = model_params['d0'] * model_params['c3'] + model_params['d1'] * model_params['c2']
+    model_params['k4'] = model_params['d1'] * model_params['c3']
+    return model_params
+
+# Leave-one-out interpolation error of each corner: the corner is predicted from all others and compared by
+# the final DW position after a pulse of each of its simulated J values.  griddata cannot extrapolate to a
+# removed hull vertex, so a linear RBF interpolator over the same rescaled coordinates is used instead.
+def leave_one_out_error(lookup_table, corners, RT = 100e-9):
+    lt_min = lookup_table[CORNER_PARAMS].values.min(axis=0)
+    lt_max = lookup_table[CORNER_PARAMS].values.max(axis=0)
+    points = scaled_points(lookup_table, lt_min, lt_max)
+    values = lookup_table[MODEL_CONSTANTS].values
+    J_default = np.concatenate([corner['J'] for corner in corners.values()]) if corners else np.linspace(1e11, 8e11, 8)
+
+    errors = np.full(len(lookup_table), np.nan)
+    for i in range(len(lookup_table)):
+        others = np.arange(len(lookup_table)) != i
+        if np.count_nonzero(others) <= len(CORNER_PARAMS) + 1:
+            break
+        predicted = RBFInterpolator(points[others], values[others], kernel='linear', degree=1)(points[i:i+1])[0]
+        J = J_default
+        for corner in corners.values():
+            if all(abs(corner['params'][p] - lookup_table[p].iloc[i]) <= 0.01 * abs(lookup_table[p].iloc[i]) for p in CORNER_PARAMS):
+                J = corner['J']
+                break
+        actual = with_quartic_constants(dict(zip(MODEL_CONSTANTS, values[i])))
+        estimate = with_quartic_constants(dict(zip(MODEL_CONSTANTS, predicted)))
+        x_actual = kdw9_inverse.final_position(actual, J, RT)
+        x_estimate = kdw9_inverse.final_position(estimate, J, RT)
+        errors[i] = np.mean(np.abs(x_estimate - x_actual) / np.abs(x_actual))
+    return errors
+
+# Candidate corners lie on the grid of simulated parameter values and their midpoints, or on candidate_values
+# for the parameters it gives values of (a dict of values per parameter).  Each is scored by the inverse distance weighted leave-one-out error of
+# the simulated corners, scaled by its distance to the nearest simulated corner relative to the typical
+# corner spacing.
+def rank_corner_candidates(lookup_table, corners, candidate_values = None, RT = 100e-9):
+    loo_error = leave_one_out_error(lookup_table, corners, RT)
+    lt_min = lookup_table[CORNER_PARAMS].values.min(axis=0)
+    lt_max = lookup_table[CORNER_PARAMS].values.max(axis=0)
+    points = scaled_points(lookup_table, lt_min, lt_max)
+
+    candidate_values = dict(candidate_values or {})
+    for param in CORNER_PARAMS:
+        if param not in candidate_values:
+            values = np.unique(lookup_table[param].values)
+            candidate_values[param] = np.union1d(values, (values[1:] + values[:-1]) / 2)
+    candidates = pd.DataFrame(list(itertools.product(*[candidate_values[p] for p in CORNER_PARAMS])), columns=CORNER_PARAMS)
+    candidate_points = scaled_points(candidates, lt_min, lt_max)
+
+    distances = np.sqrt(((candidate_points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    spacing = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(spacing, np.inf)
+    typical_spacing = np.median(spacing.min(axis=1))
+
+    valid = np.isfinite(loo_error)
+    weights = 1 / np.maximum(distances[:, valid], 1e-12) ** 2
+    expected_error = (weights * loo_error[valid]).sum(axis=1) / weights.sum(axis=1)
+    nearest = distances.argmin(axis=1)
+    candidates['expected_error'] = expected_error * distances.min(axis=1) / typical_spacing
+
+    corner_names = list(corners.keys())
+    corner_points = np.array([[corners[name]['params'][p] for p in CORNER_PARAMS] for name in corner_names]) if corner_names else np.empty((0, len(CORNER_PARAMS)))
+    if len(corner_names):
+        corner_scaled = (corner_points - lt_min) / (lt_max - lt_min)
+        corner_distances = np.sqrt(((candidate_points[:, None, :] - corner_scaled[None, :, :]) ** 2).sum(axis=2))
+        candidates['nearest_corner'] = [corner_names[i] for i in corner_distances.argmin(axis=1)]
+    else:
+        candidates['nearest_corner'] = ''
+    candidates['nearest_loo_error'] = loo_error[nearest]
+
+    # Drop candidates that have already been simulated
+    candidates = candidates[distances.min(axis=1) > 1e-9]
+    return candidates.sort_values('expected_error', ascending=False, kind='stable').reset_index(drop=True)
+
+# Writes a copy of the mumax template with the material parameters, J and RT of tokens, named by the
+# filename convention
+def write_mx3(template_file, mx3_folder, tokens):
+    with open(template_file, mode='r') as infile:
+        script = infile.read()
+
+    template_name = os.path.splitext(os.path.basename(template_file))[0]
+    name_tokens = []
+    for token in template_name.split('_'):
+        key = token.split('=')[0]
+        name_tokens.append(f"{key}={tokens[key]}" if '=' in token and key in tokens else token)
+    sim_name = '_'.join(name_tokens)
+
+    W = float(tokens['W'])
+    grid_y = math.ceil(round(W / 1.6e-9, 6))
+    replacements = [
+        (r'^//"?[^\n]*\.mx3"?', f'//"{sim_name}.mx3"'),
+        (r'(Aex\.setregion\(0,\s*)[^)]+', rf'\g<1>{tokens["Aex"]}'),
+        (r'(alpha\.setregion\(0,\s*)[^)]+', rf'\g<1>{tokens["A"]}'),
+        (r'(Msat\.setregion\(0,\s*)[^)]+', rf'\g<1>{tokens["Msat"]}'),
+        (r'(Ku1\.setregion\(0,\s*)[^)]+', rf'\g<1>{tokens["Ku"]}'),
+        (r'(setgridsize\(\s*\d+\s*,\s*)\d+', rf'\g<1>{grid_y}'),
+        (r'(cuboid\(\s*[^,]+,\s*)[^,]+', rf'\g<1>{format_value(W)}'),
+        (r'(Crop\(m\.comp\(2\),\s*i,\s*\(i\+1\),\s*)\d+\s*,\s*\d+', rf'\g<1>{grid_y // 2 - 1},{grid_y // 2 + 1}'),
+        (r'(Jelec\s*:=\s*)[^\s/]+', rf'\g<1>{tokens["J"]}'),
+        (r'(run\()[^)]+', rf'\g<1>{tokens["RT"]}'),
+    ]
+    for pattern, replacement in replacements:
+        script = re.sub(pattern, replacement, script, count=1, flags=re.MULTILINE)
+
+    output_file = os.path.join(mx3_folder, f"{sim_name}.mx3")
+    with open(output_file, mode='w') as outfile:
+        outfile.write(script)
+    return output_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks and writes the most informative new mumax simulations.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--marker_folder", type=str, default='', help="The directory storing the extracted max_vel and drift constants")  # Optional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
+    parser.add_argument("--template_file", type=str, default='', help="The mumax script to use as a template")  # Optional argument
+    parser.add_argument("--mx3_folder", type=str, default='', help="Folder to store the planned .mx3 files")  # Optional argument
+    parser.add_argument("--n_j", type=int, default=5, help="Number of new J values to simulate")  # Optional argument
+    parser.add_argument("--n_corners", type=int, default=2, help="Number of new parameter corners to simulate")  # Optional argument
+    parser.add_argument("--candidate_js", type=float, default=None, nargs='+', help="Candidate J values for existing corners")  # Optional argument
+    parser.add_argument("--candidate_values", type=str, default=[], nargs='+', help="Candidate values of new corners like: Aex 1.1e-11,1.6e-11 W 5e-8 (others from the simulated grid)")  # Optional argument
+    parser.add_argument("--RT", type=float, default=None, help="Run time of the planned simulations (s), by default that of the template")  # Optional argument
+
+    args = parser.parse_args()
+
+    candidate_values = {}
+    for i in range (0, len(args.candidate_values), 2):
+        candidate_values[args.candidate_values[i]] = [float(value) for value in args.candidate_values[i+1].split(',')]
+
+    j_plan, corner_plan = plan(args.home_folder, args.marker_folder, args.lookup_table_folder, args.template_file, args.mx3_folder,
+                               args.n_j, args.n_corners, args.candidate_js, candidate_values or None, args.RT)
+    print(j_plan.head(args.n_j))
+    print(corner_plan.head(args.n_corners))
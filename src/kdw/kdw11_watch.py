@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import kdw.kdw1_extract as kdw1_extract
+import kdw.kdw2_analyze as kdw2_analyze
+import kdw.kdw3_fit as kdw3_fit
+import kdw.kdw4_evaluate as kdw4_evaluate
+import kdw.kdw19_catalog as kdw19_catalog
+
+CORNER_PARAMS = ['Aex', 'Ku', 'A', 'Msat', 'W']
+
+# Polls the simulations folder and processes mumax runs as they finish.  Each completed table.txt is
+# extracted and analyzed on its own.  Once every run of a parameter corner has completed (and at least
+# min_sims_per_corner, or all expected_js, are present) the corner's marker table is written from the markers
+# kept for its runs, the lookup table is re-fit, and the corner's rows of the error tables are replaced.  Shared tables are replaced atomically and
+# progress is kept in a status file, which also lets a restarted watch skip already processed runs.  Fitted
+# constants and errors are only recorded in the catalog once the tables holding them are in place.
+def watch(home_folder, sim_folder = '', poll_interval = 60, settle_time = 120, min_sims_per_corner = 5, expected_js = None,
+          status_file = '', with_ext_centerwall = True, once = False, catalog = True):
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if not sim_folder:
+        sim_folder = os.path.join(home_folder, 'simulations')
+    if not os.path.isdir(sim_folder):
+        raise FileNotFoundError(f"Error: The folder {sim_folder} does not exist.")
+
+    if not status_file:
+        status_file = os.path.join(home_folder, 'watch_status.json')
+
+    status = {'sims': {}, 'corners': {}}
+    if os.path.isfile(status_file):
+        with open(status_file, mode='r') as infile:
+            status = json.load(infile)
+
+    sizes = {}  # table.txt sizes seen at the previous poll
+    print(f"INFO: Watching {sim_folder}")
+    try:
+        while True:
+            poll(home_folder, sim_folder, status, sizes, settle_time, min_sims_per_corner, expected_js, with_ext_centerwall, catalog)
+            status['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            atomic_write_text(status_file, json.dumps(status, indent=2, sort_keys=True))
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print(f"INFO: Stopped watching {sim_folder}")
+    return status
+
+def poll(home_folder, sim_folder, status, sizes, settle_time, min_sims_per_corner, expected_js, with_ext_centerwall, catalog = True):
+    out_folders = sorted(f for f in os.listdir(sim_folder) if f.endswith('.out'))
+
+    for out_folder in out_folders:
+        if status['sims'].get(out_folder, {}).get('state') in ('processed', 'failed'):
+            continue
+        if not is_complete(os.path.join(sim_folder, out_folder, 'table.txt'), sizes, settle_time):
+            status['sims'][out_folder] = {'state': 'running'}
+            continue
+
+        print(f"INFO: {out_folder} completed.")
+        try:
+            markers = process_sim(home_folder, sim_folder, out_folder, with_ext_centerwall, catalog)
+            status['sims'][out_folder] = {'state': 'processed', 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'markers': markers}
+        except Exception as e:
+            print(f"ERROR: Could not process {out_folder}: {e}")
+            status['sims'][out_folder] = {'state': 'failed', 'error': str(e)}
+
+    # Group runs by parameter corner, as kdw2_analyze does
+    corners = {}
+    for out_folder in out_folders:
+        params = sim_params(out_folder)
+        corners.setdefault(corner_name(params), []).append(out_folder)
+
+    for corner, corner_sims in sorted(corners.items()):
+        states = [status['sims'].get(s, {}).get('state') for s in corner_sims]
+        processed = sorted(s for s, state in zip(corner_sims, states) if state == 'processed')
+        corner_status = status['corners'].setdefault(corner, {'state': 'waiting'})
+        corner_status['sims'] = len(corner_sims)
+        corner_status['processed'] = len(processed)
+
+        if 'running' in states or not processed:
+            corner_status['state'] = 'waiting'
+            continue
+        if expected_js is not None:
+            found_js = [float(sim_params(s)['J']) for s in processed]
+            if any(not np.isclose(found_js, J, rtol=1e-3).any() for J in expected_js):
+                corner_status['state'] = 'waiting'
+                continue
+        elif len(processed) < min_sims_per_corner:
+            corner_status['state'] = 'waiting'
+            continue
+        if processed in (corner_status.get('fitted_sims'), corner_status.get('failed_sims')):
+            continue
+
+        print(f"INFO: Corner {corner} is complete with {len(processed)} simulations.  Re-fitting.")
+        try:
+            for out_folder in processed:
+                if 'markers' not in status['sims'][out_folder]:  # Processed by a watch that did not keep markers
+                    status['sims'][out_folder]['markers'] = sim_markers(home_folder, out_folder, catalog)
+            simulations = [status['sims'][out_folder]['markers'] for out_folder in processed]
+            corner_status['err_mean_mean'] = process_corner(home_folder, sim_params(processed[0]), simulations, catalog)
+            corner_status['state'] = 'fitted'
+            corner_status['fitted_sims'] = processed
+            corner_status['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        except Exception as e:
+            print(f"ERROR: Could not fit corner {corner}: {e}")
+            corner_status['state'] = 'failed'
+            corner_status['failed_sims'] = processed
+            corner_status['error'] = str(e)
+
+# A table is complete once its size has not changed since the last poll and it has not been modified for
+# settle_time seconds
+def is_complete(table_file, sizes, settle_time):
+    if not os.path.isfile(table_file):
+        return False
+    size = os.path.getsize(table_file)
+    previous = sizes.get(table_file)
+    sizes[table_file] = size
+    if size == 0 or time.time() - os.path.getmtime(table_file) < settle_time:
+        return False
+    return previous == size or settle_time == 0
+
+def sim_params(out_folder):
+    params = {}
+    for param_string in re.sub(r'\.out$', '', out_folder).split('_'):
+        match = re.match(r'^(.+)=(.+)$', param_string)
+        if match:
+            params[match.group(1)] = match.group(2)
+    return params
+
+def corner_name(params):
+    return '_'.join([f"{param}={params[param]}" for param in sorted(params.keys()) if param not in ('J', 'RT')])
+
+# Extracts and analyzes a single run and returns its markers
+def process_sim(home_folder, sim_folder, out_folder, with_ext_centerwall, catalog = True):
+    kdw1_extract.extract(home_folder, sim_folder, with_ext_centerwall=with_ext_centerwall, out_folders=[out_folder], catalog=catalog)
+    return sim_markers(home_folder, out_folder, catalog)
+
+# Analyzes only the raw data of one run.  Its marker table is discarded; marker tables are only written once
+# the whole corner is complete, from the markers returned here.
+def sim_markers(home_folder, out_folder, catalog = True):
+    scratch_folder = os.path.join(home_folder, '.watch_markers')
+    if not os.path.isdir(scratch_folder):
+        os.mkdir(scratch_folder)
+    sim_name = re.sub(r'\.out$', '', out_folder)
+    simulations = kdw2_analyze.analyze(home_folder, marker_folder=scratch_folder, catalog=catalog, sim_names=[sim_name])
+    if not simulations:
+        raise ValueError(f"Error: No markers found for {sim_name}.")
+    simulation = simulations[0]
+    return dict({'params': simulation['params'], 'name': simulation['name']},
+                **{column: float(simulation[column]) for column in ['J', 'max_vel', 'time_constant', 'drift_dist']})
+
+def process_corner(home_folder, params, simulations, catalog = True):
+    corner_params = {param: value for param, value in params.items() if param not in ('J', 'RT')}
+    marker_folder = os.path.join(home_folder, 'marker_tables')
+    if not os.path.isdir(marker_folder):
+        os.mkdir(marker_folder)
+    kdw2_analyze.write_marker_tables(simulations, marker_folder)
+
+    staging_folder = os.path.join(home_folder, '.watch_staging')
+    if os.path.isdir(staging_folder):
+        shutil.rmtree(staging_folder)
+    os.mkdir(staging_folder)
+
+    # Re-fit all corners into the staging folder, then swap the lookup table in
+    lookup_table_folder = os.path.join(home_folder, 'lookup_tables')
+    if not os.path.isdir(lookup_table_folder):
+        os.mkdir(lookup_table_folder)
+    corner_constants = kdw3_fit.fit(home_folder, lookup_table_folder=staging_folder, catalog=False)
+    os.replace(os.path.join(staging_folder, 'lookup_all.csv'), os.path.join(lookup_table_folder, 'lookup_all.csv'))
+    if catalog:
+        kdw19_catalog.record_constants(home_folder, corner_constants)
+
+    # Evaluate only this corner, then merge its rows into the shared error tables
+    error_folder = os.path.join(home_folder, 'error_tables')
+    if not os.path.isdir(error_folder):
+        os.mkdir(error_folder)
+    simulations = kdw4_evaluate.evaluate(home_folder, error_folder=staging_folder, match_params=corner_params, catalog=False)
+    corner_values = {param: float(corner_params[param]) for param in CORNER_PARAMS}
+    for table_name in ['all_corners_error.csv', 'all_sims_error.csv']:
+        merge_error_rows(os.path.join(error_folder, table_name), pd.read_csv(os.path.join(staging_folder, table_name)), corner_values)
+    for file_name in os.listdir(staging_folder):
+        if file_name.startswith('error_'):
+            os.replace(os.path.join(staging_folder, file_name), os.path.join(error_folder, file_name))
+    shutil.rmtree(staging_folder)
+    if catalog:
+        kdw19_catalog.record_errors(home_folder, simulations)
+
+    corners_error = pd.read_csv(os.path.join(error_folder, 'all_corners_error.csv'))
+    return float(corners_error.loc[matching_rows(corners_error, corner_values), 'err_mean_mean'].iloc[0])
+
+def matching_rows(table, corner_values):
+    match = np.ones(len(table), dtype=bool)
+    for param, value in corner_values.items():
+        match &= np.isclose(table[param].astype(float), value, rtol=1e-3)
+    return match
+
+# Replaces the rows of one corner in an error table with new_rows
+def merge_error_rows(table_path, new_rows, corner_values):
+    if os.path.isfile(table_path):
+        table = pd.read_csv(table_path)
+        table = pd.concat([table[~matching_rows(table, corner_values)], new_rows], ignore_index=True)
+    else:
+        table = new_rows
+    atomic_write_text(table_path, table.to_csv(index=False))
+
+def atomic_write_text(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode='w') as outfile:
+        outfile.write(text)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Processes mumax simulations as they complete.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--sim_folder", type=str, default='', help="The directory storing the mumax output folders")  # Optional argument
+    parser.add_argument("--poll_interval", type=float, default=60, help="Seconds between polls")  # Optional argument
+    parser.add_argument("--settle_time", type=float, default=120, help="Seconds a table.txt must be unmodified to count as complete")  # Optional argument
+    parser.add_argument("--min_sims_per_corner", type=int, default=5, help="Minimum completed simulations before a corner is fit")  # Optional argument
+    parser.add_argument("--expected_js", type=float, default=None, nargs='+', help="J values that complete a corner's sweep")  # Optional argument
+    parser.add_argument("--status_file", type=str, default='', help="Status file to keep up to date")  # Optional argument
+    parser.add_argument("--once", action='store_true', help="Poll once and exit")  # Optional argument
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the results in the catalog (see kdw19_catalog.py)")  # Optional argument
+
+    args = parser.parse_args()
+
+    watch(args.home_folder, args.sim_folder, args.poll_interval, args.settle_time, args.min_sims_per_corner, args.expected_js,
+          args.status_file, once=args.once, catalog=not args.no_catalog)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+
+# Sharding splits the flow over N processes or machines sharing the home_folder.  Every simulation is assigned
+# to one shard by a stable hash of its name, so the same simulation lands in the same shard in every stage and
+# on every machine.  Per-simulation outputs (raw_data, smoothed_data, images) are written to the usual shared
+# folders; per-corner outputs are partial and go to $home_folder/shards/[i]_of_[N]/ until merge combines them:
+#   python kdw1_extract.py  home --shard i/N     (for i = 0..N-1, on any machine)
+#   python kdw2_analyze.py  home --shard i/N
+#   python kdw12_shard.py   home --stage analyze --num_shards N   (marker tables and lookup_all.csv)
+#   python kdw4_evaluate.py home --shard i/N
+#   python kdw12_shard.py   home --stage evaluate --num_shards N  (error tables)
+
+COMPLETE_FILE = 'shard_complete.json'
+PARTIAL_OUTPUTS = r'^(dataTable_.+\.mat|error_.+\.csv|all_(corners|sims)_error\.csv)$'  # Written to a shard's stage folder
+
+# Parses 'i/N' into (i, N), with shards numbered 0 to N-1
+def parse_shard(shard):
+    if shard is None or shard == '':
+        return None
+    if isinstance(shard, str):
+        m = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', shard)
+        if not m:
+            raise ValueError(f"Error: Shard {shard} must be given as i/N.")
+        shard = (int(m.group(1)), int(m.group(2)))
+    index, num_shards = shard
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"Error: Shard index {index} must be between 0 and {num_shards - 1}.")
+    return index, num_shards
+
+# crc32 rather than hash() so the assignment does not change between processes
+def shard_of(sim_name, num_shards):
+    sim_name = re.sub(r'\.(out|mat)$', '', os.path.basename(sim_name))
+    return zlib.crc32(sim_name.encode('utf-8')) % num_shards
+
+def in_shard(sim_name, shard):
+    shard = parse_shard(shard)
+    return shard is None or shard_of(sim_name, shard[1]) == shard[0]
+
+def shard_folder(home_folder, stage_folder, shard):
+    index, num_shards = parse_shard(shard)
+    shards_folder = os.path.join(home_folder, 'shards')
+    if not os.path.isdir(shards_folder):
+        os.mkdir(shards_folder)
+    folder = os.path.join(shards_folder, f"{index}_of_{num_shards}")
+    if not os.path.isdir(folder):
+        os.mkdir(folder)
+
+    # A rerun of the shard is incomplete until it finishes again, and starts without the tables of the previous
+    # run, which may hold corners or simulations this shard no longer has
+    stage_folder = os.path.join(folder, stage_folder)
+    if os.path.isfile(os.path.join(stage_folder, COMPLETE_FILE)):
+        os.remove(os.path.join(stage_folder, COMPLETE_FILE))
+    if os.path.isdir(stage_folder):
+        for file_name in os.listdir(stage_folder):
+            if re.match(PARTIAL_OUTPUTS, file_name):
+                os.remove(os.path.join(stage_folder, file_name))
+    return stage_folder
+
+# Written last by each sharded stage, so merge can tell a finished shard from one still running
+def mark_complete(folder, sim_names):
+    with open(os.path.join(folder, COMPLETE_FILE), mode='w') as outfile:
+        json.dump({'sims': sorted(sim_names)}, outfile, indent=2)
+
+def completed_shard_folders(home_folder, stage_folder, num_shards):
+    folders = [os.path.join(home_folder, 'shards', f"{i}_of_{num_shards}", stage_folder) for i in range(num_shards)]
+    missing = [folder for folder in folders if not os.path.isfile(os.path.join(folder, COMPLETE_FILE))]
+    if missing:
+        raise FileNotFoundError(f"Error: Shards have not completed: {', '.join(missing)}")
+    return folders
+
+# Combines the shards of the analyze or evaluate stage into the tables a single run would have produced.
+# Merging the analyze stage also fits lookup_all.csv, which the sharded evaluate stage needs.
+def merge(home_folder, stage, num_shards, marker_folder = '', lookup_table_folder = '', error_folder = '', catalog = True):
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if stage == 'analyze':
+        if not marker_folder:
+            marker_folder = os.path.join(home_folder, 'marker_tables')
+        if not os.path.isdir(marker_folder):
+            os.mkdir(marker_folder)
+        merge_marker_tables(completed_shard_folders(home_folder, 'marker_tables', num_shards), marker_folder)
+
+        import kdw.kdw3_fit as kdw3_fit  # Imported here as kdw2_analyze and kdw4_evaluate import this module
+        kdw3_fit.fit(home_folder, marker_folder, lookup_table_folder, catalog)
+    elif stage == 'evaluate':
+        if not error_folder:
+            error_folder = os.path.join(home_folder, 'error_tables')
+        if not os.path.isdir(error_folder):
+            os.mkdir(error_folder)
+        merge_error_tables(completed_shard_folders(home_folder, 'error_tables', num_shards), error_folder)
+    else:
+        raise ValueError(f"Error: Unknown stage {stage}.  Must be 'analyze' or 'evaluate'.")
+
+# Each shard holds the rows of its own simulations for every corner it touched
+def merge_marker_tables(shard_folders, marker_folder):
+    data_tables = {}
+    for folder in shard_folders:
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.startswith('dataTable_') and file_name.endswith('.mat'):
+                data_tables.setdefault(file_name, []).append(sio.loadmat(os.path.join(folder, file_name))['dataTable'])
+
+    for file_name, tables in sorted(data_tables.items()):
+        data_table = np.vstack(tables)
+        data_table = data_table[data_table[:, 0].argsort()]  # Sort by J values
+        sio.savemat(os.path.join(marker_folder, file_name), {"dataTable": data_table})
+    print(f"INFO: Merged {len(data_tables)} marker tables from {len(shard_folders)} shards into {marker_folder}")
+
+def merge_error_tables(shard_folders, error_folder):
+    import kdw.kdw4_evaluate as kdw4_evaluate  # Imported here as kdw4_evaluate imports this module
+
+    simulations = []
+    for folder in shard_folders:
+        for file_name in sorted(os.listdir(folder)):
+            m = re.match(r'^error_(.+)\.csv$', file_name)
+            if not m:
+                continue
+            params = {}
+            for param_string in m.group(1).split('_'):
+                match = re.match(r'^(.+)=(.+)$', param_string)
+                if match:
+                    params[match.group(1)] = match.group(2)
+            for _, row in pd.read_csv(os.path.join(folder, file_name), float_precision='round_trip').iterrows():
+                simulation = {'params': dict(params)}
+                simulation.update({column: float(row[column]) for column in row.index})
+                simulations.append(simulation)
+
+    kdw4_evaluate.write_error_tables(simulations, error_folder)
+    print(f"INFO: Merged {len(simulations)} simulations from {len(shard_folders)} shards into {error_folder}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merges the outputs of sharded analyze or evaluate runs.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--stage", type=str, required=True, help="analyze or evaluate")  # Optional argument
+    parser.add_argument("--num_shards", type=int, required=True, help="Number of shards the stage was run with")  # Optional argument
+    parser.add_argument("--marker_folder", type=str, default='', help="The directory to store the merged data tables")  # Optional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
+    parser.add_argument("--error_folder", type=str, default='', help="Folder to store the merged error tables")  # Optional argument
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the fitted constants in the catalog (see kdw19_catalog.py)")  # Optional argument
+
+    args = parser.parse_args()
+
+    merge(args.home_folder, args.stage, args.num_shards, args.marker_folder, args.lookup_table_folder, args.error_folder, not args.no_catalog)
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import kdw.runtime.lookup as runtime_lookup
+import kdw.runtime.simulate as runtime_simulate
+
+# Local lookup and simulation service.  The lookup and error tables and the interpolation triangulation stay
+# loaded, concurrent requests are gathered for up to batch_window seconds and evaluated together with the
+# vectorized kdw.runtime functions, and results are kept in an LRU cache keyed on the parameter values rounded
+# to quantize_digits significant digits, so parameter sets that differ by less than that share a result.
+# Queries are evaluated at their given values, since rounding could move a query on the edge of the lookup
+# table outside it.  The tables are reloaded when their files change, e.g. after watch or a refit replaced
+# them, and the cache is then cleared; keys also hold the tables' modification times, so a result computed
+# from the old tables is never served for the new ones.  Simulations of a batch are run in chunks of at most
+# max_simulate_memory bytes.  Clients use kdw.runtime.client.
+#
+#   POST /lookup   {"params": {"Aex": 1.1e-11, ...}} or {"params": [{...}, ...]}
+#   POST /simulate {"params": {...} or [...], "J": 4e11, "width": 1e-7, "t_stop": 2e-7, "dt": 1e-11, "samples": 0}
+#   GET  /stats
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+SIMULATE_ARRAYS = 6  # float64 arrays of the time axis per simulation: x, v, a, the current and 2 temporaries
+
+def new_state(home_folder, lookup_table_folder = '', error_tables_folder = '', batch_window = 0.002, max_batch = 1024,
+              cache_size = 100000, quantize_digits = 6, max_simulate_memory = 2.5e8):
+    lookup_table_path, error_table_path = runtime_lookup.table_paths(home_folder, lookup_table_folder, error_tables_folder)
+    runtime_lookup.read_table(lookup_table_path)
+    if error_table_path:
+        runtime_lookup.read_table(error_table_path)
+    else:
+        print(f"WARNING: all_corners_error.csv not found.  Confidence will not be reported.")
+
+    return {'lookup_table_path': lookup_table_path, 'error_table_path': error_table_path, 'queue': queue.Queue(),
+            'cache': OrderedDict(), 'cache_lock': threading.Lock(), 'cache_size': cache_size, 'quantize_digits': quantize_digits,
+            'batch_window': batch_window, 'max_batch': max_batch, 'max_simulate_memory': max_simulate_memory, 'version': None,
+            'stats': {'queries': 0, 'cache_hits': 0, 'batches': 0, 'batched_queries': 0, 'started': time.time()}}
+
+def quantize(values, digits):
+    return tuple(float(f"{value:.{digits}g}") for value in values)
+
+# Modification times of the tables, part of every cache key.  The cache is cleared when they change.
+def table_version(state):
+    paths = [path for path in (state['lookup_table_path'], state['error_table_path']) if path]
+    version = tuple(os.path.getmtime(path) if os.path.isfile(path) else None for path in paths)
+    with state['cache_lock']:
+        if version != state['version']:
+            if state['version'] is not None:
+                print(f"INFO: Tables changed.  Cleared {len(state['cache'])} cached results.")
+            state['cache'].clear()
+            state['version'] = version
+    return version
+
+def cache_get(state, key):
+    with state['cache_lock']:
+        state['stats']['queries'] += 1
+        if key in state['cache']:
+            state['cache'].move_to_end(key)
+            state['stats']['cache_hits'] += 1
+            return state['cache'][key]
+    return None
+
+def cache_put(state, key, result):
+    with state['cache_lock']:
+        state['cache'][key] = result
+        state['cache'].move_to_end(key)
+        while len(state['cache']) > state['cache_size']:
+            state['cache'].popitem(last=False)
+
+# Answers each query from the cache or hands it to the batcher, then waits for all of them.  A query is a dict
+# with 'kind' ('lookup' or 'simulate'), 'names' and 'values' of the material parameters and, for 'simulate',
+# the pulse settings in 'options'.
+def resolve(state, queries):
+    results = [None] * len(queries)
+    pending = []
+    version = table_version(state)
+    for i, query in enumerate(queries):
+        query['key'] = (version, query['kind'], tuple(query['names']), quantize(query['values'], state['quantize_digits']),
+                        tuple(sorted(query['options'].items())))
+        results[i] = cache_get(state, query['key'])
+        if results[i] is None:
+            query['done'] = threading.Event()
+            state['queue'].put(query)
+            pending.append((i, query))
+
+    for i, query in pending:
+        query['done'].wait()
+        results[i] = query['result']
+    return results
+
+# Collects queued queries for up to batch_window seconds after the first one arrives, then evaluates them
+def batcher(state):
+    while True:
+        query = state['queue'].get()
+        if query is None:
+            return
+        batch = [query]
+        deadline = time.perf_counter() + state['batch_window']
+        while len(batch) < state['max_batch']:
+            try:
+                query = state['queue'].get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if query is None:
+                state['queue'].put(None)
+                break
+            batch.append(query)
+        try:
+            run_batch(state, batch)
+        except Exception as e:
+            print(f"ERROR: Batch of {len(batch)} queries failed: {e}")
+            for query in batch:
+                if not query['done'].is_set():
+                    query['result'] = {'error': str(e)}
+                    query['done'].set()
+
+def run_batch(state, batch):
+    with state['cache_lock']:
+        state['stats']['batches'] += 1
+        state['stats']['batched_queries'] += len(batch)
+
+    groups = {}
+    for query in batch:
+        if query['key'] in groups:  # Repeated in this batch before the first one reached the cache
+            groups[query['key']].append(query)
+        else:
+            groups[query['key']] = [query]
+    unique = [queries[0] for queries in groups.values()]
+
+    by_kind = {}
+    for query in unique:
+        group_key = (query['kind'], tuple(query['names']))
+        if query['kind'] == 'simulate':  # Simulations are batched over a shared time axis
+            group_key += (query['options']['t_stop'], query['options']['dt'])
+        by_kind.setdefault(group_key, []).append(query)
+
+    # Each group of simulations is split into chunks of at most max_simulate_memory bytes
+    chunks = []
+    for group_key, queries in by_kind.items():
+        size = len(queries)
+        if group_key[0] == 'simulate':
+            samples = len(runtime_simulate.pulse(0, 0, group_key[2], group_key[3])[0])
+            size = max(int(state['max_simulate_memory'] // (SIMULATE_ARRAYS * 8 * samples)), 1)
+        chunks += [queries[start:start + size] for start in range(0, len(queries), size)]
+
+    for queries in chunks:
+        try:
+            results = evaluate_group(state, queries)
+        except Exception:
+            # Evaluate one at a time so that a bad query does not fail the others
+            results = []
+            for query in queries:
+                try:
+                    results.append(evaluate_group(state, [query])[0])
+                except Exception as e:
+                    results.append({'error': str(e)})
+        for query, result in zip(queries, results):
+            cache_put(state, query['key'], result)
+            for duplicate in groups[query['key']]:
+                duplicate['result'] = result
+                duplicate['done'].set()
+
+# Vectorized evaluation of queries of the same kind and parameter names
+def evaluate_group(state, queries):
+    names = list(queries[0]['names'])
+    values = np.array([query['values'] for query in queries])
+    batch = runtime_lookup.lookup_batch(state['lookup_table_path'], names, values)
+    confidence = None
+    if state['error_table_path']:
+        confidence = runtime_lookup.confidence_batch(state['lookup_table_path'], state['error_table_path'], names, values, batch['interpolated'])
+
+    results = []
+    for i in range(len(queries)):
+        if np.isnan(batch['c0'][i]):
+            results.append({'error': f"Error: Micromagnetic parameters outside convex hull of lookup table."})
+            continue
+        result = {'params': dict(zip(names, values[i].tolist())), 'model_params': {k: float(batch[k][i]) for k in runtime_lookup.MODEL_PARAM_NAMES},
+                  'interpolated': bool(batch['interpolated'][i])}
+        if confidence is not None and not np.isnan(confidence['err_mean_mean'][i]):
+            result['confidence'] = {'err_mean_mean': float(confidence['err_mean_mean'][i]), 'confidence': str(confidence['confidence'][i]),
+                                    'distance': float(confidence['distance'][i])}
+            if not batch['interpolated'][i]:
+                result['confidence']['err_conf_95'] = float(confidence['err_conf_95'][i])
+        results.append(result)
+
+    if queries[0]['kind'] == 'simulate':
+        valid = [i for i, result in enumerate(results) if 'error' not in result]
+        if valid:
+            simulate_group(queries, results, batch, valid)
+    return results
+
+def simulate_group(queries, results, batch, valid):
+    options = queries[valid[0]]['options']
+    time_axis = runtime_simulate.pulse(0, 0, options['t_stop'], options['dt'])[0]
+    current = np.array([runtime_simulate.pulse(queries[i]['options']['J'], queries[i]['options']['width'], options['t_stop'], options['dt'])[1] for i in valid])
+    x, v, a = runtime_simulate.kinematic_model_batch(*[batch[k][valid] for k in ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']], time_axis, current)
+    for row, i in enumerate(valid):
+        results[i]['final_x'] = float(x[row, -1])
+        results[i]['max_v'] = float(v[row, np.argmax(np.abs(v[row]))])
+        samples = queries[i]['options']['samples']
+        if samples > 0:
+            keep = np.unique(np.linspace(0, len(time_axis) - 1, samples).round().astype(int))
+            results[i]['time'] = time_axis[keep].tolist()
+            results[i]['x'] = x[row, keep].tolist()
+            results[i]['v'] = v[row, keep].tolist()
+
+def parse_queries(kind, body):
+    params_list = body['params'] if isinstance(body['params'], list) else [body['params']]
+    options = {}
+    if kind == 'simulate':
+        options = {'J': float(body['J']), 'width': float(body.get('width', 100e-9)), 't_stop': float(body.get('t_stop', 200e-9)),
+                   'dt': float(body.get('dt', 1e-11)), 'samples': int(body.get('samples', 0))}
+    queries = []
+    for params in params_list:
+        names = list(params.keys())
+        queries.append({'kind': kind, 'names': names, 'values': [float(params[name]) for name in names], 'options': dict(options)})
+    return queries, isinstance(body['params'], list)
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, code, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                with state['cache_lock']:
+                    stats = dict(state['stats'], cache_entries=len(state['cache']), uptime=time.time() - state['stats']['started'])
+                self.send_json(200, stats)
+            else:
+                self.send_json(404, {'error': f"Error: Unknown path {self.path}."})
+
+        def do_POST(self):
+            kind = self.path.strip('/')
+            if kind not in ('lookup', 'simulate'):
+                self.send_json(404, {'error': f"Error: Unknown path {self.path}."})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                queries, many = parse_queries(kind, body)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {'error': f"Error: Bad request: {e}"})
+                return
+            results = resolve(state, queries)
+            self.send_json(200, {'results': results} if many else results[0])
+
+    return Handler
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Many clients may connect at once
+
+def serve(home_folder, host = DEFAULT_HOST, port = DEFAULT_PORT, lookup_table_folder = '', error_tables_folder = '', batch_window = 0.002,
+          max_batch = 1024, cache_size = 100000, quantize_digits = 6, block = True, max_simulate_memory = 2.5e8):
+    state = new_state(home_folder, lookup_table_folder, error_tables_folder, batch_window, max_batch, cache_size, quantize_digits, max_simulate_memory)
+    threading.Thread(target=batcher, args=(state,), daemon=True).start()
+
+    server = Server((host, port), make_handler(state))
+    print(f"INFO: Serving {state['lookup_table_path']} on http://{host}:{server.server_address[1]}")
+    if not block:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"INFO: Stopped serving.")
+    finally:
+        state['queue'].put(None)
+        server.server_close()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves model parameter lookups and kinematic simulations on localhost.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Address to listen on")  # Optional argument
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")  # Optional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
+    parser.add_argument("--error_tables_folder", type=str, default='', help="Folder storing all_corners_error.csv")  # Optional argument
+    parser.add_argument("--batch_window", type=float, default=0.002, help="Seconds to gather concurrent requests into one batch")  # Optional argument
+    parser.add_argument("--max_batch", type=int, default=1024, help="Maximum queries per batch")  # Optional argument
+    parser.add_argument("--cache_size", type=int, default=100000, help="Number of results kept in the LRU cache")  # Optional argument
+    parser.add_argument("--quantize_digits", type=int, default=6, help="Significant digits of parameter values in cache keys")  # Optional argument
+    parser.add_argument("--max_simulate_memory", type=float, default=2.5e8, help="Bytes of simulation arrays per chunk of a batch")  # Optional argument
+
+    args = parser.parse_args()
+
+    serve(args.home_folder, args.host, args.port, args.lookup_table_folder, args.error_tables_folder, args.batch_window,
+          args.max_batch, args.cache_size, args.quantize_digits, max_simulate_memory=args.max_simulate_memory)
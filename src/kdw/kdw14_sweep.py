@@ -0,0 +1,239 @@
+import argparse
+import itertools
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from scipy.ndimage import gaussian_filter, uniform_filter1d
+from scipy.signal import savgol_filter
+import kdw.kdw1_extract as kdw1_extract
+import kdw.kdw2_analyze as kdw2_analyze
+import kdw.kdw3_fit as kdw3_fit
+import kdw.kdw4_evaluate as kdw4_evaluate
+import kdw.kdw15_store as kdw15_store
+from kdw.runtime.simulate import kinematic_model_batch
+
+# Sweep of the processing settings that are fixed in the file-based flow: the velocity derivative of kdw1_extract
+# (forward difference over n = 2 samples) and the smoothing of kdw2_analyze (gaussian_filter with sigma 25).  The
+# raw trajectories are loaded once into shared memory, and worker processes run the analyze -> fit -> evaluate
+# chain in memory for each setting, using the same marker, fit and error functions as kdw2, kdw3 and kdw4.
+#
+# Filters, with width sigma in samples:
+#   gaussian  gaussian_filter with standard deviation sigma (the kdw2_analyze default, sigma 25)
+#   uniform   moving average over 2 sigma + 1 samples
+#   savgol    cubic Savitzky-Golay filter over 2 sigma + 1 samples
+#   none      no smoothing (sigma is ignored)
+# Derivatives, with step n in samples:
+#   forward   (x[i] - x[i+n]) / (t[i] - t[i+n]) as in kdw1_extract (the default, n = 2)
+#   central   (x[i+n] - x[i-n]) / (t[i+n] - t[i-n])
+
+FILTERS = ('gaussian', 'uniform', 'savgol', 'none')
+DERIVATIVES = ('forward', 'central')
+ERROR_COLUMNS = ['rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
+
+_shared = {}  # Trajectories of a worker process, set by attach
+
+def sweep(home_folder, raw_data_folder = '', sweep_folder = '', filters = ('gaussian',), sigmas = (5, 10, 15, 25, 40, 60),
+          derivatives = (('forward', 1), ('forward', 2), ('central', 1), ('central', 2)), match_params = {}, workers = None):
+
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if not raw_data_folder:
+        raw_data_folder = os.path.join(home_folder, 'raw_data')
+    if not os.path.isdir(raw_data_folder):
+        raise FileNotFoundError(f"Error: The folder {raw_data_folder} does not exist.")
+
+    if not sweep_folder:
+        sweep_folder = os.path.join(home_folder, 'sweep_tables')
+    if not os.path.isdir(sweep_folder):
+        os.mkdir(sweep_folder)
+
+    for filter_name in filters:
+        if filter_name not in FILTERS:
+            raise ValueError(f"Error: Unknown filter {filter_name}.  Use one of {', '.join(FILTERS)}.")
+    for derivative, n in derivatives:
+        if derivative not in DERIVATIVES:
+            raise ValueError(f"Error: Unknown derivative {derivative}.  Use one of {', '.join(DERIVATIVES)}.")
+
+    settings = []
+    for filter_name, derivative in itertools.product(filters, derivatives):
+        for sigma in (sigmas if filter_name != 'none' else [0]):
+            settings.append({'filter': filter_name, 'sigma': float(sigma), 'derivative': derivative[0], 'n': int(derivative[1])})
+
+    sims, time, position = load_trajectories(raw_data_folder, match_params)
+    if not sims:
+        raise FileNotFoundError(f"Error: No simulations found in {raw_data_folder}.")
+    print(f"INFO: Sweeping {len(settings)} settings over {len(sims)} simulations.")
+
+    # One block of shared memory holds the time and position of every simulation back to back
+    offsets = np.concatenate([[0], np.cumsum([sim['samples'] for sim in sims])])
+    shm = shared_memory.SharedMemory(create=True, size=2 * offsets[-1] * 8)
+    data = np.ndarray((2, offsets[-1]), dtype=np.float64, buffer=shm.buf)
+    try:
+        data[0] = time
+        data[1] = position
+        groups = time_groups(data[0], offsets)
+
+        if workers == 1:
+            share(data, offsets, sims, groups)
+            results = [evaluate_setting(setting) for setting in settings]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(shm.name, offsets, sims, groups)) as executor:
+                results = list(executor.map(evaluate_setting, settings))
+    finally:
+        _shared.clear()
+        del data
+        shm.close()
+        shm.unlink()
+
+    # A setting whose markers or fits fail drops those simulations from its mean, so fewer failures rank first
+    results = pd.DataFrame(results).sort_values(['failed_sims', 'err_mean'], kind='stable').reset_index(drop=True)
+    results.to_csv(os.path.join(sweep_folder, 'sweep_results.csv'), index=False)
+    print(f"INFO: Wrote {os.path.join(sweep_folder, 'sweep_results.csv')}")
+    if results['failed_sims'].iloc[0] > 0:
+        print(f"WARNING: Every setting fails on some simulations.  The best setting fails on {results['failed_sims'].iloc[0]} of {len(sims)}, which its errors leave out.")
+    return results
+
+# Time and DW position of every simulation in raw_data_folder, concatenated, and the J, RT and corner of each
+def load_trajectories(raw_data_folder, match_params = {}):
+    sims = []
+    times = []
+    positions = []
+    for mat_file in sorted(f for f in os.listdir(raw_data_folder) if f.endswith('.mat')):
+        base_name = os.path.splitext(mat_file)[0]
+        params = {}
+        for param_string in base_name.split('_'):
+            match = re.match(r'^(.+)=(.+)$', param_string)
+            if match:
+                params[match.group(1)] = match.group(2)
+        if any(params.get(match_param) != match_value for match_param, match_value in match_params.items()):
+            continue
+        if 'J' not in params or 'RT' not in params:
+            print(f"ERROR: No parameter 'J' or 'RT' found in filename of {base_name}. Skipping.")
+            continue
+        J = float(params.pop('J'))
+        RT = float(params.pop('RT'))
+
+        mat_data = kdw15_store.load(os.path.join(raw_data_folder, mat_file))
+        times.append(mat_data['time'])
+        positions.append(mat_data['dwPosition'])
+        sims.append({'name': base_name, 'corner': kdw4_evaluate.corner_string(params), 'J': J, 'RT': RT, 'samples': len(times[-1])})
+    if not sims:
+        return sims, np.empty(0), np.empty(0)
+    return sims, np.concatenate(times), np.concatenate(positions)
+
+# Lists of simulations sharing the same time axis, which are simulated together
+def time_groups(time, offsets):
+    groups = {}
+    for i in range(len(offsets) - 1):
+        key = time[offsets[i]:offsets[i+1]].tobytes()
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+def share(data, offsets, sims, groups):
+    _shared.update({'time': data[0], 'position': data[1], 'offsets': offsets, 'sims': sims, 'groups': groups})
+
+# Worker process initializer: maps the trajectories in shared memory without copying them
+def attach(shm_name, offsets, sims, groups):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _shared['shm'] = shm  # Kept open for the life of the worker
+    share(np.ndarray((2, offsets[-1]), dtype=np.float64, buffer=shm.buf), offsets, sims, groups)
+
+def derivative_velocity(time, position, derivative, n):
+    if derivative == 'forward':
+        return kdw1_extract.difference_velocity(time, position, n)
+    velocity = np.empty_like(position)
+    velocity[n:-n] = (position[2*n:] - position[:-2*n]) / (time[2*n:] - time[:-2*n])
+    velocity[:n] = velocity[n]
+    velocity[-n:] = velocity[-n-1]
+    return velocity
+
+def smooth(velocity, filter_name, sigma):
+    width = 2 * int(round(sigma)) + 1
+    if filter_name == 'gaussian':
+        return gaussian_filter(velocity, sigma)
+    if filter_name == 'uniform':
+        return uniform_filter1d(velocity, width)
+    if filter_name == 'savgol':
+        return savgol_filter(velocity, width, 3)
+    return velocity
+
+# Runs analyze -> fit -> evaluate for one setting and returns its mean errors over all simulations
+def evaluate_setting(setting):
+    time, position, offsets, sims = _shared['time'], _shared['position'], _shared['offsets'], _shared['sims']
+
+    # Analyze: markers of each simulation with this derivative and smoothing
+    smooth_vels = {}
+    current_ends = {}
+    tables = {}
+    for i, sim in enumerate(sims):
+        t = time[offsets[i]:offsets[i+1]]
+        x = position[offsets[i]:offsets[i+1]]
+        velocity = derivative_velocity(t, x, setting['derivative'], setting['n'])
+        negate = -1 if (sum(velocity) < 0) else 1
+        smooth_vels[i] = smooth(velocity, setting['filter'], setting['sigma'])
+        current_ends[i] = int(np.argmax(t > sim['RT'])) if t[-1] > sim['RT'] else -1
+        try:
+            markers = kdw2_analyze.markers(t, x, smooth_vels[i], current_ends[i], negate)
+        except IndexError:  # Velocity never settles within 1/e of its peak
+            continue
+        tables.setdefault(sim['corner'], []).append([sim['J'], *markers])
+
+    # Fit: model constants of each corner
+    constants = {}
+    for corner, table in tables.items():
+        table = np.array(table)
+        table = table[table[:, 0].argsort()]  # Sort by J values
+        try:
+            constants[corner] = kdw3_fit.fit_corner(table[:, 0], table[:, 1], table[:, 2], table[:, 3])
+        except (RuntimeError, ValueError, np.linalg.LinAlgError):
+            pass
+
+    # Evaluate: model errors of each simulation, batched over simulations sharing a time axis
+    errors = []
+    for group in _shared['groups']:
+        group = [i for i in group if sims[i]['corner'] in constants]
+        if not group:
+            continue
+        t = time[offsets[group[0]]:offsets[group[0]+1]]
+        current = np.array([np.where(t <= sims[i]['RT'], sims[i]['J'], 0.0) for i in group])
+        model = [[constants[sims[i]['corner']][k] for i in group] for k in ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']]
+        x_model, v_model, _ = kinematic_model_batch(*model, t, current)
+        for row, i in enumerate(group):
+            errors.append(kdw4_evaluate.model_errors(x_model[row], v_model[row], position[offsets[i]:offsets[i+1]], smooth_vels[i], current_ends[i]))
+
+    result = dict(setting)
+    for column in ERROR_COLUMNS:
+        result[column] = np.mean([error[column] for error in errors]) if errors else np.inf
+    result['err_mean_max'] = max(error['err_mean'] for error in errors) if errors else np.inf
+    result['failed_sims'] = len(sims) - len(errors)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweeps the smoothing and derivative settings of the flow for the lowest model error.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--raw_data_folder", type=str, default='', help="The directory storing the time-resolved DW motion data")  # Optional argument
+    parser.add_argument("--sweep_folder", type=str, default='', help="The directory to store sweep_results.csv")  # Optional argument
+    parser.add_argument("--filters", type=str, default=['gaussian'], nargs='+', choices=FILTERS, help="Smoothing filters")  # Optional argument
+    parser.add_argument("--sigmas", type=float, default=[5, 10, 15, 25, 40, 60], nargs='+', help="Filter widths in samples")  # Optional argument
+    parser.add_argument("--derivatives", type=str, default=['forward', '1', 'forward', '2', 'central', '1', 'central', '2'], nargs='+',
+                        help="Derivative schemes and steps like: forward 2 central 1")  # Optional argument
+    parser.add_argument("--match_params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")  # Optional argument
+
+    args = parser.parse_args()
+
+    derivatives = []
+    for i in range (0, len(args.derivatives), 2):
+        derivatives.append((args.derivatives[i], int(args.derivatives[i+1])))
+    match_params = {}
+    for i in range (0, len(args.match_params), 2):
+        match_params[args.match_params[i]] = args.match_params[i+1]
+
+    results = sweep(args.home_folder, args.raw_data_folder, args.sweep_folder, args.filters, args.sigmas, derivatives, match_params, args.workers)
+    print(results.head(10).to_string(index=False))
+    best = results.iloc[0]
+    print(f"Lowest err_mean {best['err_mean']:.4g} ({best['failed_sims']} failed simulations) with {best['filter']} filter, sigma {best['sigma']:g}, {best['derivative']} derivative, n {best['n']}")
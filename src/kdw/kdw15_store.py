@@ -0,0 +1,243 @@
+import argparse
+import os
+import numpy as np
+import scipy.io as sio
+
+# Storage of DW trajectories (time, dwPosition, dwVelocity) in .mat files.  'full' writes float64 arrays as the
+# flow always has.  The compact storages write a uniform time axis as its start, step and length, and the other
+# fields as:
+#   float32  single precision floats, with an error of at most 2^-24 (6e-8) of each value
+#   int16    16 bit integers scaled to the range of the field, with an error of at most (max - min) / 65535 / 2
+#            of the field, e.g. 0.05 nm for a 3 um DW track.  Fields whose steps fit 8 bits are delta encoded,
+#            which halves them; with compress, also those whose steps fit 16 bits, which zlib then packs better.
+#            Only finite values are quantized; NaN and inf samples are stored apart as [field]_nonfinite and
+#            their indices, and restored exactly.
+# A time axis is stored as uniform only if no sample is more than TIME_TOLERANCE time steps from it; otherwise it
+# is kept as float64.  With compress, compact files are also zlib compressed, which halves them again but makes
+# loading several times slower, so it only pays where reading the file costs more than decompressing it (e.g. a
+# network file system).  The largest error of each field is stored with it as max_error_[field].  load returns
+# float64 arrays whatever the storage.
+#
+# lttb decimates a trace to a few thousand points that keep its visual shape, for plotting.  Compact files also
+# hold such a preview of each field as [field]_preview, which load_preview reads without reading the full arrays,
+# so a stored trajectory is loaded for plotting in a fraction of the time load takes.
+
+STORAGES = ('full', 'float32', 'int16')
+TIME_TOLERANCE = 1e-6
+PLOT_POINTS = 2000
+INT_LEVELS = 65535
+
+def save(path, time, fields, storage = 'full', compress = False):
+    if storage not in STORAGES:
+        raise ValueError(f"Error: Unknown storage {storage}.  Use one of {', '.join(STORAGES)}.")
+    if storage == 'full':
+        sio.savemat(path, dict({"time": time}, **fields))
+        return
+
+    time = np.asarray(time, dtype=float)
+    data = {'storage': storage}
+    data.update(encode_time(time))
+    for name, values in fields.items():
+        values = np.asarray(values, dtype=float)
+        data.update(encode_field(name, values, storage, compress))
+        data[f"{name}_preview"] = np.vstack(preview(time, values))
+    sio.savemat(path, data, do_compression=compress)
+
+def load(path):
+    mat_data = sio.loadmat(path)
+    if 'storage' not in mat_data:
+        return {name: values[0] for name, values in mat_data.items() if not name.startswith('__')}
+
+    trajectory = {'time': decode_time(mat_data)}
+    for name in mat_data:
+        if name.startswith('max_error_') and name != 'max_error_time':
+            trajectory[name[len('max_error_'):]] = decode_field(mat_data, name[len('max_error_'):])
+    return trajectory
+
+# (time, values) of each field decimated for plotting, read from the previews of a compact file, or else
+# decimated from the full arrays
+def load_preview(path, points = PLOT_POINTS):
+    names = [name for name, _, _ in sio.whosmat(path)]
+    if 'storage' in names:
+        mat_data = sio.loadmat(path, variable_names=[name for name in names if name.endswith('_preview')])
+        return {name[:-len('_preview')]: (values[0], values[1]) for name, values in mat_data.items() if not name.startswith('__')}
+    trajectory = load(path)
+    return {name: preview(trajectory['time'], values, points) for name, values in trajectory.items() if name != 'time'}
+
+# values and their times decimated with lttb over the finite samples
+def preview(time, values, points = PLOT_POINTS):
+    finite = np.flatnonzero(np.isfinite(values) & np.isfinite(time))
+    keep = finite[lttb(time[finite], values[finite], points)]
+    return time[keep], values[keep]
+
+def encode_time(time):
+    n = len(time)
+    if n > 1:
+        dt = (time[-1] - time[0]) / (n - 1)
+        uniform = time[0] + dt * np.arange(n)
+        error = np.max(np.abs(uniform - time))
+        if dt > 0 and error <= TIME_TOLERANCE * dt:
+            return {'time_start': time[0], 'time_step': dt, 'time_samples': n, 'max_error_time': error}
+    return {'time': time, 'max_error_time': 0.0}
+
+def decode_time(mat_data):
+    if 'time' in mat_data:
+        return mat_data['time'][0]
+    time = np.arange(int(mat_data['time_samples'][0, 0]), dtype=float)
+    time *= mat_data['time_step'][0, 0]
+    time += mat_data['time_start'][0, 0]
+    return time
+
+def encode_field(name, values, storage, compress = False):
+    if storage == 'float32':
+        encoded = values.astype(np.float32)
+        with np.errstate(invalid='ignore'):  # inf - inf of non-finite samples, which are kept exactly
+            return {name: encoded, f"max_error_{name}": np.max(np.abs(encoded - values)[np.isfinite(values)], initial=0)}
+
+    # Non-finite samples are kept apart and filled in by interpolation, so they do not break up the deltas
+    data = {}
+    finite = np.isfinite(values)
+    if not finite.all():
+        nonfinite = np.flatnonzero(~finite)
+        data[f"{name}_nonfinite_index"] = nonfinite.astype(np.uint32 if len(values) < 2**32 else np.uint64)
+        data[f"{name}_nonfinite"] = values[nonfinite]
+        values = values.copy()
+        values[nonfinite] = np.interp(nonfinite, np.flatnonzero(finite), values[finite]) if finite.any() else 0.0
+
+    offset = np.min(values)
+    scale = (np.max(values) - offset) / INT_LEVELS
+    if scale == 0:
+        scale = 1.0
+    q = np.round((values - offset) / scale).astype(np.int64)
+    delta = np.diff(q)
+    decoded = offset + scale * q
+    data.update({f"{name}_offset": offset, f"{name}_scale": scale, f"max_error_{name}": np.max(np.abs(decoded - values)[finite], initial=0)})
+
+    # Deltas of a smooth trace are small, so most fit in 8 bits.  Undoing them is a sequential cumsum, so they are
+    # only kept where they make the file smaller
+    dtype = np.result_type(np.min_scalar_type(int(delta.min(initial=0))), np.min_scalar_type(int(delta.max(initial=0))), np.int8)
+    if dtype.itemsize > (2 if compress else 1):
+        data[f"{name}_levels"] = q.astype(np.uint16)
+    else:
+        data[f"{name}_first"] = int(q[0])
+        data[f"{name}_delta"] = delta.astype(dtype)
+    return data
+
+def decode_field(mat_data, name):
+    if name in mat_data:
+        return mat_data[name][0].astype(float)
+    # Levels are exact in float64, so they are decoded in place without int64 temporaries
+    if f"{name}_levels" in mat_data:
+        values = mat_data[f"{name}_levels"][0].astype(float)
+    else:
+        delta = mat_data[f"{name}_delta"][0]
+        values = np.empty(len(delta) + 1)
+        values[0] = mat_data[f"{name}_first"][0, 0]
+        np.cumsum(delta, dtype=float, out=values[1:])
+        values[1:] += values[0]
+    values *= mat_data[f"{name}_scale"][0, 0]
+    values += mat_data[f"{name}_offset"][0, 0]
+    if f"{name}_nonfinite_index" in mat_data:
+        values[mat_data[f"{name}_nonfinite_index"][0]] = mat_data[f"{name}_nonfinite"][0]
+    return values
+
+# Indices of points of the trace y(x) picked by largest-triangle-three-buckets: the first and last points, and
+# from each of points - 2 equal buckets in between the point forming the largest triangle with the point picked
+# from the previous bucket and the mean of the next bucket
+def lttb(x, y, points = PLOT_POINTS):
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n-1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:n-1], edges[:-1] - 1) / counts
+    mean_x = np.append(mean_x[1:], x[n-1])  # Mean of the bucket after each bucket, the last point after the last
+    mean_y = np.append(mean_y[1:], y[n-1])
+
+    keep = np.empty(points, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i+1]
+        area = np.abs((x[a] - mean_x[i]) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (mean_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i+1] = a
+    return keep
+
+# x and y decimated with lttb, for plotting
+def decimate(x, y, points = PLOT_POINTS):
+    keep = lttb(x, y, points)
+    return x[keep], y[keep]
+
+# Rewrites every trajectory .mat file of folder with the given storage, and reports the sizes and largest errors
+def convert(folder, storage, out_folder = '', compress = False):
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"Error: The folder {folder} does not exist.")
+    if not out_folder:
+        out_folder = folder
+    if not os.path.isdir(out_folder):
+        os.mkdir(out_folder)
+
+    size_before = 0
+    size_after = 0
+    max_errors = {}
+    for mat_file in sorted(f for f in os.listdir(folder) if f.endswith('.mat')):
+        path = os.path.join(folder, mat_file)
+        trajectory = load(path)
+        if 'time' not in trajectory:
+            print(f"WARNING: {mat_file} is not a trajectory. Skipping.")
+            continue
+        size_before += os.path.getsize(path)
+        out_path = os.path.join(out_folder, mat_file)
+        save(out_path, trajectory['time'], {name: values for name, values in trajectory.items() if name != 'time'}, storage, compress)
+        size_after += os.path.getsize(out_path)
+
+        converted = load(out_path)
+        for name, values in trajectory.items():
+            finite = np.isfinite(values)
+            if not np.array_equal(np.isfinite(converted[name]), finite):
+                raise ValueError(f"Error: The non-finite samples of {name} in {mat_file} were not kept.")
+            max_errors[name] = max(max_errors.get(name, 0), float(np.max(np.abs(converted[name] - values)[finite], initial=0)))
+
+    print(f"INFO: {size_before / 1e6:.2f} MB -> {size_after / 1e6:.2f} MB")
+    for name, error in max_errors.items():
+        print(f"INFO: Largest error of {name}: {error:.3g}")
+    return max_errors
+
+# Plots the preview of each field of every trajectory .mat file of folder to img_folder
+def plot_previews(folder, img_folder):
+    import matplotlib.pyplot as plt  # Only needed for plotting
+
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"Error: The folder {folder} does not exist.")
+    if not os.path.isdir(img_folder):
+        os.mkdir(img_folder)
+
+    for mat_file in sorted(f for f in os.listdir(folder) if f.endswith('.mat')):
+        previews = load_preview(os.path.join(folder, mat_file))
+        fig, axes = plt.subplots(len(previews), 1, sharex=True, squeeze=False)
+        for ax, (name, (time, values)) in zip(axes[:, 0], previews.items()):
+            ax.plot(time * 1e9, values, '-')
+            ax.set_ylabel(name)
+        axes[-1, 0].set_xlabel('Time (ns)')
+        fig.tight_layout()
+        fig.savefig(os.path.join(img_folder, f"{os.path.splitext(mat_file)[0]}.png"))
+        plt.close(fig)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts DW trajectory .mat files to full or compact storage.")
+    parser.add_argument("folder", type=str, help="The directory of trajectory .mat files, e.g. raw_data or smoothed_data")  # Positional argument
+    parser.add_argument("--storage", type=str, default='int16', choices=STORAGES, help="Storage to convert to")  # Optional argument
+    parser.add_argument("--out_folder", type=str, default='', help="The directory to write to, by default the folder itself")  # Optional argument
+    parser.add_argument("--compress", action='store_true', help="Also zlib compress compact files, for smaller but slower to load files")  # Optional argument
+    parser.add_argument("--plot_folder", type=str, default='', help="Plot the previews of the files to this directory instead of converting them")  # Optional argument
+
+    args = parser.parse_args()
+
+    if args.plot_folder:
+        plot_previews(args.folder, args.plot_folder)
+    else:
+        convert(args.folder, args.storage, args.out_folder, args.compress)
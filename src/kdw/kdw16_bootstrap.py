@@ -0,0 +1,130 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+
+# Bootstrap confidence intervals of the kinematic model constants of each parameter corner.  The rows of a
+# corner's marker table are resampled with replacement, and every replicate is refit at once with the closed
+# form of the kdw3_fit.fit_corner fits: weighted least squares for the cubic max_vel fit and the drift fit, and
+# least squares for d1.  Replicates with fewer than 4 distinct J values cannot be fit with a cubic and are
+# dropped.  Corners are spread across processes.  Percentile intervals are written to lookup_all_ci.csv next
+# to lookup_all.csv, in the same row order, and kdw6_lookup propagates them through interpolation.
+
+PARAM_COLUMNS = ['Aex', 'Ku', 'B_anis', 'A', 'Msat', 'W']
+MODEL_CONSTANTS = ['c0', 'c1', 'c2', 'c3', 'd0', 'd1', 'k0', 'k1', 'k2', 'k3', 'k4']
+
+def bootstrap(home_folder, marker_folder = '', lookup_table_folder = '', replicates = 2000, confidence = 0.95, workers = None, seed = 0):
+
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist. Please specify a new folder.")
+
+    if not marker_folder:
+        marker_folder = os.path.join(home_folder, 'marker_tables')
+    if not os.path.isdir(marker_folder):
+        raise FileNotFoundError(f"Error: The folder {marker_folder} does not exist. Please specify a new folder.")
+
+    if not lookup_table_folder:
+        lookup_table_folder = os.path.join(home_folder, 'lookup_tables')
+    if not os.path.isdir(lookup_table_folder):
+        os.mkdir(lookup_table_folder)
+
+    if not 0 < confidence < 1:
+        raise ValueError(f"Error: The confidence {confidence} must be between 0 and 1.")
+
+    # Same corners in the same order as kdw3_fit
+    mat_files = sorted(f for f in os.listdir(marker_folder) if f.endswith('.mat'))
+    tasks = []
+    param_list = []
+    for index, file_name in enumerate(mat_files):
+        data_table = sio.loadmat(os.path.join(marker_folder, file_name))['dataTable']
+        base_name, _ = os.path.splitext(file_name)
+
+        Aex_s = float(base_name.split('_Aex=')[1].split('_')[0])
+        Ku_s = float(base_name.split('_Ku=')[1].split('_')[0])
+        A_s = float(base_name.split('_A=')[1].split('_')[0])
+        Msat_s = float(base_name.split('_Msat=')[1].split('_')[0])
+        W_s = float(base_name.split('_W=')[1].split('_')[0])
+
+        B_anis_s = (Ku_s / (0.5 * Msat_s) - (4 * np.pi * 1e-7) * Msat_s)
+        param_list.append([Aex_s, Ku_s, B_anis_s, A_s, Msat_s, W_s])
+        tasks.append((data_table, replicates, confidence, (seed, index)))
+
+    if workers == 1:
+        intervals = [bootstrap_corner(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            intervals = list(executor.map(bootstrap_corner, tasks))
+
+    df = pd.DataFrame(param_list, columns=PARAM_COLUMNS)
+    df = pd.concat([df, pd.DataFrame(intervals)], axis=1)
+    ci_path = os.path.join(lookup_table_folder, 'lookup_all_ci.csv')
+    df.to_csv(ci_path, index=False)
+    print(f"INFO: Wrote {int(confidence * 100)}% intervals of {len(df)} corners from {replicates} replicates to {ci_path}")
+    return df
+
+# Percentile interval and standard deviation of each constant of one corner over its bootstrap replicates
+def bootstrap_corner(task):
+    data_table, replicates, confidence, seed = task
+    rng = np.random.default_rng(seed)
+    n = len(data_table)
+    samples = data_table[rng.integers(0, n, (replicates, n))]
+
+    # Sorted by J as in the marker tables, so J[0] is the smallest J of the replicate as in fit_corner
+    samples = np.take_along_axis(samples, np.argsort(samples[:, :, 0], axis=1)[:, :, None], axis=1)
+    distinct = 1 + np.count_nonzero(np.diff(samples[:, :, 0], axis=1), axis=1)
+    samples = samples[distinct >= 4]
+
+    constants = fit_corner_batch(samples[:, :, 0], samples[:, :, 1], samples[:, :, 2], samples[:, :, 3])
+    tail = 100 * (1 - confidence) / 2
+    result = {}
+    for name in MODEL_CONSTANTS:
+        result[f"{name}_lo"], result[f"{name}_hi"] = np.percentile(constants[name], [tail, 100 - tail]) if len(samples) else (np.nan, np.nan)
+        result[f"{name}_std"] = np.std(constants[name], ddof=1) if len(samples) > 1 else np.nan
+    result['replicates'] = len(samples)
+    return result
+
+# kdw3_fit.fit_corner for a stack of marker tables, each row of the arrays being one table sorted by J
+def fit_corner_batch(J, max_vel, time_constant, drift_dist):
+    # Cubic fit of max_vel over J / J[0], weighted by 1 / max_vel^2 as curve_fit with sigma=max_vel^2
+    J_scale = J[:, :1]
+    J_fit = J / J_scale
+    weights = max_vel ** 2
+    X = np.stack([J_fit**3, J_fit**2, J_fit, np.ones_like(J_fit)], axis=2) / weights[:, :, None]
+    q, r = np.linalg.qr(X)
+    cubic_params = np.linalg.solve(r, np.einsum('bni,bn->bi', q, max_vel / weights)[:, :, None])[:, :, 0]
+
+    J_scale = J_scale[:, 0]
+    c3 = cubic_params[:, 0] / (J_scale ** 3)
+    c2 = cubic_params[:, 1] / (J_scale ** 2)
+    c1 = cubic_params[:, 2] / J_scale
+    c0 = cubic_params[:, 3]
+
+    # Linear drift fit through the origin with sigma=drift_dist
+    drift_params = np.sum(max_vel * drift_dist / drift_dist**2, axis=1) / np.sum(max_vel**2 / drift_dist**2, axis=1)
+    d0 = 1 / drift_params
+
+    time_inv = 1/time_constant - d0[:, None]
+    d1 = np.sum(J * time_inv, axis=1) / np.sum(J * J, axis=1)
+
+    k0 = d0 * c0
+    k1 = d0 * c1 + d1 * c0
+    k2 = d0 * c2 + d1 * c1
+    k3 = d0 * c3 + d1 * c2
+    k4 = d1 * c3
+
+    return {'c0': c0, 'c1': c1, 'c2': c2, 'c3': c3, 'd0': d0, 'd1': d1, 'k0': k0, 'k1': k1, 'k2': k2, 'k3': k3, 'k4': k4}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstraps confidence intervals of the kinematic model constants of each parameter corner.")
+    parser.add_argument("home_folder", type=str, help="The master directory.")  # Positional argument
+    parser.add_argument("--marker_folder", type=str, default='', help="The directory storing the extracted max_vel and drift constants")  # Optional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="The directory of the model lookup table")  # Optional argument
+    parser.add_argument("--replicates", type=int, default=2000, help="Bootstrap replicates per corner")  # Optional argument
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")  # Optional argument
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")  # Optional argument
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")  # Optional argument
+
+    args = parser.parse_args()
+    bootstrap(args.home_folder, args.marker_folder, args.lookup_table_folder, args.replicates, args.confidence, args.workers, args.seed)
@@ -0,0 +1,211 @@
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import ConvexHull, Delaunay
+from scipy.stats import qmc
+import kdw.kdw9_inverse as kdw9_inverse
+import kdw.runtime.lookup as runtime_lookup
+
+# Sobol global sensitivity of the DW response to a current pulse over the material parameters of the lookup
+# table.  Saltelli sampling: two quasi-random matrices A and B of N rows and, for each parameter i, A with its
+# column i taken from B, so N (d + 2) model evaluations for d parameters.  First-order indices use the Saltelli
+# (2010) estimator and total indices the Jansen estimator, with bootstrap confidence intervals over the rows.
+#
+# The parameters are sampled uniformly over the convex hull of lookup_all.csv.  Where the hull is not a box
+# (e.g. Ku is only simulated at some Ku, Msat pairs), one conditional parameter is sampled uniformly within
+# its range in the hull given the others, so its index is that of its position within that range.  By default
+# the conditional parameter is the one that keeps the most samples inside the hull.
+#
+# Each evaluation interpolates the model constants as kdw6_lookup does and applies the closed-form pulse response
+# of kdw9_inverse, which solves the kinematic model exactly for a rectangular pulse.  Outputs:
+#   final_position  resting position of the DW after the pulse
+#   switching_time  time at which the DW has moved switch_distance, censored at max_time (10 pulse widths by
+#                   default) where it does so later or never
+#   switched        1 if the DW has moved switch_distance by max_time, else 0
+# Every output stays defined for every row, so the A, B and AB_i rows of a sample keep the Saltelli structure.
+# Only samples whose parameters fall outside the hull (an empty conditional range) are dropped, as whole A, B,
+# AB_1 .. AB_d groups and for every output alike, since that depends on the parameters and not on the response.
+# The rows are split into chunks that are evaluated in parallel processes.
+
+PARAM_NAMES = ['Aex', 'Ku', 'A', 'Msat', 'W']
+OUTPUTS = ['final_position', 'switching_time', 'switched']
+
+_model = {}  # Interpolator of a worker process, set by load_model
+
+def sensitivity(home_folder, lookup_table_folder = '', sensitivity_folder = '', J = 4e11, width = 100e-9, switch_distance = 1e-6, max_time = None,
+                samples = 2**14, param_names = PARAM_NAMES, conditional = None, chunk_size = 8192, workers = None, resamples = 200, seed = 0):
+
+    lookup_table_path, _ = runtime_lookup.table_paths(home_folder, lookup_table_folder)
+    if max_time is None:
+        max_time = 10 * width
+
+    if not sensitivity_folder:
+        sensitivity_folder = os.path.join(home_folder, 'sensitivity_tables')
+    if not os.path.isdir(sensitivity_folder):
+        os.mkdir(sensitivity_folder)
+
+    table = runtime_lookup.read_table(lookup_table_path)
+    points = np.column_stack([table[param] for param in param_names])
+    space = parameter_space(points)
+    if conditional is None:
+        conditional = choose_conditional(space, param_names, seed)
+    elif conditional and conditional not in param_names:
+        raise ValueError(f"Error: The conditional parameter {conditional} is not one of {', '.join(param_names)}.")
+    if conditional:
+        print(f"INFO: Sampling {conditional} within its range in the lookup table hull given the other parameters.")
+
+    # Quasi-random A and B, rounded up to a power of 2 rows
+    d = len(param_names)
+    m = max(int(math.ceil(math.log2(samples))), 1)
+    AB = qmc.Sobol(d=2 * d, scramble=True, seed=seed).random_base2(m)
+    A, B = AB[:, :d], AB[:, d:]
+    n = len(A)
+    print(f"INFO: {n * (d + 2)} model evaluations in chunks of {chunk_size} rows.")
+
+    c = param_names.index(conditional) if conditional else -1
+    tasks = [(A[start:start + chunk_size], B[start:start + chunk_size], space, c, J, width, switch_distance, max_time)
+             for start in range(0, n, chunk_size)]
+    init_args = (points, np.column_stack([table[k] for k in runtime_lookup.INTERP_PARAM_NAMES]))
+    if workers == 1:
+        load_model(*init_args)
+        chunks = [evaluate_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_model, initargs=init_args) as executor:
+            chunks = list(executor.map(evaluate_chunk, tasks))
+
+    # Samples with any evaluation outside the hull are dropped as whole groups, the same for every output
+    outputs = {output: np.concatenate([chunk[output] for chunk in chunks], axis=1) for output in OUTPUTS}  # (d + 2, n): A, B, AB_1 .. AB_d
+    valid = np.all([np.all(np.isfinite(Y), axis=0) for Y in outputs.values()], axis=0)
+    if not valid.all():
+        print(f"WARNING: Dropped {np.count_nonzero(~valid)} of {n} samples with parameters outside the lookup table hull.")
+    if np.count_nonzero(valid) < 2:
+        raise ValueError(f"Error: Too few samples inside the lookup table hull to estimate the indices.")
+    censored = np.count_nonzero(outputs['switched'][:, valid] == 0)
+    if censored:
+        print(f"INFO: {censored} of {outputs['switched'][:, valid].size} evaluations did not switch within {max_time:g} s; their switching_time is {max_time:g} s.")
+
+    rows = []
+    rng = np.random.default_rng(seed)
+    for output in OUTPUTS:
+        Y = outputs[output][:, valid]
+        S1, ST = sobol_indices(Y)
+        if np.isnan(S1).all():
+            print(f"WARNING: {output} is {Y[0, 0]:g} for every sample of A and B, so its indices are undefined.")
+            S1_conf, ST_conf = S1, ST
+        else:
+            boot = np.array([sobol_indices(Y[:, rng.integers(0, Y.shape[1], Y.shape[1])]) for _ in range(resamples)])  # (resamples, 2, d)
+            S1_conf, ST_conf = 1.96 * np.nanstd(boot, axis=0)
+        for i, param in enumerate(param_names):
+            rows.append({'output': output, 'param': param, 'S1': S1[i], 'S1_conf': S1_conf[i], 'ST': ST[i], 'ST_conf': ST_conf[i], 'rows': Y.shape[1]})
+
+    indices = pd.DataFrame(rows)
+    indices_path = os.path.join(sensitivity_folder, 'sobol_indices.csv')
+    indices.to_csv(indices_path, index=False)
+    print(f"INFO: Wrote {indices_path}")
+    return indices
+
+# First-order and total indices of each parameter from the outputs of A, B and AB_1 .. AB_d, the rows of Y.
+# Both are nan if the output does not vary over A and B.
+def sobol_indices(Y):
+    f_A, f_B, f_AB = Y[0], Y[1], Y[2:]
+    variance = np.var(np.concatenate([f_A, f_B]))
+    if np.ptp(np.concatenate([f_A, f_B])) == 0:
+        return np.full(len(f_AB), np.nan), np.full(len(f_AB), np.nan)
+    S1 = np.mean(f_B * (f_AB - f_A), axis=1) / variance
+    ST = 0.5 * np.mean((f_A - f_AB) ** 2, axis=1) / variance
+    return S1, ST
+
+# Box and facets of the convex hull of the lookup table points, in coordinates scaled to the box
+def parameter_space(points):
+    lo = points.min(axis=0)
+    scale = np.ptp(points, axis=0)
+    scale[~(scale > 0)] = 1.0
+    hull = ConvexHull((points - lo) / scale)
+    return {'lo': lo, 'scale': scale, 'normals': hull.equations[:, :-1], 'offsets': hull.equations[:, -1]}
+
+# Parameter values for unit-cube samples u.  The conditional parameter c (if c >= 0) is placed within its range
+# in the hull given the others; samples where that range is empty are nan.  Samples are kept a hair inside the
+# hull so that they interpolate.
+def to_params(u, space, c = -1, margin = 1e-9):
+    u = margin + (1 - 2 * margin) * u
+    x = u.copy()
+    if c >= 0:
+        # Each facet n.x + b <= 0 bounds x_c given the other parameters
+        rest = space['offsets'][None, :] + (x @ space['normals'].T) - x[:, c:c+1] * space['normals'][None, :, c]
+        normal = space['normals'][:, c]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bound = -rest / normal
+        lower = np.max(np.where(normal < -1e-12, bound, 0.0), axis=1, initial=0.0)
+        upper = np.min(np.where(normal > 1e-12, bound, 1.0), axis=1, initial=1.0)
+        parallel = np.any((np.abs(normal) <= 1e-12) & (rest > 1e-12), axis=1)
+        empty = (upper < lower) | parallel
+        x[:, c] = lower + u[:, c] * (upper - lower)
+        x[empty] = np.nan
+    return space['lo'] + x * space['scale']
+
+def inside_hull(x, space, tol = 1e-12):
+    scaled = (x - space['lo']) / space['scale']
+    return np.all(scaled @ space['normals'].T + space['offsets'] <= tol, axis=1)
+
+# Parameter whose conditional sampling keeps the most samples inside the hull, or '' if plain sampling does
+def choose_conditional(space, param_names, seed = 0, samples = 4096):
+    u = np.random.default_rng(seed).uniform(size=(samples, len(param_names)))
+    best, best_inside = '', np.count_nonzero(inside_hull(to_params(u, space), space))
+    for c, param in enumerate(param_names):
+        x = to_params(u, space, c)
+        inside = np.count_nonzero(inside_hull(x[~np.isnan(x).any(axis=1)], space))
+        if inside > best_inside:
+            best, best_inside = param, inside
+    return best
+
+def load_model(points, values):
+    offset = np.mean(points, axis=0)
+    scale = np.ptp(points, axis=0)
+    scale[~(scale > 0)] = 1.0
+    _model.update({'offset': offset, 'scale': scale, 'interpolator': LinearNDInterpolator(Delaunay((points - offset) / scale), values)})
+
+# Outputs of the A, B and AB_i rows of one chunk
+def evaluate_chunk(task):
+    A, B, space, c, J, width, switch_distance, max_time = task
+    d = A.shape[1]
+    u = np.stack([A, B] + [np.where(np.arange(d) == i, B, A) for i in range(d)])  # (d + 2, rows, d)
+    x = to_params(u.reshape(-1, d), space, c)
+
+    constants = _model['interpolator']((x - _model['offset']) / _model['scale'])
+    model_params = runtime_lookup.quartic_constants({k: constants[:, j] for j, k in enumerate(runtime_lookup.INTERP_PARAM_NAMES)})
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        final_position = kdw9_inverse.final_position(model_params, J, width)
+        x_target = np.where(final_position < 0, -1.0, 1.0) * switch_distance
+        switching_time = kdw9_inverse.arrival_time(model_params, J, width, np.nan_to_num(x_target))
+    switched = np.where(np.isnan(final_position), np.nan, switching_time <= max_time)
+    switching_time = np.where(np.isnan(final_position), np.nan, np.minimum(switching_time, max_time))
+    return {'final_position': final_position.reshape(d + 2, -1), 'switching_time': switching_time.reshape(d + 2, -1),
+            'switched': switched.reshape(d + 2, -1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sobol sensitivity of the DW pulse response to the material parameters.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
+    parser.add_argument("--sensitivity_folder", type=str, default='', help="The directory to store sobol_indices.csv")  # Optional argument
+    parser.add_argument("--J", type=float, default=4e11, help="Pulse amplitude (A/m^2)")  # Optional argument
+    parser.add_argument("--width", type=float, default=100e-9, help="Pulse length (s)")  # Optional argument
+    parser.add_argument("--switch_distance", type=float, default=1e-6, help="Distance the DW must move to switch (m)")  # Optional argument
+    parser.add_argument("--max_time", type=float, default=None, help="Time by which the DW must switch, and the switching time of those that do not (s).  Default: 10 pulse widths")  # Optional argument
+    parser.add_argument("--samples", type=int, default=2**14, help="Rows of the A and B matrices, rounded up to a power of 2")  # Optional argument
+    parser.add_argument("--params", type=str, default=PARAM_NAMES, nargs='+', help="Material parameters to vary")  # Optional argument
+    parser.add_argument("--conditional", type=str, default=None, help="Parameter to sample within the hull given the others, or none")  # Optional argument
+    parser.add_argument("--chunk_size", type=int, default=8192, help="Rows per chunk")  # Optional argument
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")  # Optional argument
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")  # Optional argument
+
+    args = parser.parse_args()
+
+    conditional = '' if args.conditional == 'none' else args.conditional
+    indices = sensitivity(args.home_folder, args.lookup_table_folder, args.sensitivity_folder, args.J, args.width, args.switch_distance, args.max_time,
+                          args.samples, args.params, conditional, args.chunk_size, args.workers, seed=args.seed)
+    print(indices.to_string(index=False))
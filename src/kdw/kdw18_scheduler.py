@@ -0,0 +1,193 @@
+import argparse
+import math
+import os
+import time as timer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import kdw.runtime.lookup as runtime_lookup
+import kdw.runtime.simulate as runtime_simulate
+
+# Runs kinematic simulations of many devices, e.g. a Monte Carlo population, within a memory budget.  The inputs
+# (time axis, model constants of each device, and either the pulse J and width of each device or a current
+# waveform per device) are placed once in shared memory.  The devices are split into chunks sized so that the
+# inputs, counted twice since the caller's arrays stay in memory next to their shared copy, plus one chunk per
+# worker fit the budget, the chunks are simulated in worker processes with
+# kinematic_model_batch, and each chunk's trajectories are reduced in the worker so only the reduced results
+# are sent back, where they are combined as the chunks complete.  The throughput is reported in simulated
+# device-steps per second.
+#
+# Reducers:
+#   final_position  position of each device at the last time step
+#   max_velocity    velocity of largest magnitude of each device
+#   mean_position   position over time averaged over the devices
+
+# Peak memory of kinematic_model_batch is 5 float64 arrays of the time axis per device; the current and the
+# reducers' temporaries add up to 3 more
+ARRAYS_PER_DEVICE = 8
+MODEL_PARAM_NAMES = ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']
+REDUCERS = ('final_position', 'max_velocity', 'mean_position')
+
+_shared = {}  # Inputs of a worker process, set by attach
+
+def run(model_params, time, current = None, J = None, width = None, memory_budget = 1e9, workers = None, reducers = ('final_position', 'max_velocity')):
+    for name in reducers:
+        if name not in REDUCERS:
+            raise ValueError(f"Error: Unknown reducer {name}.  Use one of {', '.join(REDUCERS)}.")
+    if (current is None) == (J is None or width is None):
+        raise ValueError(f"Error: Give either a current waveform per device, or J and width of a pulse per device.")
+
+    inputs = {'time': np.asarray(time, dtype=float)}
+    inputs.update({k: np.asarray(model_params[k], dtype=float) for k in MODEL_PARAM_NAMES})
+    devices = len(inputs['k0'])
+    if current is not None:
+        inputs['current'] = np.asarray(current, dtype=float)
+    else:
+        inputs['J'] = np.broadcast_to(np.asarray(J, dtype=float), (devices,))
+        inputs['width'] = np.broadcast_to(np.asarray(width, dtype=float), (devices,))
+    samples = len(inputs['time'])
+
+    workers = workers or os.cpu_count()
+    shared_bytes = sum(values.nbytes for values in inputs.values())
+    chunk = chunk_devices(samples, devices, memory_budget, workers, shared_bytes)
+    chunks = [(start, min(start + chunk, devices), tuple(reducers)) for start in range(0, devices, chunk)]
+    print(f"INFO: {devices} devices in {len(chunks)} chunks of up to {chunk} on {workers} workers, "
+          f"{(2 * shared_bytes + workers * chunk * ARRAYS_PER_DEVICE * samples * 8) / 1e6:.0f} MB of a {memory_budget / 1e6:.0f} MB budget.")
+
+    results = {}
+    for name in reducers:
+        results[name] = np.zeros(samples) if name == 'mean_position' else np.full(devices, np.nan)
+
+    # One block of shared memory holds all inputs back to back
+    layout = {}
+    offset = 0
+    for name, values in inputs.items():
+        layout[name] = (offset, values.shape)
+        offset += values.size
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1) * 8)
+    start_time = timer.perf_counter()
+    try:
+        block = np.ndarray((offset,), dtype=np.float64, buffer=shm.buf)
+        for name in list(inputs):
+            values = inputs.pop(name)
+            block[layout[name][0]:layout[name][0] + values.size] = values.ravel()
+        del block, values
+
+        if workers == 1:
+            attach(shm.name, layout)
+            for result in map(run_chunk, chunks):
+                combine(results, *result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(shm.name, layout)) as executor:
+                for future in as_completed([executor.submit(run_chunk, task) for task in chunks]):
+                    combine(results, *future.result())
+    finally:
+        _shared.clear()
+        shm.close()
+        shm.unlink()
+    elapsed = timer.perf_counter() - start_time
+
+    if 'mean_position' in results:
+        results['mean_position'] /= devices
+    device_steps = devices * (samples - 1)
+    stats = {'devices': devices, 'steps': samples - 1, 'chunks': len(chunks), 'chunk_devices': chunk, 'workers': workers,
+             'seconds': elapsed, 'device_steps_per_second': device_steps / elapsed}
+    print(f"INFO: {device_steps:.3g} device-steps in {elapsed:.2f} s: {stats['device_steps_per_second']:.3g} device-steps/s")
+    return results, stats
+
+# Devices per chunk so that the shared inputs and one chunk per worker fit memory_budget bytes, and every
+# worker gets work.  The inputs count twice: the block in shared memory, and the caller's arrays it was copied from.
+def chunk_devices(samples, devices, memory_budget, workers, shared_bytes = 0):
+    per_device = ARRAYS_PER_DEVICE * samples * 8
+    chunk = int((memory_budget - 2 * shared_bytes) // (workers * per_device))
+    if chunk < 1:
+        needed = 2 * shared_bytes + workers * per_device
+        raise ValueError(f"Error: A memory budget of {memory_budget / 1e6:.0f} MB does not fit one device per worker.  At least {needed / 1e6:.0f} MB is needed for {workers} workers.")
+    return min(chunk, math.ceil(devices / workers))
+
+# Worker process initializer: maps the inputs in shared memory without copying them
+def attach(shm_name, layout):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    size = sum(int(np.prod(shape)) for _, shape in layout.values())
+    block = np.ndarray((size,), dtype=np.float64, buffer=shm.buf)
+    _shared['shm'] = shm  # Kept open for the life of the worker
+    for name, (offset, shape) in layout.items():
+        _shared[name] = block[offset:offset + int(np.prod(shape))].reshape(shape)
+
+# Simulates devices start..stop and returns their reduced results
+def run_chunk(task):
+    start, stop, reducers = task
+    time = _shared['time']
+    if 'current' in _shared:
+        current = _shared['current'][start:stop]
+    else:
+        current = np.where(time[None, :] <= _shared['width'][start:stop, None], _shared['J'][start:stop, None], 0.0)
+    x, v, a = runtime_simulate.kinematic_model_batch(*[_shared[k][start:stop] for k in MODEL_PARAM_NAMES], time, current)
+    del a, current
+
+    parts = {}
+    for name in reducers:
+        if name == 'final_position':
+            parts[name] = x[:, -1].copy()
+        elif name == 'max_velocity':
+            parts[name] = v[np.arange(stop - start), np.argmax(np.abs(v), axis=1)]
+        elif name == 'mean_position':
+            parts[name] = x.sum(axis=0)
+    return start, stop, parts
+
+def combine(results, start, stop, parts):
+    for name, part in parts.items():
+        if name == 'mean_position':
+            results[name] += part
+        else:
+            results[name][start:stop] = part
+
+# Model constants of a Monte Carlo population of devices whose material parameters are normally distributed
+# around params with relative standard deviation spread.  Devices outside the lookup table hull are dropped.
+def population(home_folder, params, devices, spread = 0.02, seed = 0, lookup_table_folder = '', block = 1024):
+    lookup_table_path, _ = runtime_lookup.table_paths(home_folder, lookup_table_folder)
+    names = list(params.keys())
+    nominal = np.array([params[name] for name in names])
+    values = nominal * (1 + spread * np.random.default_rng(seed).standard_normal((devices, len(names))))
+
+    model_params = {k: np.empty(devices) for k in MODEL_PARAM_NAMES}
+    for i in range(0, devices, block):
+        batch = runtime_lookup.lookup_batch(lookup_table_path, names, values[i:i + block])
+        for k in MODEL_PARAM_NAMES:
+            model_params[k][i:i + block] = batch[k]
+    inside = ~np.isnan(model_params['k0'])
+    if not inside.all():
+        print(f"WARNING: Dropped {np.count_nonzero(~inside)} of {devices} devices outside the convex hull of the lookup table.")
+    return {k: model_params[k][inside] for k in MODEL_PARAM_NAMES}, values[inside]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates a Monte Carlo population of devices within a memory budget.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in nominal parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--devices", type=int, default=10000, help="Number of devices")  # Optional argument
+    parser.add_argument("--spread", type=float, default=0.02, help="Relative standard deviation of the material parameters")  # Optional argument
+    parser.add_argument("--J", type=float, default=4e11, help="Pulse amplitude (A/m^2)")  # Optional argument
+    parser.add_argument("--width", type=float, default=100e-9, help="Pulse length (s)")  # Optional argument
+    parser.add_argument("--t_stop", type=float, default=200e-9, help="Simulated time (s)")  # Optional argument
+    parser.add_argument("--dt", type=float, default=1e-11, help="Time step (s)")  # Optional argument
+    parser.add_argument("--memory_budget", type=float, default=1e9, help="Memory budget (bytes)")  # Optional argument
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")  # Optional argument
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")  # Optional argument
+    parser.add_argument("--output_file", type=str, default='', help="Optional .csv file to write the parameters and results of each device to")  # Optional argument
+
+    args = parser.parse_args()
+
+    params = {}
+    for i in range (0, len(args.params), 2):
+        params[args.params[i]] = float(args.params[i+1])
+
+    model_params, values = population(args.home_folder, params, args.devices, args.spread, args.seed)
+    time = runtime_simulate.pulse(0, 0, args.t_stop, args.dt)[0]
+    results, stats = run(model_params, time, J=args.J, width=args.width, memory_budget=args.memory_budget, workers=args.workers)
+
+    final_position = results['final_position']
+    print(f"Final DW position: mean {np.mean(final_position)} m, std {np.std(final_position)} m")
+    if args.output_file:
+        np.savetxt(args.output_file, np.column_stack([values, final_position, results['max_velocity']]), delimiter=',',
+                   header=','.join(list(params.keys()) + ['final_position', 'max_velocity']), comments='')
+        print(f"INFO: Wrote {len(final_position)} devices to {args.output_file}")
@@ -0,0 +1,263 @@
+import argparse
+import os
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+
+# Indexed SQLite catalog of the flow, $home_folder/catalog.db, so simulations can be selected by parameters and
+# results without rescanning folders or reloading .csv and .mat files.  Each stage records what it produced:
+#   kdw1_extract   simulations  one row per simulation: its name, corner, raw_path, and a typed column for every
+#                               name=value token of its filename (REAL if the value is a number, TEXT otherwise)
+#   kdw2_analyze   simulations  smoothed_path and markers max_vel, time_constant, drift_dist
+#                  corners      one row per corner (the tokens other than J and RT) with its token columns and B_anis
+#   kdw3_fit       constants    model constants c0..c3, d0, d1, k0..k4 and J_scale of each corner
+#   kdw4_evaluate  errors       model errors of each simulation
+# Token columns are added as new tokens appear, and every token and error column is indexed.  The view sims joins
+# each simulation with its errors and its corner's constants, which is what query selects from, e.g.
+#   python -m kdw catalog . --where W=50e-9 "J>4e11" "err_pos>5%"
+# rebuild fills the catalog from the files of a flow that was run without it.
+
+CATALOG_FILE = 'catalog.db'
+CORNER_EXCLUDE = ('J', 'RT')
+MARKER_COLUMNS = ['max_vel', 'time_constant', 'drift_dist']
+CONSTANT_COLUMNS = ['c0', 'c1', 'c2', 'c3', 'd0', 'd1', 'k0', 'k1', 'k2', 'k3', 'k4', 'J_scale']
+ERROR_COLUMNS = ['rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
+OPERATORS = ('<=', '>=', '!=', '=', '<', '>')
+RELATIVE_TOLERANCE = 1e-9  # Of = on numbers, so 50e-9 matches a filename's 5e-08
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS simulations (name TEXT PRIMARY KEY, corner TEXT, raw_path TEXT, smoothed_path TEXT,
+    {', '.join(f'{column} REAL' for column in MARKER_COLUMNS)});
+CREATE INDEX IF NOT EXISTS simulations_corner ON simulations (corner);
+CREATE TABLE IF NOT EXISTS corners (corner TEXT PRIMARY KEY, B_anis REAL);
+CREATE TABLE IF NOT EXISTS constants (corner TEXT PRIMARY KEY, {', '.join(f'{column} REAL' for column in CONSTANT_COLUMNS)});
+CREATE TABLE IF NOT EXISTS errors (name TEXT PRIMARY KEY, {', '.join(f'{column} REAL' for column in ERROR_COLUMNS)});
+{' '.join(f'CREATE INDEX IF NOT EXISTS errors_{column} ON errors ({column});' for column in ERROR_COLUMNS)}
+CREATE VIEW IF NOT EXISTS sims AS SELECT * FROM simulations LEFT JOIN errors USING (name) LEFT JOIN constants USING (corner);
+"""
+
+def catalog_path(home_folder, path = ''):
+    if path:
+        return path
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+    return os.path.join(home_folder, CATALOG_FILE)
+
+def connect(home_folder, path = ''):
+    connection = sqlite3.connect(catalog_path(home_folder, path), timeout=60)  # Shards may write at once
+    connection.executescript(SCHEMA)
+    return connection
+
+# Tokens of a simulation name, with numbers as floats, e.g. {'Aex': 1.1e-11, ..., 'J': 4e11, 'RT': 1e-07}
+def parse_name(base_name):
+    tokens = {}
+    for param_string in base_name.split('_'):
+        match = re.match(r'^(.+)=(.+)$', param_string)
+        if match:
+            tokens[match.group(1)] = typed(match.group(2))
+    return tokens
+
+def typed(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+# Corner of a simulation as named by kdw2_analyze and kdw4_evaluate.corner_string, from its filename strings
+def corner_name(base_name):
+    params = {}
+    for param_string in base_name.split('_'):
+        match = re.match(r'^(.+)=(.+)$', param_string)
+        if match and match.group(1) not in CORNER_EXCLUDE:
+            params[match.group(1)] = match.group(2)
+    return '_'.join([f"{param}={params[param]}" for param in sorted(params.keys())])
+
+def simulation_row(base_name, **columns):
+    return dict(parse_name(base_name), name=base_name, corner=corner_name(base_name), **columns)
+
+def corner_row(corner):
+    row = dict(parse_name(corner), corner=corner)
+    if isinstance(row.get('Ku'), float) and isinstance(row.get('Msat'), float):
+        row['B_anis'] = row['Ku'] / (0.5 * row['Msat']) - (4 * np.pi * 1e-7) * row['Msat']
+    return row
+
+# Adds the columns of rows missing from table, typed by their first value, each with an index.  Run within the
+# write transaction of record, so a concurrent shard cannot add the same column between the check and the ALTER.
+def add_columns(connection, table, rows):
+    existing = {info[1].lower() for info in connection.execute(f"PRAGMA table_info({table})")}
+    for row in rows:
+        for column, value in row.items():
+            if column.lower() in existing:
+                continue
+            if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', column):
+                raise ValueError(f"Error: The filename token {column} is not a valid column name.")
+            kind = 'REAL' if isinstance(value, (int, float)) else 'TEXT'
+            connection.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {kind}')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{column}" ON {table} ("{column}")')
+            existing.add(column.lower())
+
+# Inserts rows into table, or updates the given columns of rows whose key already exists
+def upsert(connection, table, key, rows):
+    add_columns(connection, table, rows)
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row.keys()), []).append(tuple(float(v) if isinstance(v, np.floating) else v for v in row.values()))
+    for columns, values in groups.items():
+        names = ', '.join(f'"{column}"' for column in columns)
+        updates = ', '.join(f'"{column}" = excluded."{column}"' for column in columns if column != key)
+        action = f"UPDATE SET {updates}" if updates else "NOTHING"
+        connection.executemany(f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT ({key}) DO {action}", values)
+
+# Upserts each (table, key, rows) in one transaction, and updates the statistics the query planner picks indexes by.
+# BEGIN IMMEDIATE takes the write lock before the columns are read, so concurrent shards wait for each other.
+def record(home_folder, tables, path = ''):
+    connection = connect(home_folder, path)
+    try:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for table, key, rows in tables:
+                upsert(connection, table, key, rows)
+        connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+
+# kdw1_extract: the simulations extracted to raw_data_folder
+def record_simulations(home_folder, base_names, raw_data_folder, path = ''):
+    rows = [simulation_row(base_name, raw_path=os.path.join(raw_data_folder, f"{base_name}.mat")) for base_name in base_names]
+    record(home_folder, [('simulations', 'name', rows)], path)
+
+# kdw2_analyze: the markers of each simulation and its corner
+def record_markers(home_folder, simulations, smoothed_data_folder, path = ''):
+    rows = [simulation_row(simulation['name'], smoothed_path=os.path.join(smoothed_data_folder, f"{simulation['name']}.mat"),
+                           **{column: simulation[column] for column in MARKER_COLUMNS}) for simulation in simulations]
+    corners = [corner_row(corner) for corner in sorted({row['corner'] for row in rows})]
+    record(home_folder, [('simulations', 'name', rows), ('corners', 'corner', corners)], path)
+
+# kdw3_fit: the model constants of each corner, given as {corner: fit_corner result}
+def record_constants(home_folder, constants, path = ''):
+    rows = [dict({'corner': corner}, **{column: corner_constants[column] for column in CONSTANT_COLUMNS}) for corner, corner_constants in constants.items()]
+    record(home_folder, [('corners', 'corner', [corner_row(corner) for corner in constants]), ('constants', 'corner', rows)], path)
+
+# kdw4_evaluate: the model errors of each simulation
+def record_errors(home_folder, simulations, path = ''):
+    rows = [dict({'name': simulation['name']}, **{column: simulation[column] for column in ERROR_COLUMNS}) for simulation in simulations]
+    record(home_folder, [('errors', 'name', rows)], path)
+
+# Rows of the sims view meeting every condition, given as strings like "W=50e-9", "J>4e11" or "err_pos>5%"
+def query(home_folder, conditions = (), columns = None, path = ''):
+    path = catalog_path(home_folder, path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Error: The catalog {path} does not exist.  Run the flow or rebuild it.")
+    connection = connect(home_folder, path)
+    try:
+        known = {info[1].lower(): info[1] for info in connection.execute("PRAGMA table_info(sims)")}
+        clauses = []
+        values = []
+        for condition in conditions:
+            column, operator, value = parse_condition(condition)
+            if column.lower() not in known:
+                raise ValueError(f"Error: Unknown column {column} in {condition}.  Use one of {', '.join(known.values())}.")
+            if operator == '=' and isinstance(value, float) and value != 0:
+                clauses.append(f'"{column}" BETWEEN ? AND ?')
+                values += sorted([value * (1 - RELATIVE_TOLERANCE), value * (1 + RELATIVE_TOLERANCE)])
+            else:
+                clauses.append(f'"{column}" {operator} ?')
+                values.append(value)
+        select = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+        order = 'corner, J, name' if 'j' in known else 'corner, name'
+        sql = f"SELECT {select} FROM sims" + (f" WHERE {' AND '.join(clauses)}" if clauses else '') + f" ORDER BY {order}"
+        return pd.read_sql_query(sql, connection, params=values)
+    finally:
+        connection.close()
+
+def parse_condition(condition):
+    match = re.match(rf"^\s*(\w+)\s*({'|'.join(OPERATORS)})\s*(.+?)\s*$", condition)
+    if not match:
+        raise ValueError(f"Error: Cannot read the condition {condition}.  Give it like W=50e-9 or J>4e11.")
+    column, operator, value = match.groups()
+    if value.endswith('%'):
+        return column, operator, float(value[:-1]) / 100
+    return column, operator, typed(value)
+
+# Fills the catalog from the raw_data, smoothed_data, marker_tables, lookup_tables and error_tables folders of
+# a flow run without it.  Markers and errors are matched to simulations by corner and J, as in the tables.
+def rebuild(home_folder, path = ''):
+    path = catalog_path(home_folder, path)
+    folders = {folder: os.path.join(home_folder, folder) for folder in ['raw_data', 'smoothed_data', 'marker_tables', 'lookup_tables', 'error_tables']}
+
+    names = set()
+    for folder in ['raw_data', 'smoothed_data']:
+        if os.path.isdir(folders[folder]):
+            names.update(os.path.splitext(f)[0] for f in os.listdir(folders[folder]) if f.endswith('.mat'))
+    rows = {}
+    for name in sorted(names):
+        rows[name] = simulation_row(name)
+        for folder, column in [('raw_data', 'raw_path'), ('smoothed_data', 'smoothed_path')]:
+            file_path = os.path.join(folders[folder], f"{name}.mat")
+            if os.path.isfile(file_path):
+                rows[name][column] = file_path
+    by_corner_J = {}
+    for name, row in rows.items():
+        by_corner_J.setdefault((row['corner'], row.get('J')), []).append(name)
+
+    marker_files = sorted(f for f in os.listdir(folders['marker_tables']) if f.endswith('.mat')) if os.path.isdir(folders['marker_tables']) else []
+    corners = [os.path.splitext(f)[0][len('dataTable_'):] for f in marker_files]
+    J_scales = []
+    for file_name, corner in zip(marker_files, corners):
+        data_table = sio.loadmat(os.path.join(folders['marker_tables'], file_name))['dataTable']
+        J_scales.append(data_table[0, 0])  # Sorted by J, as fit_corner scales J by its first
+        for J, *markers in data_table:
+            for name in by_corner_J.get((corner, J), []):
+                rows[name].update(zip(MARKER_COLUMNS, markers))
+
+    # lookup_all.csv has a row per marker table, in the same order (see kdw16_bootstrap)
+    constants = []
+    lookup_table_path = os.path.join(folders['lookup_tables'], 'lookup_all.csv')
+    if os.path.isfile(lookup_table_path):
+        lookup_table = pd.read_csv(lookup_table_path)
+        if len(lookup_table) == len(corners):
+            for corner, J_scale, (_, row) in zip(corners, J_scales, lookup_table.iterrows()):
+                constants.append(dict({'corner': corner}, **{column: row[column] for column in CONSTANT_COLUMNS if column != 'J_scale'}, J_scale=J_scale))
+        else:
+            print(f"WARNING: {lookup_table_path} does not have a row per marker table. Skipping the model constants.")
+
+    errors = []
+    if os.path.isdir(folders['error_tables']):
+        for file_name in sorted(f for f in os.listdir(folders['error_tables']) if f.startswith('error_') and f.endswith('.csv')):
+            corner = os.path.splitext(file_name)[0][len('error_'):]
+            for _, row in pd.read_csv(os.path.join(folders['error_tables'], file_name)).iterrows():
+                for name in by_corner_J.get((corner, row['J']), []):
+                    errors.append(dict({'name': name}, **{column: row[column] for column in ERROR_COLUMNS}))
+
+    all_corners = sorted(set(corners) | {row['corner'] for row in rows.values()})
+    record(home_folder, [('simulations', 'name', list(rows.values())), ('corners', 'corner', [corner_row(corner) for corner in all_corners]),
+                         ('constants', 'corner', constants), ('errors', 'name', errors)], path)
+    print(f"INFO: Cataloged {len(rows)} simulations, {len(constants)} fitted corners and {len(errors)} simulation errors in {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries the catalog of simulations, corners, fits and errors.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--where", type=str, default=[], nargs='+', help="Conditions like: W=50e-9 J>4e11 err_pos>5%%")  # Optional argument
+    parser.add_argument("--columns", type=str, default=None, nargs='+', help="Columns to show, by default all")  # Optional argument
+    parser.add_argument("--sql", type=str, default='', help="Run an SQL query instead, e.g. on the sims view")  # Optional argument
+    parser.add_argument("--rebuild", action='store_true', help="First fill the catalog from the files of the flow")  # Optional argument
+    parser.add_argument("--catalog", type=str, default='', help="The catalog file, by default $home_folder/catalog.db")  # Optional argument
+    parser.add_argument("--output_file", type=str, default='', help="Optional .csv file to write the rows to")  # Optional argument
+
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild(args.home_folder, args.catalog)
+    if args.sql:
+        connection = connect(args.home_folder, args.catalog)
+        rows = pd.read_sql_query(args.sql, connection)
+        connection.close()
+    else:
+        rows = query(args.home_folder, args.where, args.columns, args.catalog)
+
+    print(rows.to_string(index=False))
+    print(f"INFO: {len(rows)} rows")
+    if args.output_file:
+        rows.to_csv(args.output_file, index=False)
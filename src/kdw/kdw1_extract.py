@@ -1,11 +1,26 @@
 import os
 import numpy as np
-import scipy.io as sio
 import matplotlib.pyplot as plt
 import argparse
 import re
+import bz2
+import gzip
+import io
+import itertools
+import lzma
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import kdw.kdw12_shard as kdw12_shard
+import kdw.kdw15_store as kdw15_store
+import kdw.kdw19_catalog as kdw19_catalog
 
-def extract(home_folder, sim_folder = '', raw_data_folder = '', with_ext_centerwall = True):
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz', '.tar.bz2', '.tbz2')
+POSITION_METHODS = ('centroid', 'zero_crossing', 'tanh')
+
+def extract(home_folder, sim_folder = '', raw_data_folder = '', with_ext_centerwall = True, out_folders = None, shard = None, position_method = 'centroid',
+            storage = 'full', catalog = True, compress = False):
     
     # Check if home_folder exists
     if not os.path.isdir(home_folder):
@@ -21,9 +36,12 @@ def extract(home_folder, sim_folder = '', raw_data_folder = '', with_ext_centerw
     if not os.path.isdir(raw_data_folder):
         os.mkdir(raw_data_folder)
 
-    # Get a list of all .out folders in the folder
+    # Get a list of all .out folders in the folder, unless only some were requested
     file_pattern = '*.out'
-    out_folders = [f for f in os.listdir(sim_folder) if f.endswith('.out')]
+    if out_folders is None:
+        out_folders = sorted(f for f in os.listdir(sim_folder) if f.endswith('.out'))
+    out_folders = [f for f in out_folders if kdw12_shard.in_shard(f, shard)]
+    extracted = []
     
     # Loop over each .out file
     for mumax_out_folder in out_folders:
@@ -36,98 +54,305 @@ def extract(home_folder, sim_folder = '', raw_data_folder = '', with_ext_centerw
         if m:
             base_name = m.group(1)
     
-        # Extract J (current density) and RT (runtime) from the file name
-        j_val = float(base_name.split('_J=')[1].split('_')[0])
-        rt_val = float(base_name.split('_RT=')[1].split('_')[0])
-    
-        # Load the table data
+        # Load the table data, which may also be stored compressed as table.txt.gz, .xz or .bz2
         table_file = os.path.join(full_folder_path, 'table.txt')
+        for ext in COMPRESSED_OPENERS:
+            if not os.path.isfile(table_file) and os.path.isfile(table_file + ext):
+                table_file = table_file + ext
         if not os.path.isfile(table_file):
             raise FileNotFoundError(f"Error: The table file {table_file} does not exist.")
+
+        with open_table(table_file) as stream:
+            time, dw_position, ext_dwpos = read_table(stream, with_ext_centerwall, position_method=position_method)
+
+        save_trajectory(base_name, time, dw_position, ext_dwpos, raw_data_folder, with_ext_centerwall, full_folder_path, storage, compress)
+        extracted.append(base_name)
     
-        data_analyzed = np.loadtxt(table_file, skiprows=1)
-    
-        # Determine rows and columns of data
-        rows, columns = data_analyzed.shape
-    
-        # Shift data to calculate position/velocity values
-        if with_ext_centerwall:
-            data_shift = np.hstack([np.ones((rows, 1)), data_analyzed[:, 4:columns-3]])
-            d_diff = data_shift - data_analyzed[:, 4:columns-2]
-            x = np.arange(4, columns - 2)
+        print(f"Processed and saved data for {mumax_out_folder}")
+
+    if catalog:
+        kdw19_catalog.record_simulations(home_folder, extracted, raw_data_folder)
+
+# Extracts DW motion from table.txt files inside gzip, xz or bzip2 compressed files and tar or zip archives
+# in sim_folder.  Tables are decompressed and parsed block by block in memory; nothing decompressed is
+# written to disk.  Several archives are read at once so decompression and I/O overlap with parsing.  Since
+# there is no .out folder to write to, only the raw_data .mat files are produced.  With a shard, every archive
+# is read but only the tables of the shard's simulations are parsed, so each simulation is extracted by the
+# same shard that analyzes and evaluates it.
+def extract_archives(home_folder, sim_folder = '', raw_data_folder = '', with_ext_centerwall = True, workers = 4, archives = None, shard = None,
+                     position_method = 'centroid', storage = 'full', catalog = True, compress = False):
+
+    # Check if home_folder exists
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if not sim_folder:
+        sim_folder = os.path.join(home_folder, 'simulations')
+    if not os.path.isdir(sim_folder):
+        raise FileNotFoundError(f"Error: The folder {sim_folder} does not exist.")
+
+    if not raw_data_folder:
+        raw_data_folder = os.path.join(home_folder, 'raw_data')
+    if not os.path.isdir(raw_data_folder):
+        os.mkdir(raw_data_folder)
+
+    if archives is None:
+        archives = sorted(f for f in os.listdir(sim_folder) if archive_kind(f))
+    extracted = []
+
+    # Parsing happens in the worker threads, plotting and saving in this one
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(read_archive, os.path.join(sim_folder, archive), with_ext_centerwall, position_method, shard): archive for archive in archives}
+        for future in as_completed(futures):
+            print(f"Now reading {futures[future]}")
+            for base_name, time, dw_position, ext_dwpos in future.result():
+                save_trajectory(base_name, time, dw_position, ext_dwpos, raw_data_folder, with_ext_centerwall, storage=storage, compress=compress)
+                extracted.append(base_name)
+                print(f"Processed and saved data for {base_name}")
+
+    if catalog:
+        kdw19_catalog.record_simulations(home_folder, extracted, raw_data_folder)
+
+def archive_kind(file_name):
+    if file_name.endswith(TAR_SUFFIXES):
+        return 'tar'
+    if file_name.endswith('.zip'):
+        return 'zip'
+    if os.path.splitext(file_name)[1] in COMPRESSED_OPENERS:
+        return 'compressed'
+    return ''
+
+# Simulation name from the .out folder in a path, or else from the archive name
+def sim_name_from_path(path, archive_path):
+    for part in reversed(path.replace('\\', '/').split('/')):
+        if part.endswith('.out'):
+            return part[:-len('.out')]
+    name = os.path.basename(archive_path)
+    for suffix in TAR_SUFFIXES + ('.zip',) + tuple(COMPRESSED_OPENERS):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return re.sub(r'(\.out)?(\.table)?(\.txt)?$', '', name)
+
+def read_archive(archive_path, with_ext_centerwall = True, position_method = 'centroid', shard = None):
+    trajectories = []
+    kind = archive_kind(archive_path)
+    if kind == 'tar':
+        # Stream mode reads the members in order without seeking
+        with tarfile.open(archive_path, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile() and os.path.basename(member.name) == 'table.txt' and kdw12_shard.in_shard(sim_name_from_path(member.name, archive_path), shard):
+                    # Members of a streamed tar are not seekable, so decode their lines directly
+                    with tar.extractfile(member) as stream:
+                        trajectories.append((sim_name_from_path(member.name, archive_path), *read_table((line.decode() for line in stream), with_ext_centerwall, position_method=position_method)))
+    elif kind == 'zip':
+        with zipfile.ZipFile(archive_path) as zf:
+            for name in zf.namelist():
+                if os.path.basename(name) == 'table.txt' and kdw12_shard.in_shard(sim_name_from_path(name, archive_path), shard):
+                    with io.TextIOWrapper(zf.open(name)) as stream:
+                        trajectories.append((sim_name_from_path(name, archive_path), *read_table(stream, with_ext_centerwall, position_method=position_method)))
+    elif kind == 'compressed':
+        if not kdw12_shard.in_shard(sim_name_from_path(os.path.dirname(archive_path), archive_path), shard):
+            return trajectories
+        with open_table(archive_path) as stream:
+            trajectories.append((sim_name_from_path(os.path.dirname(archive_path), archive_path), *read_table(stream, with_ext_centerwall, position_method=position_method)))
+    else:
+        raise ValueError(f"Error: {archive_path} is not a supported archive.")
+    return trajectories
+
+def open_table(table_file):
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(table_file)[1], open)
+    return opener(table_file, mode='rt')
+
+# Reads a mumax table from an iterable of text lines block_rows rows at a time, keeping only the time, the DW position
+# within the simulation window (in cells), and the ext_dwpos window shift of each row.  Only those columns and the
+# m_z cells are parsed.  position_method is one of POSITION_METHODS: 'centroid' (dw_position_rows), or
+# 'zero_crossing' and 'tanh' (dw_position_crossing)
+def read_table(lines, with_ext_centerwall = True, block_rows = 10000, position_method = 'centroid'):
+    if position_method not in POSITION_METHODS:
+        raise ValueError(f"Error: Unknown position method {position_method}.  Use one of {', '.join(POSITION_METHODS)}.")
+    cell = None  # Wall cell of the previous row, carried across blocks
+    times = []
+    positions = []
+    shifts = []
+    lines = iter(lines)
+    next(lines, None)  # Header
+    usecols = None
+    while True:
+        block_lines = list(itertools.islice(lines, block_rows))
+        if not block_lines:
+            break
+        if usecols is None:
+            # Time, the m_z cells from column 4 on and the ext_dwpos shift in the second to last column
+            columns = len(block_lines[0].split())
+            usecols = [0] + list(range(4, columns - 2 if with_ext_centerwall else columns - 1)) + [columns - 2]
+        block = np.loadtxt(block_lines, usecols=usecols, ndmin=2)
+        mz = block[:, 1:-1]
+        times.append(block[:, 0])
+        if position_method == 'centroid':
+            positions.append(dw_position_rows(mz))
         else:
-            data_shift = np.hstack([np.ones((rows, 1)), data_analyzed[:, 4:columns-2]])
-            d_diff = data_shift - data_analyzed[:, 4:columns-1]
-            x = np.arange(4, columns - 1)
-    
-        # Generate current profile
-        current = np.zeros(rows)
-        for i in range(rows):
-            if data_analyzed[i, 0] <= rt_val:
-                current[i] = j_val
-    
-        # Calculate domain wall position
-        dw_position = np.zeros(rows)
-        for i in range(rows):
-            dw_position[i] = np.sum(d_diff[i, :] * x) / np.sum(d_diff[i, :])
-    
-        if with_ext_centerwall:
-            dw_position_shift = dw_position + data_analyzed[:, -2] * 1e9 - dw_position[0]
+            position, cell = dw_position_crossing(mz, position_method, cell)
+            positions.append(position)
+        shifts.append(block[:, -1])
+    if not times:
+        raise ValueError(f"Error: The table is empty.")
+    return np.concatenate(times), np.concatenate(positions), np.concatenate(shifts)
+
+# DW position of each table row as the weighted centroid of the differences of neighbouring m_z cells, in table
+# column units (cell 0 is column 4)
+def dw_position_rows(mz):
+
+    # Shift data to calculate position/velocity values
+    d_diff = np.hstack([np.ones((mz.shape[0], 1)), mz[:, :-1]]) - mz
+    x = np.arange(4, 4 + mz.shape[1])
+
+    # Calculate domain wall position
+    return np.sum(d_diff * x, axis=1) / np.sum(d_diff, axis=1)
+
+# DW position of each table row from the m_z sign change.  The sign changes of all rows are found at once; a row
+# with several (e.g. noise near the wall) takes the one within search_cells of the previous row's wall, or else
+# the one found by bisection over the track.  The position is then interpolated linearly between the two cells
+# around the sign change ('zero_crossing') or found from a tanh profile fit to fit_cells cells on each side ('tanh').
+# Positions are in the same column units as dw_position_rows, which places an abrupt wall between cells k and k+1
+# at column k+5.  Rows without a sign change fall back to the centroid.
+def dw_position_crossing(mz, method = 'zero_crossing', cell = None, search_cells = 8, fit_cells = 3):
+
+    rows, cells = mz.shape
+
+    # Cell k of each row such that m_z changes sign between cells k and k+1, or -1 if it does not
+    positive = mz > 0
+    changes = positive[:, :-1] != positive[:, 1:]
+    count = changes.sum(axis=1)
+    wall = np.where(count == 1, np.argmax(changes, axis=1), -1)
+
+    index = np.arange(rows)
+    last_found = np.maximum.accumulate(np.where(wall >= 0, index, -1))  # Latest single crossing row up to each row
+    resolved, resolved_cell = -1, cell  # Latest row with several crossings that was resolved, and its wall
+    for i in np.flatnonzero(count > 1):
+        previous = last_found[i - 1] if i > 0 else -1
+        wall[i] = find_wall(mz[i], wall[previous] if previous > resolved else resolved_cell, search_cells)
+        if wall[i] >= 0:
+            resolved, resolved_cell = i, wall[i]
+    found = wall >= 0
+    if found.any():
+        cell = int(wall[np.flatnonzero(found)[-1]])
+
+    k = np.where(found, wall, 0)
+    left = mz[index, k]
+    right = mz[index, k + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):  # Rows without a wall are replaced below
+        position = k + left / (left - right)
+        if method == 'tanh':
+            # Weighted least squares of atanh(s m_z) = (x0 - x) / w over the window, s being the sign of m_z left of the wall
+            window = np.clip(k[:, None] + np.arange(-fit_cells + 1, fit_cells + 1), 0, cells - 1)
+            m = np.clip(np.where(left > 0, 1.0, -1.0)[:, None] * mz[index[:, None], window], -0.95, 0.95)
+            y = np.arctanh(m)
+            weight = 1 - m**2
+            x = window.astype(float)
+            sw, sx, sy = weight.sum(axis=1), (weight * x).sum(axis=1), (weight * y).sum(axis=1)
+            sxx, sxy = (weight * x * x).sum(axis=1), (weight * x * y).sum(axis=1)
+            slope = (sw * sxy - sx * sy) / (sw * sxx - sx**2)
+            fit = -(sy - slope * sx) / sw / slope
+            # Keep the fit only where it lands within the cells around the sign change
+            position = np.where(np.abs(fit - k - 0.5) <= 1, fit, position)
+    position = position + 4.5
+
+    if not found.all():
+        position[~found] = dw_position_rows(mz[~found])
+    return position, cell
+
+# Sign change of one row of m_z nearest to cell (the nearer cell above it first on a tie) within search_cells,
+# or else by bisection over the track, or -1 if the ends of the track have the same sign
+def find_wall(row, cell = None, search_cells = 8):
+    cells = len(row)
+    if cell is not None:
+        for offset in [0] + [sign * step for step in range(1, search_cells + 1) for sign in (1, -1)]:
+            k = cell + offset
+            if 0 <= k < cells - 1 and (row[k] > 0) != (row[k+1] > 0):
+                return k
+    low, high = 0, cells - 1
+    if (row[low] > 0) == (row[high] > 0):
+        return -1
+    while high - low > 1:
+        middle = (low + high) // 2
+        if (row[middle] > 0) == (row[low] > 0):
+            low = middle
         else:
-            dw_position_shift = dw_position - dw_position[0]
+            high = middle
+    return low
+
+# DW velocity as the difference of the position n samples ahead.  The last n samples repeat the last difference.
+def difference_velocity(time, dw_position, n = 2):
+    dw_next = np.roll(dw_position, -n)
+    dw_next[-n:] = 0
+
+    time_next = np.roll(time, -n)
+    time_next[-n:] = 0
+
+    delta_velocity = (dw_position - dw_next) / (time - time_next)
+    delta_velocity[-n:] = delta_velocity[-n-1]
+    return delta_velocity
+
+# Scales the DW position, calculates velocity, and saves the trajectory of one simulation with the given
+# kdw15_store storage.  Plots and a copy of the data are also written to the simulation's .out folder, if there is one.
+def save_trajectory(base_name, time, dw_position, ext_dwpos, raw_data_folder, with_ext_centerwall = True, full_folder_path = '', storage = 'full', compress = False):
+
+    # Extract J (current density) and RT (runtime) from the file name
+    j_val = float(base_name.split('_J=')[1].split('_')[0])
+    rt_val = float(base_name.split('_RT=')[1].split('_')[0])
+
+    # Generate current profile
+    current = np.where(time <= rt_val, j_val, 0.0)
 
-        position_step = 1e-9 # (1nm) !! Change if position step size changes
-        dw_position_scaled = dw_position_shift * position_step
+    if with_ext_centerwall:
+        dw_position_shift = dw_position + ext_dwpos * 1e9 - dw_position[0]
+    else:
+        dw_position_shift = dw_position - dw_position[0]
 
-        # Plot position and velocity
+    position_step = 1e-9 # (1nm) !! Change if position step size changes
+    dw_position_scaled = dw_position_shift * position_step
+
+    # Plot position and velocity
+    if full_folder_path:
         plt.figure()
-        plt.plot(data_analyzed[:, 0] * 1e9, dw_position_scaled * 1e9, label="DW Position", color='blue')
+        plt.plot(*kdw15_store.decimate(time * 1e9, dw_position_scaled * 1e9), label="DW Position", color='blue')
         plt.ylabel("Domain wall position (nm)")
         plt.xlabel("Time (ns)")
-    
+
         plt.twinx()
-        plt.plot(data_analyzed[:, 0] * 1e9, current / 1e12, label="Current Density", color='red')
+        plt.plot(*kdw15_store.decimate(time * 1e9, current / 1e12), label="Current Density", color='red')
         plt.ylabel("Current Density (10^12 A/m^2)")
-    
+
         plt.title("Domain Wall Position and Current Density")
         plt.tight_layout()
         plt.savefig(f"{full_folder_path}/position.png")
         plt.close()
-    
-        # Calculate velocity
-        n = 2
-        dw_next = np.roll(dw_position_scaled, -n)
-        dw_next[-n:] = 0
-    
-        time_next = np.roll(data_analyzed[:, 0], -n)
-        time_next[-n:] = 0
-    
-        delta_velocity = (dw_position_scaled - dw_next) / (data_analyzed[:, 0] - time_next)
-        delta_velocity[-1] = delta_velocity[-3]
-        delta_velocity[-2] = delta_velocity[-3]
-    
+
+    # Calculate velocity
+    delta_velocity = difference_velocity(time, dw_position_scaled)
+
+    if full_folder_path:
         plt.figure()
-        plt.plot(data_analyzed[:, 0] * 1e9, dw_position_scaled * 1e9, label="DW Position", color='blue')
+        plt.plot(*kdw15_store.decimate(time * 1e9, dw_position_scaled * 1e9), label="DW Position", color='blue')
         plt.ylabel("Domain wall position (nm)")
         plt.xlabel("Time (ns)")
 
         plt.twinx()
-        plt.plot(data_analyzed[:, 0] * 1e9, delta_velocity, label="DW Velocity", color='red')
+        plt.plot(*kdw15_store.decimate(time * 1e9, delta_velocity), label="DW Velocity", color='red')
         plt.ylabel("Domain wall velocity (m/s)")
         plt.grid()
         plt.tight_layout()
         plt.savefig(f"{full_folder_path}/velocity.png")
         plt.close()
-    
-        # Save time, position, and velocity to .mat file
-        time = data_analyzed[:, 0]
-        dw_position = dw_position_scaled
-        dw_velocity = delta_velocity
 
-        sio.savemat(f"{full_folder_path}/data.mat", {"time": time, "dwPosition": dw_position, "dwVelocity": dw_velocity})
-        sio.savemat(f"{raw_data_folder}/{base_name}.mat", {"time": time, "dwPosition": dw_position, "dwVelocity": dw_velocity})
-    
-        print(f"Processed and saved data for {mumax_out_folder}")
+    # Save time, position, and velocity to .mat file
+    dw_position = dw_position_scaled
+    dw_velocity = delta_velocity
+
+    if full_folder_path:
+        kdw15_store.save(f"{full_folder_path}/data.mat", time, {"dwPosition": dw_position, "dwVelocity": dw_velocity}, storage, compress)
+    kdw15_store.save(f"{raw_data_folder}/{base_name}.mat", time, {"dwPosition": dw_position, "dwVelocity": dw_velocity}, storage, compress)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extracts DW position from output .txt files.")
@@ -135,7 +360,18 @@ if __name__ == "__main__":
     parser.add_argument("--sim_folder", type=str, default='', help="The directory storing the time-resolved DW motion data")  # Positional argument
     parser.add_argument("--raw_data_folder", type=str, default='', help="The directory to put the output data_files")  # Positional argument
     parser.add_argument("--with_ext_centerwall", nargs=1, type=bool, default=True, help="True if ext_centerWall was used in mumax")  # Optional argument
+    parser.add_argument("--archives", action='store_true', help="Also extract tables from compressed files and tar/zip archives in the sim_folder")  # Optional argument
+    parser.add_argument("--workers", type=int, default=4, help="Number of archives to read at once")  # Optional argument
+    parser.add_argument("--shard", type=str, default='', help="Only extract shard i of N, given as i/N")  # Optional argument
+    parser.add_argument("--position_method", type=str, default='centroid', choices=POSITION_METHODS, help="DW position estimator")  # Optional argument
+    parser.add_argument("--storage", type=str, default='full', choices=kdw15_store.STORAGES, help="Storage of the trajectory .mat files")  # Optional argument
+    parser.add_argument("--compress", action='store_true', help="Also zlib compress compact .mat files, for smaller but slower to load files")  # Optional argument
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the results in the catalog (see kdw19_catalog.py)")  # Optional argument
 
     args = parser.parse_args()
 
-    extract(args.home_folder, args.sim_folder, args.raw_data_folder, args.with_ext_centerwall)
\ No newline at end of file
+    extract(args.home_folder, args.sim_folder, args.raw_data_folder, args.with_ext_centerwall, shard=args.shard, position_method=args.position_method,
+            storage=args.storage, catalog=not args.no_catalog, compress=args.compress)
+    if args.archives:
+        extract_archives(args.home_folder, args.sim_folder, args.raw_data_folder, args.with_ext_centerwall, args.workers, shard=args.shard,
+                         position_method=args.position_method, storage=args.storage, catalog=not args.no_catalog, compress=args.compress)
\ No newline at end of file
@@ -6,8 +6,12 @@ from scipy.ndimage import gaussian_filter
 import matplotlib.pyplot as plt
 import argparse
 import re
+import kdw.kdw12_shard as kdw12_shard
+import kdw.kdw15_store as kdw15_store
+import kdw.kdw19_catalog as kdw19_catalog
 
-def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data_folder = '', smoothed_img_folder = '', match_params = {}):
+def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data_folder = '', smoothed_img_folder = '', match_params = {}, shard = None, storage = 'full', catalog = True, compress = False,
+            sim_names = None):
 
     # Check if home_folder exists
     if not os.path.isdir(home_folder):
@@ -18,8 +22,14 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
     if not os.path.isdir(raw_data_folder):
         raise FileNotFoundError(f"Error: The folder {raw_data_folder} does not exist.")
 
+    # A shard only sees some of each corner's simulations, so its marker tables are kept apart until merged
+    if kdw12_shard.parse_shard(shard) and marker_folder:
+        raise ValueError(f"Error: A shard writes its marker tables to {os.path.join(home_folder, 'shards')}, where merge reads them.  Do not give marker_folder with shard.")
     if not marker_folder:
-        marker_folder = os.path.join(home_folder, 'marker_tables')
+        if kdw12_shard.parse_shard(shard):
+            marker_folder = kdw12_shard.shard_folder(home_folder, 'marker_tables', shard)
+        else:
+            marker_folder = os.path.join(home_folder, 'marker_tables')
     if not os.path.isdir(marker_folder):
         os.mkdir(marker_folder)
 
@@ -35,7 +45,10 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
         os.mkdir(smoothed_img_folder)
 
     # Get all .mat files in the folder
-    mat_files = [f for f in os.listdir(raw_data_folder) if f.endswith('.mat')]
+    mat_files = sorted(f for f in os.listdir(raw_data_folder) if f.endswith('.mat') and kdw12_shard.in_shard(f, shard))
+    if sim_names is not None:
+        sim_names = set(sim_names)
+        mat_files = [f for f in mat_files if os.path.splitext(f)[0] in sim_names]
     
     # Init master simulation data structure:
     simulations = []
@@ -45,14 +58,6 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
         full_file_path = os.path.join(raw_data_folder, mat_file)
         #print(f"INFO: Now reading {full_file_path}")
     
-        # Load data from the .mat file
-        mat_data = sio.loadmat(full_file_path)
-        time = mat_data['time'][0]
-        dw_position = mat_data['dwPosition'][0]
-        dw_velocity = mat_data['dwVelocity'][0]
-
-        negate = -1 if (sum(dw_velocity) < 0) else 1
-    
         # Extract J (current density) and runtime (RT) from the file name
         base_name = os.path.splitext(os.path.basename(mat_file))[0]
         
@@ -77,6 +82,14 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
         else:
             print(f"INFO: Now reading {base_name}.")
 
+        # Load data from the .mat file, only once its name matches
+        mat_data = kdw15_store.load(full_file_path)
+        time = mat_data['time']
+        dw_position = mat_data['dwPosition']
+        dw_velocity = mat_data['dwVelocity']
+
+        negate = -1 if (sum(dw_velocity) < 0) else 1
+
         if 'J' in params:
             J = float(params['J'])
             del params['J']
@@ -104,7 +117,7 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
         # Smooth velocity data
         smooth_vel = gaussian_filter(dw_velocity, 25)
         
-        sio.savemat(f"{smoothed_data_folder}/{base_name}.mat", {"time": time, "dwPosition": dw_position, "dwVelocity": smooth_vel})
+        kdw15_store.save(f"{smoothed_data_folder}/{base_name}.mat", time, {"dwPosition": dw_position, "dwVelocity": smooth_vel}, storage, compress)
     
         # Plot position and velocity
         plt.figure()
@@ -113,12 +126,12 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
     
             ax1.set_xlabel('Time (ns)')
             ax1.set_ylabel('Domain wall position (nm)', color='blue')
-            ax1.plot(time * 1e9, dw_position * 1e9, 'b-', label='DW position')
+            ax1.plot(*kdw15_store.decimate(time * 1e9, dw_position * 1e9), 'b-', label='DW position')
             ax1.tick_params(axis='y', labelcolor='blue')
     
             ax2 = ax1.twinx()
             ax2.set_ylabel('Domain wall velocity (m/s)', color='red')
-            ax2.plot(time * 1e9, smooth_vel, 'r-', label='DW velocity')
+            ax2.plot(*kdw15_store.decimate(time * 1e9, smooth_vel), 'r-', label='DW velocity')
             ax2.tick_params(axis='y', labelcolor='red')
     
             fig.tight_layout()
@@ -131,18 +144,25 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
         plt.close('all')
     
         # Calculate quantities
-        max_vel = negate * np.max(np.abs(smooth_vel[current_end-1]))
-    
-        time_constant = time[np.where(np.abs(smooth_vel - smooth_vel[current_end - 1]) < abs(max_vel) / np.exp(1))[0][0]]
-    
-        drift_dist = negate * np.abs(dw_position[-1] - dw_position[current_end])
+        max_vel, time_constant, drift_dist = markers(time, dw_position, smooth_vel, current_end, negate)
     
         if np.abs(smooth_vel[-1]) > 0.01 * abs(max_vel):
             print("WARNING: DW not stopped by end of simulation.")
     
-        simulation = {'params': params, 'J': J, 'max_vel': max_vel, 'time_constant': time_constant, 'drift_dist': drift_dist}
+        simulation = {'params': params, 'J': J, 'max_vel': max_vel, 'time_constant': time_constant, 'drift_dist': drift_dist, 'name': base_name}
         simulations.append(simulation)
 
+    write_marker_tables(simulations, marker_folder)
+
+    if kdw12_shard.parse_shard(shard):
+        kdw12_shard.mark_complete(marker_folder, [simulation['name'] for simulation in simulations])
+    if catalog:
+        kdw19_catalog.record_markers(home_folder, simulations, smoothed_data_folder)
+    return simulations
+
+# Writes a marker table of J, max_vel, time_constant and drift_dist, sorted by J, for each parameter corner
+# of simulations
+def write_marker_tables(simulations, marker_folder):
     param_corners = []
     for simulation in simulations:
         params = simulation['params']
@@ -161,7 +181,16 @@ def analyze(home_folder, raw_data_folder = '', marker_folder = '', smoothed_data
 
         output_file_name = f"dataTable_{param_str}.mat"
         sio.savemat(os.path.join(marker_folder, output_file_name), {"dataTable": data_table})
-    
+
+# Max velocity at the end of the pulse, time constant and drift distance after the pulse of one simulation
+def markers(time, dw_position, smooth_vel, current_end, negate = 1):
+    max_vel = negate * np.max(np.abs(smooth_vel[current_end-1]))
+
+    time_constant = time[np.where(np.abs(smooth_vel - smooth_vel[current_end - 1]) < abs(max_vel) / np.exp(1))[0][0]]
+
+    drift_dist = negate * np.abs(dw_position[-1] - dw_position[current_end])
+    return max_vel, time_constant, drift_dist
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Smooths DW motion and extracts max velocity and time constant markers.")
     parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
@@ -170,6 +199,10 @@ if __name__ == "__main__":
     parser.add_argument("--smoothed_data_folder", type=str, default='', help="The directory to store the smoothed time-resolved data")  # Positional argument
     parser.add_argument("--smoothed_img_folder", type=str, default='', help="The directory to store the images")  # Positional argument
     parser.add_argument("--match_params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--shard", type=str, default='', help="Only analyze shard i of N, given as i/N")  # Optional argument
+    parser.add_argument("--storage", type=str, default='full', choices=kdw15_store.STORAGES, help="Storage of the smoothed trajectory .mat files")  # Optional argument
+    parser.add_argument("--compress", action='store_true', help="Also zlib compress compact .mat files, for smaller but slower to load files")  # Optional argument
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the results in the catalog (see kdw19_catalog.py)")  # Optional argument
 
     args = parser.parse_args()
 
@@ -178,4 +211,4 @@ if __name__ == "__main__":
         for i in range (0, len(args.match_params), 2):
             match_params[args.match_params[i]] = args.match_params[i+1]
 
-    analyze(args.home_folder, args.raw_data_folder, args.marker_folder, args.smoothed_data_folder, args.smoothed_img_folder, match_params)
\ No newline at end of file
+    analyze(args.home_folder, args.raw_data_folder, args.marker_folder, args.smoothed_data_folder, args.smoothed_img_folder, match_params, args.shard, args.storage, not args.no_catalog, args.compress)
\ No newline at end of file
@@ -4,9 +4,10 @@ import numpy as np
 import scipy.io as sio
 import pandas as pd
 from scipy.optimize import curve_fit
+import kdw.kdw19_catalog as kdw19_catalog
 
 
-def fit(home_folder, marker_folder = '', lookup_table_folder = ''):
+def fit(home_folder, marker_folder = '', lookup_table_folder = '', catalog = True):
 
     if not os.path.isdir(home_folder):
         raise FileNotFoundError(f"Error: The folder {home_folder} does not exist. Please specify a new folder.")
@@ -22,7 +23,7 @@ def fit(home_folder, marker_folder = '', lookup_table_folder = ''):
         os.mkdir(lookup_table_folder)
 
     # Get a list of all .mat files in the folder
-    mat_files = [f for f in os.listdir(marker_folder) if f.endswith('.mat')]
+    mat_files = sorted(f for f in os.listdir(marker_folder) if f.endswith('.mat'))
 
     # Initialize tables for constants of model fitting
     interp_maxVel_c0 = []
@@ -39,6 +40,7 @@ def fit(home_folder, marker_folder = '', lookup_table_folder = ''):
     
     # List of param corners to track the order
     param_list = []
+    corner_constants = {}
     
     # Process each .mat file
     for file_name in mat_files:
@@ -73,32 +75,13 @@ def fit(home_folder, marker_folder = '', lookup_table_folder = ''):
         current_param = [Aex_s, Ku_s, B_anis_s, A_s, Msat_s, W_s]
         param_list.append(current_param)
     
-        # Fit max velocity to cubic model
-        J_fit = J / J[0]
-        weights = max_vel ** 2
-        print(J_fit)
+        print(J / J[0])
         print(max_vel)
-        cubic_params, _ = curve_fit(cubic_model, J_fit, max_vel, p0=[1, 1, 1, 1], sigma=weights)
-
-        # Adjust coefficients for unscaled J
-        c3 = cubic_params[0] / (J[0] ** 3)
-        c2 = cubic_params[1] / (J[0] ** 2)
-        c1 = cubic_params[2] / J[0]
-        c0 = cubic_params[3]
-
-        # Fit drift distance to linear model
-        drift_params, _ = curve_fit(linear_model, max_vel, drift_dist, p0=[1], sigma=drift_dist ** 1)
-        d0 = 1 / drift_params[0]
-    
-        # Calculate d2
-        time_inv = 1/time_constant - d0
-        d1 = np.linalg.lstsq(J[:, np.newaxis], time_inv, rcond=None)[0][0]
-
-        k0 = d0 * c0
-        k1 = d0 * c1 + d1 * c0
-        k2 = d0 * c2 + d1 * c1
-        k3 = d0 * c3 + d1 * c2
-        k4 = d1 * c3
+        constants = fit_corner(J, max_vel, time_constant, drift_dist)
+        corner_constants[base_name[len('dataTable_'):]] = constants
+        c0, c1, c2, c3 = constants['c0'], constants['c1'], constants['c2'], constants['c3']
+        d0, d1 = constants['d0'], constants['d1']
+        k0, k1, k2, k3, k4 = constants['k0'], constants['k1'], constants['k2'], constants['k3'], constants['k4']
     
         # Append model constants to respective lists
         interp_maxVel_c0.append(c0)
@@ -120,7 +103,43 @@ def fit(home_folder, marker_folder = '', lookup_table_folder = ''):
     
     # Write to .csv file
     df.to_csv(os.path.join(lookup_table_folder, 'lookup_all.csv'), index=False)
-    
+
+    if catalog:
+        kdw19_catalog.record_constants(home_folder, corner_constants)
+    return corner_constants
+    
+# Fits the kinematic model constants of a single parameter corner to its marker table.  Also returns the
+# covariance of the cubic fit of max_vel over the scaled current density J / J_scale (cubic_cov, ordered
+# b3, b2, b1, b0) and of the linear drift fit (drift_cov).
+def fit_corner(J, max_vel, time_constant, drift_dist):
+    # Fit max velocity to cubic model
+    J_fit = J / J[0]
+    weights = max_vel ** 2
+    cubic_params, cubic_cov = curve_fit(cubic_model, J_fit, max_vel, p0=[1, 1, 1, 1], sigma=weights)
+
+    # Adjust coefficients for unscaled J
+    c3 = cubic_params[0] / (J[0] ** 3)
+    c2 = cubic_params[1] / (J[0] ** 2)
+    c1 = cubic_params[2] / J[0]
+    c0 = cubic_params[3]
+
+    # Fit drift distance to linear model
+    drift_params, drift_cov = curve_fit(linear_model, max_vel, drift_dist, p0=[1], sigma=drift_dist ** 1)
+    d0 = 1 / drift_params[0]
+
+    # Calculate d2
+    time_inv = 1/time_constant - d0
+    d1 = np.linalg.lstsq(J[:, np.newaxis], time_inv, rcond=None)[0][0]
+
+    k0 = d0 * c0
+    k1 = d0 * c1 + d1 * c0
+    k2 = d0 * c2 + d1 * c1
+    k3 = d0 * c3 + d1 * c2
+    k4 = d1 * c3
+
+    return {'c0': c0, 'c1': c1, 'c2': c2, 'c3': c3, 'd0': d0, 'd1': d1, 'k0': k0, 'k1': k1, 'k2': k2, 'k3': k3, 'k4': k4,
+            'J_scale': J[0], 'cubic_cov': cubic_cov, 'drift_cov': drift_cov}
+
 def cubic_model(x, b3, b2, b1, b0):
     return b3 * x**3 + b2 * x**2 + b1 * x + b0
 
@@ -133,6 +152,7 @@ if __name__ == "__main__":
     parser.add_argument("--marker_folder", type=str, default='', help="The directory storing the extracted max_vel and drift constants")  # Positional argument
     parser.add_argument("--lookup_table_folder", type=str, default='', help="The directory to put the model lookup table")  # Positional argument
     parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in parameters to include in lookup table")
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the results in the catalog (see kdw19_catalog.py)")  # Optional argument
 
     args = parser.parse_args()
-    fit(args.home_folder, args.marker_folder, args.lookup_table_folder)
\ No newline at end of file
+    fit(args.home_folder, args.marker_folder, args.lookup_table_folder, not args.no_catalog)
\ No newline at end of file
@@ -4,10 +4,13 @@ import numpy as np
 import csv
 import matplotlib.pyplot as plt
 import pandas as pd
-import scipy.io as sio
 import re
+import kdw.kdw12_shard as kdw12_shard
+import kdw.kdw15_store as kdw15_store
+import kdw.kdw19_catalog as kdw19_catalog
+from kdw.runtime.simulate import kinematic_model  # Also used as kdw4_evaluate.kinematic_model
 
-def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', error_img_folder = '', error_folder = '', match_params = {}):
+def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', error_img_folder = '', error_folder = '', match_params = {}, shard = None, catalog = True):
     if not os.path.isdir(home_folder):
         raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
     
@@ -26,8 +29,14 @@ def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', e
     if not os.path.isdir(error_img_folder):
         os.mkdir(error_img_folder)
 
+    # A shard only sees some of each corner's simulations, so its error tables are kept apart until merged
+    if kdw12_shard.parse_shard(shard) and error_folder:
+        raise ValueError(f"Error: A shard writes its error tables to {os.path.join(home_folder, 'shards')}, where merge reads them.  Do not give error_folder with shard.")
     if not error_folder:
-        error_folder = os.path.join(home_folder, 'error_tables')
+        if kdw12_shard.parse_shard(shard):
+            error_folder = kdw12_shard.shard_folder(home_folder, 'error_tables', shard)
+        else:
+            error_folder = os.path.join(home_folder, 'error_tables')
     if not os.path.isdir(error_folder):
         os.mkdir(error_folder)
 
@@ -47,19 +56,13 @@ def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', e
 
         simulations = []
         
-        mat_files = [f for f in os.listdir(smoothed_data_folder) if f.endswith('.mat')]
+        mat_files = sorted(f for f in os.listdir(smoothed_data_folder) if f.endswith('.mat') and kdw12_shard.in_shard(f, shard))
 
         # Loop through each .mat file
         for mat_file in mat_files:
             full_file_path = os.path.join(smoothed_data_folder, mat_file)
             #print(f"INFO: Now reading {full_file_path}")
     
-            # Load data from the .mat file
-            mat_data = sio.loadmat(full_file_path)
-            time = mat_data['time'][0]
-            dw_position = mat_data['dwPosition'][0]
-            dw_velocity = mat_data['dwVelocity'][0]
-    
             # Extract J (current density) and runtime (RT) from the file name
             base_name = os.path.splitext(os.path.basename(mat_file))[0]
             
@@ -84,6 +87,12 @@ def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', e
             else:
                 print(f"INFO: Now reading {base_name}.")
 
+            # Load data from the .mat file, only once its name matches
+            mat_data = kdw15_store.load(full_file_path)
+            time = mat_data['time']
+            dw_position = mat_data['dwPosition']
+            dw_velocity = mat_data['dwVelocity']
+
             if 'J' in params:
                 J = float(params['J'])
                 del params['J']
@@ -146,14 +155,14 @@ def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', e
      
                 ax1.set_xlabel('Time (ns)')
                 ax1.set_ylabel('Domain wall position (nm)', color='blue')
-                ax1.plot(time * 1e9, dw_position * 1e9, 'b-', label='DW position')
-                ax1.plot(time * 1e9, x_model * 1e9, 'b--', label='DW position')
+                ax1.plot(*kdw15_store.decimate(time * 1e9, dw_position * 1e9), 'b-', label='DW position')
+                ax1.plot(*kdw15_store.decimate(time * 1e9, x_model * 1e9), 'b--', label='DW position')
                 ax1.tick_params(axis='y', labelcolor='blue')
     
                 ax2 = ax1.twinx()
                 ax2.set_ylabel('Domain wall velocity (m/s)', color='red')
-                ax2.plot(time * 1e9, dw_velocity, 'r-', label='DW velocity')
-                ax2.plot(time * 1e9, v_model, 'r--', label='DW velocity')
+                ax2.plot(*kdw15_store.decimate(time * 1e9, dw_velocity), 'r-', label='DW velocity')
+                ax2.plot(*kdw15_store.decimate(time * 1e9, v_model), 'r--', label='DW velocity')
                 ax2.tick_params(axis='y', labelcolor='red')
                 
                 fig.tight_layout()
@@ -165,90 +174,87 @@ def evaluate(home_folder, smoothed_data_folder = '', lookup_table_folder = '', e
                 print(f"Could not save figure: {e}")
             plt.close('all')
 
-            rmse_J_on = np.sqrt(np.mean((x_model[0:current_end] - dw_position[0:current_end]-0.1e-9)**2)) / abs(dw_position[-1])
-            rmse_J_off = np.sqrt(np.mean((x_model[current_end:] - dw_position[current_end:])**2)) / abs(dw_position[-1])
-            err_pos = abs((x_model[-1] / dw_position[-1]) - 1)
-            err_maxvel = abs((v_model[current_end-1] / dw_velocity[current_end-1]) - 1)
-            err_mean = np.mean([rmse_J_on, rmse_J_off, err_pos, err_maxvel])
-            print(rmse_J_on, rmse_J_off, err_pos, err_maxvel, err_mean)
+            errors = model_errors(x_model, v_model, dw_position, dw_velocity, current_end)
+            print(errors['rmse_J_on'], errors['rmse_J_off'], errors['err_pos'], errors['err_maxvel'], errors['err_mean'])
 
-            simulation = {'params': params, 'J': J, 'rmse_J_on': rmse_J_on, 'rmse_J_off': rmse_J_off, 'err_pos': err_pos, 'err_maxvel': err_maxvel, 'err_mean': err_mean}
+            simulation = dict({'params': params, 'J': J}, **errors, name=base_name)
             simulations.append(simulation)
 
-        
-        param_corners = []
-        corners_data_table = np.empty((0,11))
-        corners_param_table = np.empty((0,6))
-        all_sims_table = np.empty((0,12))
+    write_error_tables(simulations, error_folder)
+    if kdw12_shard.parse_shard(shard):
+        kdw12_shard.mark_complete(error_folder, [simulation['name'] for simulation in simulations])
+    if catalog:
+        kdw19_catalog.record_errors(home_folder, simulations)
+    return simulations
+
+# Error of the modeled DW trajectory against the simulated one, relative to the final DW position
+def model_errors(x_model, v_model, dw_position, dw_velocity, current_end):
+    rmse_J_on = np.sqrt(np.mean((x_model[0:current_end] - dw_position[0:current_end]-0.1e-9)**2)) / abs(dw_position[-1])
+    rmse_J_off = np.sqrt(np.mean((x_model[current_end:] - dw_position[current_end:])**2)) / abs(dw_position[-1])
+    err_pos = abs((x_model[-1] / dw_position[-1]) - 1)
+    err_maxvel = abs((v_model[current_end-1] / dw_velocity[current_end-1]) - 1)
+    err_mean = np.mean([rmse_J_on, rmse_J_off, err_pos, err_maxvel])
+    return {'rmse_J_on': rmse_J_on, 'rmse_J_off': rmse_J_off, 'err_pos': err_pos, 'err_maxvel': err_maxvel, 'err_mean': err_mean}
+
+# Writes the error table of each corner and the all_corners_error.csv and all_sims_error.csv summaries.
+# Corners are written in order of their parameter string and simulations in order of J, so the tables do not
+# depend on the order the simulations were evaluated in (see kdw12_shard.merge).
+def write_error_tables(simulations, error_folder):
+    simulations = sorted(simulations, key=lambda simulation: (corner_string(simulation['params']), simulation['J']))
+    param_corners = []
+    corners_data_table = np.empty((0,11))
+    corners_param_table = np.empty((0,6))
+    all_sims_table = np.empty((0,12))
+    for simulation in simulations:
+        params = simulation['params']
+        if params not in param_corners:
+            param_corners.append(params)
+    for params in param_corners:
+        data_table = np.empty((0,6))
+        B_anis = (float(params['Ku']) / (0.5 * float(params['Msat'])) - (4 * np.pi * 1e-7) * float(params['Msat']))
         for simulation in simulations:
-            params = simulation['params']
-            if params not in param_corners:
-                param_corners.append(params)
-        for params in param_corners:
-            data_table = np.empty((0,6))
-            B_anis = (float(params['Ku']) / (0.5 * float(params['Msat'])) - (4 * np.pi * 1e-7) * float(params['Msat']))
-            for simulation in simulations:
-                if params != simulation['params']:
-                    continue
+            if params != simulation['params']:
+                continue
 
-                current_data = [simulation['J'], simulation['rmse_J_on'], simulation['rmse_J_off'], simulation['err_pos'], simulation['err_maxvel'], simulation['err_mean']]
-                data_table = np.vstack([data_table, current_data])
-                all_sims_table = np.vstack([all_sims_table, np.hstack([[params['Aex'], params['Ku'], B_anis, params['A'], params['Msat'], params['W']], current_data])])
+            current_data = [simulation['J'], simulation['rmse_J_on'], simulation['rmse_J_off'], simulation['err_pos'], simulation['err_maxvel'], simulation['err_mean']]
+            data_table = np.vstack([data_table, current_data])
+            all_sims_table = np.vstack([all_sims_table, np.hstack([[params['Aex'], params['Ku'], B_anis, params['A'], params['Msat'], params['W']], current_data])])
 
-            data_table = data_table[data_table[:, 0].argsort()]  # Sort by J values
-            
-            columns = ['J', 'rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
-            df = pd.DataFrame(data_table, columns=columns)
-            param_str = '_'.join([f"{param}={params[param]}" for param in sorted(params.keys())])
-            output_file_name = f"error_{param_str}.csv"
-            df.to_csv(os.path.join(error_folder, output_file_name), index=False)
-            
-            rmse_J_on_mean =  np.mean(data_table[:, 1])
-            rmse_J_on_std =    np.std(data_table[:, 1])
-            rmse_J_off_mean = np.mean(data_table[:, 2])
-            rmse_J_off_std =   np.std(data_table[:, 2])
-            err_pos_mean =    np.mean(data_table[:, 3])
-            err_pos_std =      np.std(data_table[:, 3])
-            err_maxvel_mean = np.mean(data_table[:, 4])
-            err_maxvel_std =   np.std(data_table[:, 4])
-            err_mean_mean =   np.mean(data_table[:, 5])
-            err_mean_std =     np.std(data_table[:, 5])
-            err_conf_95 =     err_mean_mean + err_mean_std * 1.96 / np.sqrt(len(data_table[:, 5]))
-            
-            corner_data = [rmse_J_on_mean, rmse_J_on_std, rmse_J_off_mean, rmse_J_off_std, err_pos_mean, err_pos_std, err_maxvel_mean, err_maxvel_std, err_mean_mean, err_mean_std, err_conf_95]
-            corners_data_table = np.vstack([corners_data_table, corner_data])
-            
-            corner_params = [params['Aex'], params['Ku'], B_anis, params['A'], params['Msat'], params['W']]
-            corners_param_table = np.vstack([corners_param_table, corner_params])
+        data_table = data_table[data_table[:, 0].argsort()]  # Sort by J values
+        
+        columns = ['J', 'rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
+        df = pd.DataFrame(data_table, columns=columns)
+        output_file_name = f"error_{corner_string(params)}.csv"
+        df.to_csv(os.path.join(error_folder, output_file_name), index=False)
+        
+        rmse_J_on_mean =  np.mean(data_table[:, 1])
+        rmse_J_on_std =    np.std(data_table[:, 1])
+        rmse_J_off_mean = np.mean(data_table[:, 2])
+        rmse_J_off_std =   np.std(data_table[:, 2])
+        err_pos_mean =    np.mean(data_table[:, 3])
+        err_pos_std =      np.std(data_table[:, 3])
+        err_maxvel_mean = np.mean(data_table[:, 4])
+        err_maxvel_std =   np.std(data_table[:, 4])
+        err_mean_mean =   np.mean(data_table[:, 5])
+        err_mean_std =     np.std(data_table[:, 5])
+        err_conf_95 =     err_mean_mean + err_mean_std * 1.96 / np.sqrt(len(data_table[:, 5]))
+        
+        corner_data = [rmse_J_on_mean, rmse_J_on_std, rmse_J_off_mean, rmse_J_off_std, err_pos_mean, err_pos_std, err_maxvel_mean, err_maxvel_std, err_mean_mean, err_mean_std, err_conf_95]
+        corners_data_table = np.vstack([corners_data_table, corner_data])
+        
+        corner_params = [params['Aex'], params['Ku'], B_anis, params['A'], params['Msat'], params['W']]
+        corners_param_table = np.vstack([corners_param_table, corner_params])
 
-        corners_table_columns = ['Aex', 'Ku', 'B_anis', 'A', 'Msat', 'W', 'rmse_J_on_mean', 'rmse_J_on_std', 'rmse_J_off_mean', 'rmse_J_off_std', 'err_pos_mean', 'err_pos_std', 'err_maxvel_mean', 'err_maxvel_std', 'err_mean_mean', 'err_mean_std', 'err_conf_95']
-        corners_df = pd.DataFrame(np.hstack([corners_param_table, corners_data_table]), columns=corners_table_columns)        
-        corners_df.to_csv(os.path.join(error_folder, 'all_corners_error.csv'), index=False)
+    corners_table_columns = ['Aex', 'Ku', 'B_anis', 'A', 'Msat', 'W', 'rmse_J_on_mean', 'rmse_J_on_std', 'rmse_J_off_mean', 'rmse_J_off_std', 'err_pos_mean', 'err_pos_std', 'err_maxvel_mean', 'err_maxvel_std', 'err_mean_mean', 'err_mean_std', 'err_conf_95']
+    corners_df = pd.DataFrame(np.hstack([corners_param_table, corners_data_table]), columns=corners_table_columns)        
+    corners_df.to_csv(os.path.join(error_folder, 'all_corners_error.csv'), index=False)
 
-        all_sims_columns = ['Aex', 'Ku', 'B_anis', 'A', 'Msat', 'W', 'J', 'rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
-        all_sims_df = pd.DataFrame(all_sims_table, columns=all_sims_columns)
-        all_sims_df.to_csv(os.path.join(error_folder, 'all_sims_error.csv'), index=False)
+    all_sims_columns = ['Aex', 'Ku', 'B_anis', 'A', 'Msat', 'W', 'J', 'rmse_J_on', 'rmse_J_off', 'err_pos', 'err_maxvel', 'err_mean']
+    all_sims_df = pd.DataFrame(all_sims_table, columns=all_sims_columns)
+    all_sims_df.to_csv(os.path.join(error_folder, 'all_sims_error.csv'), index=False)
 
-def kinematic_model(k0, k1, k2, k3, k4, d0, d1, time, current, init_x = 0, init_v = 0, init_a = 0):
-    x = np.zeros_like(time)
-    x[0] = init_x
-    v = np.zeros_like(time)
-    v[0] = init_v
-    a = np.zeros_like(time)
-    a[0] = init_a
-    for i in range(1, len(time)):
-        dt = time[i] - time[i-1]
-        if current[i] > 0:
-            a_j = k4 * current[i]**4 + k3 * current[i]**3 + k2 * current[i]**2 + k1 * current[i] + k0
-        elif current[i] < 0:
-            a_j = -k4 * current[i]**4 + k3 * current[i]**3 - k2 * current[i]**2 + k1 * current[i] - k0
-        else:
-            a_j = 0
-        a_damp = -v[i-1] * (d1 * abs(current[i]) + d0)
-        a[i] = a_j + a_damp
-        v[i] = v[i-1] + a[i] * dt
-        x[i] = x[i-1] + v[i] * dt
-    return x, v, a
+def corner_string(params):
+    return '_'.join([f"{param}={params[param]}" for param in sorted(params.keys())])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extracts DW motion from .txt files.")
@@ -258,6 +264,8 @@ if __name__ == "__main__":
     parser.add_argument("--error_img_folder", type=str, default='', help="Folder to store output error images.")  # Optional argument
     parser.add_argument("--error_folder", type=str, default='', help="Folder to store output error tables.")  # Optional argument
     parser.add_argument("--match_params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--shard", type=str, default='', help="Only evaluate shard i of N, given as i/N")  # Optional argument
+    parser.add_argument("--no_catalog", action='store_true', help="Do not record the results in the catalog (see kdw19_catalog.py)")  # Optional argument
 
     args = parser.parse_args()
 
@@ -268,4 +276,4 @@ if __name__ == "__main__":
         for i in range (0, len(args.match_params), 2):
             match_params[args.match_params[i]] = args.match_params[i+1]
 
-    evaluate(args.home_folder, args.smoothed_data_folder, args.lookup_table_folder, args.error_img_folder, args.error_folder, match_params)
\ No newline at end of file
+    evaluate(args.home_folder, args.smoothed_data_folder, args.lookup_table_folder, args.error_img_folder, args.error_folder, match_params, args.shard, not args.no_catalog)
\ No newline at end of file
@@ -5,7 +5,10 @@ import argparse
 import os
 from scipy.spatial import distance
 
-def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder = ''):
+# Returns a dict of the model parameters, or with intervals=True a tuple (model_params, model_intervals) where
+# model_intervals holds the bootstrap confidence interval (lo, hi) of each model parameter from lookup_all_ci.csv
+# (see kdw16_bootstrap).  The rows of lookup_all_ci.csv must be the corners of lookup_all.csv in the same order.
+def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder = '', intervals = False):
     if not os.path.isdir(home_folder):
         raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
     
@@ -16,6 +19,18 @@ def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder =
     # load the lookup table
     lookup_table = pd.read_csv(os.path.join(lookup_table_folder, 'lookup_all.csv'))
 
+    ci_table = None
+    if intervals:
+        ci_path = os.path.join(lookup_table_folder, 'lookup_all_ci.csv')
+        if not os.path.isfile(ci_path):
+            raise FileNotFoundError(f"Error: The file {ci_path} does not exist.  Run kdw16_bootstrap.py first.")
+        ci_table = pd.read_csv(ci_path)
+        corner_columns = ['Aex', 'Ku', 'A', 'Msat', 'W']
+        if len(ci_table) != len(lookup_table) or not np.allclose(ci_table[corner_columns].values, lookup_table[corner_columns].values, rtol=1e-9, atol=0):
+            raise ValueError(f"Error: The corners of {ci_path} do not match lookup_all.csv.  Run kdw16_bootstrap.py again.")
+        if os.path.getmtime(ci_path) < os.path.getmtime(os.path.join(lookup_table_folder, 'lookup_all.csv')):
+            print(f"WARNING: {ci_path} is older than lookup_all.csv, which may have been refit since.  Run kdw16_bootstrap.py again.")
+
     if not error_tables_folder:
         error_tables_folder = os.path.join(home_folder, 'error_tables')
     if not os.path.isdir(error_tables_folder):
@@ -64,6 +79,21 @@ def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder =
 
         print_model_parameters(final_model_params) # Print the model parameters
 
+        # The interval bounds are interpolated with the same non-negative weights, so they still bound the
+        # interpolated c and d.  The k intervals follow from those by interval arithmetic.
+        if ci_table is not None:
+            bound_names = [f"{name}_{bound}" for name in model_param_names for bound in ['lo', 'hi']]
+            interpolated_bounds = griddata(lt_points, ci_table[bound_names].values, [lookup_values], method='linear', rescale=True)[0]
+            model_intervals = {name: (interpolated_bounds[2*i], interpolated_bounds[2*i+1]) for i, name in enumerate(model_param_names)}
+            c = [model_intervals[f"c{i}"] for i in range(4)]
+            d0, d1 = model_intervals['d0'], model_intervals['d1']
+            model_intervals['k0'] = interval_product(d0, c[0])
+            model_intervals['k1'] = interval_sum(interval_product(d0, c[1]), interval_product(d1, c[0]))
+            model_intervals['k2'] = interval_sum(interval_product(d0, c[2]), interval_product(d1, c[1]))
+            model_intervals['k3'] = interval_sum(interval_product(d0, c[3]), interval_product(d1, c[2]))
+            model_intervals['k4'] = interval_product(d1, c[3])
+            print_model_intervals(model_intervals)
+
         # Estimate the error and confidence based on nearby simulated corners
         if error_table is not None: 
             nearest_distance_scaled = 1000000
@@ -89,6 +119,8 @@ def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder =
                 else:
                     print(f"Confidence: Low - Scaled distance to nearest corner: {round(nearest_distance_scaled,2)}")
 
+        if ci_table is not None:
+            return final_model_params, model_intervals
         return final_model_params
     
     # If one row matched, return the model parameters
@@ -102,6 +134,11 @@ def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder =
             if error_row is not None:
                 print(f"Expected error: {round(error_row['err_mean_mean'] * 100, 2)}%")
                 print(f"Confidence: 95% that error < {round(error_row['err_conf_95'] * 100,2)}%")
+        if ci_table is not None:
+            ci_row = ci_table.loc[model_params.name]
+            model_intervals = {key: (ci_row[f"{key}_lo"], ci_row[f"{key}_hi"]) for key in final_model_params}
+            print_model_intervals(model_intervals)
+            return final_model_params, model_intervals
         return final_model_params
     
     # If multiple rows matched, raise an error
@@ -114,6 +151,18 @@ def print_model_parameters(model_params):
     for param, value in model_params.items():
         print(f"\t{param}: {value}")        
 
+def print_model_intervals(model_intervals):
+    print(f"Model parameter confidence intervals:")
+    for param, (lo, hi) in model_intervals.items():
+        print(f"\t{param}: [{lo}, {hi}]")
+
+def interval_product(a, b):
+    products = [a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]]
+    return (min(products), max(products))
+
+def interval_sum(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
 # Find the row with matching parameters in the error table
 # Assumes at most one row will match
 def find_error_row(error_table, params):
@@ -136,6 +185,7 @@ if __name__ == "__main__":
     parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
     parser.add_argument("--error_tables_folder", type=str, default='', help="Folder to store output error tables.")  # Optional argument
     parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--intervals", action='store_true', help="Also report confidence intervals from lookup_all_ci.csv")  # Optional argument
 
     args = parser.parse_args()
 
@@ -146,4 +196,4 @@ if __name__ == "__main__":
         for i in range (0, len(args.params), 2):
             params[args.params[i]] = float(args.params[i+1])
 
-    lookup(args.home_folder, params, args.lookup_table_folder, args.error_tables_folder)
+    lookup(args.home_folder, params, args.lookup_table_folder, args.error_tables_folder, args.intervals)
@@ -0,0 +1,344 @@
+import argparse
+import os
+import re
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+# Default DW_MTJ parameters, matching veriloga/veriloga.va
+DW_MTJ_DEFAULTS = {
+    'R_P': 10e3, 'R_AP': 30e3, 'R_TR': 3.9e3,
+    'X_init': 0.0, 'L_TR': 120e-9, 'MTJ_L': 20e-9, 'MTJ_R': 100e-9,
+    'Area': 60e-18, 'C_R': 0.25,
+    'k0': 8860118.3062847, 'k1': -0.00487689910818454, 'k2': -1.2056181829813014e-15,
+    'k3': 4.894801586150407e-27, 'k4': -3.611453763100189e-39,
+    'd0': 49154617.19999064, 'd1': 6.736395204757528e-05,
+    'p0': 80e9, 'p1': 0.25,
+}
+
+GROUND_NODES = ('0', 'gnd', 'GND')
+
+SPICE_SUFFIXES = {'t': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3, 'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15}
+
+
+def new_netlist():
+    return {'resistors': [], 'vsources': [], 'isources': [], 'devices': [], 'models': {}}
+
+def add_resistor(netlist, name, n1, n2, resistance):
+    netlist['resistors'].append({'name': name, 'nodes': (n1, n2), 'value': float(resistance)})
+
+# waveform is a float (DC), ('PWL', [t0, v0, t1, v1, ...]) or ('PULSE', [v1, v2, td, tr, tf, pw, per])
+def add_vsource(netlist, name, n_plus, n_minus, waveform):
+    netlist['vsources'].append({'name': name, 'nodes': (n_plus, n_minus), 'waveform': waveform})
+
+def add_isource(netlist, name, n_plus, n_minus, waveform):
+    netlist['isources'].append({'name': name, 'nodes': (n_plus, n_minus), 'waveform': waveform})
+
+# Model parameters may be given directly or through a named model, e.g. the output of kdw6_lookup.lookup
+def add_device(netlist, name, l, r, m, model = '', **params):
+    netlist['devices'].append({'name': name, 'nodes': (l, r, m), 'model': model, 'params': params})
+
+def add_model(netlist, name, **params):
+    netlist['models'][name] = params
+
+def parse_value(value_str):
+    value_str = value_str.strip()
+    match = re.match(r'^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)([a-zA-Z]*)$', value_str)
+    if not match:
+        raise ValueError(f"Error: Could not parse value {value_str}.")
+    value = float(match.group(1))
+    suffix = match.group(2).lower()
+    if suffix.startswith('meg'):
+        return value * SPICE_SUFFIXES['meg']
+    if suffix and suffix[0] in SPICE_SUFFIXES:
+        return value * SPICE_SUFFIXES[suffix[0]]
+    return value
+
+def parse_waveform(tokens):
+    spec = ' '.join(tokens)
+    match = re.match(r'^(PWL|PULSE)\s*\((.*)\)$', spec, re.IGNORECASE)
+    if match:
+        return (match.group(1).upper(), [parse_value(v) for v in match.group(2).replace(',', ' ').split()])
+    if tokens and tokens[0].upper() == 'DC':
+        tokens = tokens[1:]
+    if len(tokens) != 1:
+        raise ValueError(f"Error: Could not parse source waveform {spec}.")
+    return parse_value(tokens[0])
+
+def parse_params(tokens):
+    params = {}
+    for token in tokens:
+        key, value = token.split('=')
+        params[key] = parse_value(value)
+    return params
+
+# Reads a SPICE-like netlist:
+#   R<name> n1 n2 value
+#   V<name> n+ n- [DC] value | PWL(t0 v0 t1 v1 ...) | PULSE(v1 v2 td tr tf pw per)
+#   I<name> n+ n- [DC] value | PWL(...) | PULSE(...)
+#   X<name> L R M [model] [param=value ...]
+#   .model <name> DW_MTJ param=value ...
+def parse_netlist(netlist_file):
+    if not os.path.isfile(netlist_file):
+        raise FileNotFoundError(f"Error: The file {netlist_file} does not exist.")
+
+    netlist = new_netlist()
+    with open(netlist_file, mode='r') as infile:
+        for line_number, line in enumerate(infile, start=1):
+            line = line.split(';')[0].strip()
+            if not line or line.startswith('*'):
+                continue
+            tokens = line.split()
+            kind = tokens[0][0].upper()
+            if tokens[0].lower() == '.model':
+                add_model(netlist, tokens[1], **parse_params(tokens[3:]))
+            elif tokens[0].lower() == '.end':
+                break
+            elif kind == 'R':
+                add_resistor(netlist, tokens[0], tokens[1], tokens[2], parse_value(tokens[3]))
+            elif kind == 'V':
+                add_vsource(netlist, tokens[0], tokens[1], tokens[2], parse_waveform(tokens[3:]))
+            elif kind == 'I':
+                add_isource(netlist, tokens[0], tokens[1], tokens[2], parse_waveform(tokens[3:]))
+            elif kind == 'X':
+                model = tokens[4] if len(tokens) > 4 and '=' not in tokens[4] else ''
+                params = parse_params([t for t in tokens[4:] if '=' in t])
+                add_device(netlist, tokens[0], tokens[1], tokens[2], tokens[3], model, **params)
+            else:
+                raise ValueError(f"Error: Unsupported netlist element on line {line_number} of {netlist_file}: {line}")
+    return netlist
+
+def waveform_value(waveform, t):
+    if not isinstance(waveform, tuple):
+        return float(waveform)
+    kind, values = waveform
+    if kind == 'PWL':
+        return np.interp(t, values[0::2], values[1::2])
+    v1, v2, td, tr, tf, pw, per = (list(values) + [0, 0, 0, 0, 0, np.inf, np.inf][len(values):])[:7]
+    if t < td:
+        return v1
+    t_local = (t - td) % per if per > 0 else t - td
+    if t_local < tr:
+        return v1 + (v2 - v1) * t_local / tr
+    if t_local < tr + pw:
+        return v2
+    if t_local < tr + pw + tf:
+        return v2 + (v1 - v2) * (t_local - tr - pw) / tf
+    return v1
+
+# Compiles a netlist into index and parameter arrays so every device is stepped as a vector
+def compile_netlist(netlist):
+    nodes = {}
+    def node_index(name):
+        if name in GROUND_NODES:
+            return -1
+        if name not in nodes:
+            nodes[name] = len(nodes)
+        return nodes[name]
+
+    res_nodes = np.array([[node_index(n) for n in r['nodes']] for r in netlist['resistors']], dtype=int).reshape(-1, 2)
+    res_g = np.array([1 / r['value'] for r in netlist['resistors']])
+
+    devices = netlist['devices']
+    dev_nodes = np.array([[node_index(n) for n in d['nodes']] for d in devices], dtype=int).reshape(-1, 3)
+    dev_a = np.array([node_index(f"{d['name']}.A") for d in devices], dtype=int)
+
+    dev_params = {}
+    for param, default in DW_MTJ_DEFAULTS.items():
+        values = []
+        for device in devices:
+            model_params = netlist['models'].get(device['model'], {}) if device['model'] else {}
+            if device['model'] and device['model'] not in netlist['models']:
+                raise ValueError(f"Error: Model {device['model']} of device {device['name']} is not defined.")
+            values.append(float(device['params'].get(param, model_params.get(param, default))))
+        dev_params[param] = np.array(values)
+
+    vsrc_nodes = np.array([[node_index(n) for n in s['nodes']] for s in netlist['vsources']], dtype=int).reshape(-1, 2)
+    isrc_nodes = np.array([[node_index(n) for n in s['nodes']] for s in netlist['isources']], dtype=int).reshape(-1, 2)
+
+    n_nodes = len(nodes)
+    n_vsrc = len(netlist['vsources'])
+
+    # R_L and R_R are proportionately calculated relative to the center of the MTJ
+    R_R = (dev_params['L_TR'] - (dev_params['MTJ_R'] + dev_params['MTJ_L']) / 2) / dev_params['L_TR'] * dev_params['R_TR']
+    R_L = dev_params['R_TR'] - R_R
+
+    # Static conductances: resistors plus the L-A and A-R branches of every device
+    branch_p = np.concatenate([res_nodes[:, 0], dev_nodes[:, 0], dev_a])
+    branch_n = np.concatenate([res_nodes[:, 1], dev_a, dev_nodes[:, 1]])
+    branch_g = np.concatenate([res_g, 1 / R_L, 1 / R_R])
+    rows, cols, vals = stamp_conductances(branch_p, branch_n, branch_g)
+
+    # Voltage sources add one row and column each
+    src_rows = n_nodes + np.arange(n_vsrc)
+    for k, (p, n) in enumerate(vsrc_nodes):
+        for node, sign in ((p, 1.0), (n, -1.0)):
+            if node >= 0:
+                rows = np.concatenate([rows, [node, src_rows[k]]])
+                cols = np.concatenate([cols, [src_rows[k], node]])
+                vals = np.concatenate([vals, [sign, sign]])
+
+    return {
+        'nodes': nodes, 'n_nodes': n_nodes, 'size': n_nodes + n_vsrc,
+        'static': (rows, cols, vals),
+        'dev_nodes': dev_nodes, 'dev_a': dev_a, 'dev_params': dev_params,
+        'R_L': R_L, 'R_R': R_R,
+        'vsrc_nodes': vsrc_nodes, 'vsrc_waveforms': [s['waveform'] for s in netlist['vsources']],
+        'vsrc_dc': np.array([0.0 if isinstance(s['waveform'], tuple) else float(s['waveform']) for s in netlist['vsources']]),
+        'isrc_nodes': isrc_nodes, 'isrc_waveforms': [s['waveform'] for s in netlist['isources']],
+        'isrc_dc': np.array([0.0 if isinstance(s['waveform'], tuple) else float(s['waveform']) for s in netlist['isources']]),
+        'device_names': [d['name'] for d in devices],
+    }
+
+# COO stamps of conductances g between nodes p and n, with ground (-1) rows and columns dropped
+def stamp_conductances(p, n, g):
+    rows = np.concatenate([p, n, p, n])
+    cols = np.concatenate([p, n, n, p])
+    vals = np.concatenate([g, g, -g, -g])
+    keep = (rows >= 0) & (cols >= 0)
+    return rows[keep], cols[keep], vals[keep]
+
+def assemble(circuit, g_m):
+    rows, cols, vals = circuit['static']
+    m_rows, m_cols, m_vals = stamp_conductances(circuit['dev_a'], circuit['dev_nodes'][:, 2], g_m)
+    size = circuit['size']
+    matrix = sp.coo_matrix((np.concatenate([vals, m_vals]), (np.concatenate([rows, m_rows]), np.concatenate([cols, m_cols]))), shape=(size, size))
+    return matrix.tocsc()
+
+# DC sources are evaluated once, time varying sources at every step
+def source_values(waveforms, t, dc_values):
+    values = dc_values.copy()
+    for k, waveform in enumerate(waveforms):
+        if isinstance(waveform, tuple):
+            values[k] = waveform_value(waveform, t)
+    return values
+
+def rhs(circuit, t):
+    b = np.zeros(circuit['size'] + 1)  # index -1 collects ground contributions
+    i_values = source_values(circuit['isrc_waveforms'], t, circuit['isrc_dc'])
+    np.add.at(b, circuit['isrc_nodes'][:, 0], -i_values)
+    np.add.at(b, circuit['isrc_nodes'][:, 1], i_values)
+    n_nodes = circuit['n_nodes']
+    b[n_nodes:n_nodes + len(circuit['vsrc_waveforms'])] = source_values(circuit['vsrc_waveforms'], t, circuit['vsrc_dc'])
+    return b[:-1]
+
+def mtj_resistance(x, p):
+    r_m = ((p['MTJ_R'] - p['MTJ_L']) * p['R_P'] * p['R_AP']) / ((p['R_P'] * (x - p['MTJ_L'])) + (p['R_AP'] * (p['MTJ_R'] - x)))
+    r_m = np.where(x <= p['MTJ_L'], p['R_P'], r_m)
+    return np.where(x >= p['MTJ_R'], p['R_AP'], r_m)
+
+# One explicit step of the veriloga DW_MTJ dynamics for every device at once
+def dw_mtj_step(x, v, J, dt, p):
+    J_abs = np.abs(J)
+    a_J = np.sign(J) * (p['k4'] * J_abs**4 + p['k3'] * J_abs**3 + p['k2'] * J_abs**2 + p['k1'] * J_abs + p['k0'])
+    a = a_J - (p['d0'] + p['d1'] * J_abs) * v
+    pinned = (J_abs < p['p0']) & (np.abs(v) < p['p1'])
+    a = np.where(pinned, -(10 * p['d0']) * v, a)  # Static friction
+    v = v + a * dt
+    x = x + v * dt
+
+    # Edge bounce
+    low = x <= 0
+    high = x >= p['L_TR']
+    x = np.where(low, 0, np.where(high, p['L_TR'], x))
+    v = np.where(low | high, -p['C_R'] * v, v)
+    return x, v, a
+
+# Solves the network at each time step with a cached sparse LU factorization.  Only the A-M conductances
+# change with DW position; while few devices have changed since the last factorization, the change is
+# applied as a low rank (Woodbury) update instead of refactoring.  As in the veriloga model, the DW state is
+# updated at each time t with the current of the solve at t, so the saved x and v at t are those after the step,
+# and the saved r_m and node voltages are those of the solve at t that produced them.
+def simulate(netlist, time, save_every = 1, save_nodes = None, max_lowrank = 16, refactor_tol = 1e-9):
+    circuit = compile_netlist(netlist) if 'static' not in netlist else netlist
+    p = circuit['dev_params']
+    dev_l, dev_r, dev_m = circuit['dev_nodes'].T
+    dev_a = circuit['dev_a']
+    n_devices = len(dev_a)
+
+    x = p['X_init'].copy()
+    v = np.zeros(n_devices)
+    a = np.zeros(n_devices)
+
+    if save_nodes is None:
+        save_nodes = list(circuit['nodes'].keys())
+    save_index = np.array([circuit['nodes'][n] for n in save_nodes], dtype=int)
+
+    n_saved = (len(time) + save_every - 1) // save_every
+    results = {
+        'time': np.zeros(n_saved), 'x': np.zeros((n_saved, n_devices)), 'v': np.zeros((n_saved, n_devices)),
+        'r_m': np.zeros((n_saved, n_devices)), 'node_names': save_nodes, 'node_voltages': np.zeros((n_saved, len(save_index))),
+        'device_names': circuit['device_names'],
+    }
+
+    g_base = None
+    lu = None
+    lowrank_cache = (None, None)
+    factorizations = 0
+    prev_time = time[0]
+    for i, t in enumerate(time):
+        g_m = 1 / mtj_resistance(x, p)
+        b = rhs(circuit, t)
+
+        changed = np.empty(0, dtype=int) if g_base is None else np.nonzero(np.abs(g_m - g_base) > refactor_tol * g_base)[0]
+        if lu is None or len(changed) > max_lowrank:
+            # Nodal matrices are structurally symmetric, so order on A^T + A to keep fill-in low
+            lu = splu(assemble(circuit, g_m), permc_spec='MMD_AT_PLUS_A')
+            g_base = g_m
+            lowrank_cache = (None, None)
+            factorizations += 1
+            solution = lu.solve(b)
+        elif len(changed) == 0:
+            solution = lu.solve(b)
+        else:
+            # Woodbury update, G = G_base + U diag(dg) U^T, with U the A-M incidence of the changed devices
+            if not np.array_equal(lowrank_cache[0], changed):
+                U = np.zeros((circuit['size'], len(changed)))
+                a_idx, m_idx = dev_a[changed], dev_m[changed]
+                cols = np.arange(len(changed))
+                U[a_idx, cols] = 1.0
+                U[m_idx[m_idx >= 0], cols[m_idx >= 0]] = -1.0
+                lowrank_cache = (changed, (U, lu.solve(U)))
+            U, Z = lowrank_cache[1]
+            y = lu.solve(b)
+            S = np.diag(1 / (g_m[changed] - g_base[changed])) + U.T @ Z
+            solution = y - Z @ np.linalg.solve(S, U.T @ y)
+
+        voltages = np.append(solution[:circuit['n_nodes']], 0.0)  # index -1 is ground
+        v_l, v_r, v_a = voltages[dev_l], voltages[dev_r], voltages[dev_a]
+
+        # If the DW is left of the MTJ center, the stimulating current is measured between L and A
+        i_dw = np.where(x < (p['MTJ_L'] + p['MTJ_R']) / 2, (v_l - v_a) / circuit['R_L'], (v_a - v_r) / circuit['R_R'])
+        J = i_dw / p['Area']
+
+        x, v, a = dw_mtj_step(x, v, J, t - prev_time, p)
+        prev_time = t
+
+        if i % save_every == 0:
+            s = i // save_every
+            results['time'][s] = t
+            results['x'][s] = x
+            results['v'][s] = v
+            results['r_m'][s] = 1 / g_m
+            results['node_voltages'][s] = voltages[save_index]
+
+    results['factorizations'] = factorizations
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates a resistive network of DW_MTJ devices.")
+    parser.add_argument("netlist_file", type=str, help="The netlist to simulate")  # Positional argument
+    parser.add_argument("--tstop", type=float, default=200e-9, help="Simulation stop time (s)")  # Optional argument
+    parser.add_argument("--tstep", type=float, default=1e-11, help="Simulation time step (s)")  # Optional argument
+    parser.add_argument("--save_every", type=int, default=1, help="Save every n-th time step")  # Optional argument
+    parser.add_argument("--output_file", type=str, default='', help="The .npz file to store the results")  # Optional argument
+
+    args = parser.parse_args()
+
+    time = np.arange(0, args.tstop + args.tstep / 2, args.tstep)
+    results = simulate(parse_netlist(args.netlist_file), time, args.save_every)
+
+    output_file = args.output_file if args.output_file else os.path.splitext(args.netlist_file)[0] + '.npz'
+    np.savez(output_file, time=results['time'], x=results['x'], v=results['v'], r_m=results['r_m'],
+             node_voltages=results['node_voltages'], node_names=np.array(results['node_names']), device_names=np.array(results['device_names']))
+    print(f"INFO: {len(results['device_names'])} devices, {results['factorizations']} factorizations. Results saved to {output_file}")
@@ -0,0 +1,144 @@
+import argparse
+import itertools
+import os
+import numpy as np
+import kdw.kdw6_lookup as kdw6_lookup
+import kdw.runtime.simulate as runtime_simulate
+
+# Records written by simulate_stream when an output_file is given
+STREAM_DTYPE = np.dtype([('time', 'f8'), ('current', 'f8'), ('x', 'f8'), ('v', 'f8'), ('a', 'f8')])
+
+# Each waveform below is a generator of (time, current) blocks of at most block_size samples, so stimulus
+# sequences of any length are held in memory one block at a time.
+
+def uniform_times(t_start, t_stop, dt, block_size):
+    n_samples = int(np.floor((t_stop - t_start) / dt + 1e-9)) + 1
+    for start in range(0, n_samples, block_size):
+        yield t_start + dt * np.arange(start, min(start + block_size, n_samples))
+
+# Piecewise linear waveform through (times[i], currents[i])
+def pwl_blocks(times, currents, dt, block_size = 100000):
+    times = np.asarray(times, dtype=float)
+    currents = np.asarray(currents, dtype=float)
+    if len(times) != len(currents) or np.any(np.diff(times) < 0):
+        raise ValueError(f"Error: PWL times must be increasing and match the number of current values.")
+    for time in uniform_times(times[0], times[-1], dt, block_size):
+        yield time, np.interp(time, times, currents)
+
+# Train of count rectangular pulses of amplitude J and length width, one every period, starting at delay
+def pulse_train_blocks(J, width, period, count, dt, block_size = 100000, delay = 0, t_stop = None):
+    if width > period:
+        raise ValueError(f"Error: Pulse width {width} is longer than the period {period}.")
+    if t_stop is None:
+        t_stop = delay + period * count
+    for time in uniform_times(0, t_stop, dt, block_size):
+        t_local = time - delay
+        pulse_index = np.floor(t_local / period)
+        on = (t_local >= 0) & (pulse_index < count) & (t_local - pulse_index * period <= width)
+        yield time, np.where(on, J, 0.0)
+
+# Waveform read from a two column (time, current) .npy or .csv file.  .npy files are memory mapped and
+# .csv files are parsed block by block.
+def file_blocks(waveform_file, block_size = 100000, skiprows = 0, delimiter = ','):
+    if not os.path.isfile(waveform_file):
+        raise FileNotFoundError(f"Error: The file {waveform_file} does not exist.")
+
+    if waveform_file.endswith('.npy'):
+        data = np.load(waveform_file, mmap_mode='r')
+        if data.ndim != 2 or data.shape[1] < 2:
+            raise ValueError(f"Error: {waveform_file} must contain a (samples, 2) array of time and current.")
+        for start in range(0, data.shape[0], block_size):
+            block = np.array(data[start:start + block_size, :2], dtype=float)
+            yield block[:, 0], block[:, 1]
+    else:
+        with open(waveform_file, mode='r') as infile:
+            for _ in range(skiprows):
+                next(infile)
+            while True:
+                lines = list(itertools.islice(infile, block_size))
+                if not lines:
+                    break
+                block = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+                yield block[:, 0], block[:, 1]
+
+# Runs the kinematic model over a stream of (time, current) blocks, carrying the (x, v, a) state and the
+# last sample time from block to block.  Every decimate-th sample is kept, either in memory or appended to
+# output_file as STREAM_DTYPE records (see load_stream).
+def simulate_stream(model_params, blocks, init_x = 0, init_v = 0, init_a = 0, decimate = 1, output_file = ''):
+    k0, k1, k2, k3, k4 = [float(model_params[k]) for k in ['k0', 'k1', 'k2', 'k3', 'k4']]
+    d0, d1 = float(model_params['d0']), float(model_params['d1'])
+
+    outfile = open(output_file, mode='wb') if output_file else None
+    kept = []
+    state = None  # (t, x, v, a) of the last sample of the previous block
+    n_samples = 0
+    try:
+        for time, current in blocks:
+            if len(time) == 0:
+                continue
+            if state is None:
+                x, v, a = runtime_simulate.kinematic_model(k0, k1, k2, k3, k4, d0, d1, time, current, init_x, init_v, init_a)
+            else:
+                # Prepend the last sample so the first step of this block uses the true dt
+                x, v, a = runtime_simulate.kinematic_model(k0, k1, k2, k3, k4, d0, d1, np.concatenate([[state[0]], time]),
+                                                        np.concatenate([[0], current]), state[1], state[2], state[3])
+                x, v, a = x[1:], v[1:], a[1:]
+            state = (time[-1], x[-1], v[-1], a[-1])
+
+            keep = (n_samples + np.arange(len(time))) % decimate == 0
+            n_samples += len(time)
+            records = np.empty(np.count_nonzero(keep), dtype=STREAM_DTYPE)
+            records['time'], records['current'] = time[keep], current[keep]
+            records['x'], records['v'], records['a'] = x[keep], v[keep], a[keep]
+            if outfile is not None:
+                records.tofile(outfile)
+            else:
+                kept.append(records)
+    finally:
+        if outfile is not None:
+            outfile.close()
+
+    if outfile is not None:
+        return load_stream(output_file)
+    return np.concatenate(kept) if kept else np.empty(0, dtype=STREAM_DTYPE)
+
+# Memory maps the records written by simulate_stream
+def load_stream(output_file):
+    if not os.path.isfile(output_file):
+        raise FileNotFoundError(f"Error: The file {output_file} does not exist.")
+    if os.path.getsize(output_file) == 0:
+        return np.empty(0, dtype=STREAM_DTYPE)
+    return np.memmap(output_file, dtype=STREAM_DTYPE, mode='r')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates DW motion for an arbitrary current waveform in constant memory.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--pwl", type=float, default=[], nargs='+', help="PWL waveform like: t0 J0 t1 J1 ...")  # Optional argument
+    parser.add_argument("--pulse_train", type=float, default=[], nargs=4, help="Pulse train like: J width period count")  # Optional argument
+    parser.add_argument("--waveform_file", type=str, default='', help="Two column (time, current) .csv or .npy file")  # Optional argument
+    parser.add_argument("--skiprows", type=int, default=0, help="Header rows to skip in a .csv waveform file")  # Optional argument
+    parser.add_argument("--dt", type=float, default=1e-11, help="Time step of PWL and pulse train waveforms (s)")  # Optional argument
+    parser.add_argument("--block_size", type=int, default=100000, help="Samples per simulated block")  # Optional argument
+    parser.add_argument("--decimate", type=int, default=1, help="Keep every n-th sample")  # Optional argument
+    parser.add_argument("--output_file", type=str, default='stream.dat', help="File to write the simulated records to")  # Optional argument
+
+    args = parser.parse_args()
+
+    params = {}
+    for i in range (0, len(args.params), 2):
+        params[args.params[i]] = float(args.params[i+1])
+    model_params = kdw6_lookup.lookup(args.home_folder, params)
+
+    if args.pwl:
+        blocks = pwl_blocks(args.pwl[0::2], args.pwl[1::2], args.dt, args.block_size)
+    elif args.pulse_train:
+        J, width, period, count = args.pulse_train
+        blocks = pulse_train_blocks(J, width, period, int(count), args.dt, args.block_size)
+    elif args.waveform_file:
+        blocks = file_blocks(args.waveform_file, args.block_size, args.skiprows)
+    else:
+        raise ValueError(f"Error: One of --pwl, --pulse_train or --waveform_file must be given.")
+
+    records = simulate_stream(model_params, blocks, decimate=args.decimate, output_file=args.output_file)
+    print(f"INFO: Wrote {len(records)} records to {args.output_file}. Final DW position: {records['x'][-1]} m")
@@ -0,0 +1,137 @@
+import argparse
+import numpy as np
+import kdw.kdw6_lookup as kdw6_lookup
+
+MODEL_PARAM_NAMES = ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']
+
+# Stacks model parameter dicts, e.g. several results of kdw6_lookup.lookup, into one dict of arrays
+def stack_model_params(model_params_list):
+    return {k: np.array([float(model_params[k]) for model_params in model_params_list]) for k in MODEL_PARAM_NAMES}
+
+def as_arrays(model_params):
+    return {k: np.asarray(model_params[k], dtype=float) for k in MODEL_PARAM_NAMES}
+
+# Closed-form response of the kinematic model to a constant current density J applied for time t, starting
+# from position x0 and velocity v0.  With a = a_J - (d0 + d1|J|) v the velocity relaxes exponentially
+# towards a_J / (d0 + d1|J|), the max velocity of the fitted cubic.  J = 0 gives the drift after a pulse.
+def segment_response(model_params, J, t, x0 = 0, v0 = 0):
+    p = as_arrays(model_params)
+    J = np.asarray(J, dtype=float)
+    J_abs = np.abs(J)
+    a_J = np.sign(J) * (p['k4'] * J_abs**4 + p['k3'] * J_abs**3 + p['k2'] * J_abs**2 + p['k1'] * J_abs + p['k0'])
+    g = p['d0'] + p['d1'] * J_abs
+    v_inf = a_J / g
+    decay = np.exp(-g * t)
+    v = v_inf + (v0 - v_inf) * decay
+    x = x0 + v_inf * t + (v0 - v_inf) * (-np.expm1(-g * t)) / g
+    return x, v
+
+# Velocity at the end of a pulse of amplitude J and length width
+def end_velocity(model_params, J, width, x0 = 0, v0 = 0):
+    return segment_response(model_params, J, width, x0, v0)[1]
+
+# Position at which the DW comes to rest after a pulse of amplitude J and length width
+def final_position(model_params, J, width, x0 = 0, v0 = 0):
+    x, v = segment_response(model_params, J, width, x0, v0)
+    return x + v / np.asarray(model_params['d0'], dtype=float)
+
+# Time at which the DW first reaches x_target (inf if it never does).  Assumes the DW moves monotonically,
+# which holds when v0 is zero or has the same sign as the drive.
+def arrival_time(model_params, J, width, x_target, x0 = 0, v0 = 0, xtol = 1e-15, max_iter = 100):
+    J, width, x_target, x0, v0 = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in (J, width, x_target, x0, v0)])
+    p = {k: np.broadcast_to(v, J.shape) for k, v in as_arrays(model_params).items()}
+    direction = np.sign(x_target - x0)
+    x_end, v_end = segment_response(p, J, width, x0, v0)
+
+    # Reached during the pulse: bisect on time within [0, width]
+    in_pulse = (x_end - x_target) * direction >= 0
+    t = bisect(lambda t_mid: (segment_response(p, J, t_mid, x0, v0)[0] - x_target) * direction,
+               np.zeros(J.shape), width, xtol=xtol, max_iter=max_iter)
+
+    # Otherwise the drift x_end + v_end (1 - exp(-d0 s)) / d0 must cover the remaining distance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (x_target - x_end) * p['d0'] / v_end
+        drift_time = np.where((ratio > 0) & (ratio < 1), -np.log1p(-ratio) / p['d0'], np.inf)
+    return np.where(direction == 0, 0.0, np.where(in_pulse, t, width + drift_time))
+
+# Vectorized bisection for roots of f within [lo, hi].  f must change sign across each bracket; entries
+# without a sign change are returned as nan.
+def bisect(f, lo, hi, xtol = 0, rtol = 1e-12, max_iter = 200):
+    lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=float), np.asarray(hi, dtype=float))
+    lo, hi = lo.copy(), hi.copy()
+    f_lo = f(lo)
+    f_hi = f(hi)
+    valid = np.sign(f_lo) * np.sign(f_hi) <= 0
+    for _ in range(max_iter):
+        if np.all(np.abs(hi - lo) <= xtol + rtol * np.abs(lo + hi) / 2):
+            break
+        mid = (lo + hi) / 2
+        f_mid = f(mid)
+        left = np.sign(f_mid) * np.sign(f_lo) <= 0
+        hi = np.where(left, mid, hi)
+        lo = np.where(left, lo, mid)
+        f_lo = np.where(left, f_lo, f_mid)
+    return np.where(valid, (lo + hi) / 2, np.nan)
+
+# Solves for the pulse amplitude J (solve_for='J', with width given) or the pulse length (solve_for='width',
+# with J given) that yields target for the quantity:
+#   'position' - final resting position of the DW
+#   'velocity' - DW velocity at the end of the pulse
+#   'arrival'  - time at which the DW reaches x_target
+# All arguments broadcast against each other and against the arrays in model_params, so many devices and
+# targets are solved at once.  bounds brackets the unknown; unbracketed entries are returned as nan.
+def solve_pulse(model_params, target, quantity = 'position', solve_for = 'J', J = None, width = None, x_target = None,
+                x0 = 0, v0 = 0, bounds = None, rtol = 1e-10, max_iter = 200):
+    if quantity == 'position':
+        response = lambda J_, width_: final_position(model_params, J_, width_, x0, v0)
+    elif quantity == 'velocity':
+        response = lambda J_, width_: end_velocity(model_params, J_, width_, x0, v0)
+    elif quantity == 'arrival':
+        if x_target is None:
+            raise ValueError(f"Error: x_target must be given to solve for arrival time.")
+        response = lambda J_, width_: arrival_time(model_params, J_, width_, x_target, x0, v0)
+    else:
+        raise ValueError(f"Error: Unknown quantity {quantity}.  Must be one of 'position', 'velocity' or 'arrival'.")
+
+    if solve_for == 'J':
+        if width is None:
+            raise ValueError(f"Error: width must be given to solve for J.")
+        lo, hi = bounds if bounds is not None else (-8e11, 8e11)
+        f = lambda J_: response(J_, width) - target
+    elif solve_for == 'width':
+        if J is None:
+            raise ValueError(f"Error: J must be given to solve for width.")
+        lo, hi = bounds if bounds is not None else (0, 1e-6)
+        f = lambda width_: response(J, width_) - target
+    else:
+        raise ValueError(f"Error: Cannot solve for {solve_for}.  Must be 'J' or 'width'.")
+
+    shape = np.broadcast_shapes(*[np.shape(a) for a in (target, J, width, x_target, x0, v0) if a is not None],
+                                *[np.shape(model_params[k]) for k in MODEL_PARAM_NAMES])
+    solution = bisect(f, np.full(shape, lo, dtype=float), np.full(shape, hi, dtype=float), rtol=rtol, max_iter=max_iter)
+    if np.any(np.isnan(solution)):
+        print(f"WARNING: {np.count_nonzero(np.isnan(solution))} of {solution.size} targets are not bracketed by {(lo, hi)}.")
+    return solution
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finds the pulse amplitude or length that moves the DW to a target.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--target", type=float, nargs='+', required=True, help="Target final position (m), end velocity (m/s) or arrival time (s)")  # Optional argument
+    parser.add_argument("--quantity", type=str, default='position', help="One of position, velocity or arrival")  # Optional argument
+    parser.add_argument("--solve_for", type=str, default='J', help="J or width")  # Optional argument
+    parser.add_argument("--J", type=float, default=None, help="Pulse amplitude when solving for width (A/m^2)")  # Optional argument
+    parser.add_argument("--width", type=float, default=None, help="Pulse length when solving for J (s)")  # Optional argument
+    parser.add_argument("--x_target", type=float, default=None, help="Target position when solving for arrival time (m)")  # Optional argument
+    parser.add_argument("--bounds", type=float, default=None, nargs=2, help="Bracket of the unknown")  # Optional argument
+
+    args = parser.parse_args()
+
+    params = {}
+    for i in range (0, len(args.params), 2):
+        params[args.params[i]] = float(args.params[i+1])
+    model_params = kdw6_lookup.lookup(args.home_folder, params)
+
+    solution = solve_pulse(model_params, np.array(args.target), args.quantity, args.solve_for, args.J, args.width, args.x_target, bounds=args.bounds)
+    for target, value in zip(args.target, solution):
+        print(f"{args.quantity} {target}: {args.solve_for} = {value}")
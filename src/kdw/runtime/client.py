@@ -0,0 +1,42 @@
+import json
+import urllib.error
+import urllib.request
+
+# Client for the kdw13_daemon lookup and simulation service, using only the standard library.  Start the
+# daemon with: python -m kdw daemon [home_folder]
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+def request(path, payload = None, url = DEFAULT_URL, timeout = 60):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url + path, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.loads(e.read()).get('error', str(e)))
+
+def check(result):
+    if 'error' in result:
+        raise ValueError(result['error'])
+    return result
+
+# Model parameters for one dict of material parameters, e.g. {'Aex': 1.1e-11, 'Ku': 1110000.0, ...}.  With
+# full=True the whole result, including whether it was interpolated and its confidence, is returned.
+def lookup(params, url = DEFAULT_URL, full = False):
+    result = check(request('/lookup', {'params': params}, url))
+    return result if full else result['model_params']
+
+# Results for a list of parameter dicts, sent as one request.  Failed queries hold an 'error' entry.
+def lookup_many(params_list, url = DEFAULT_URL):
+    return request('/lookup', {'params': list(params_list)}, url)['results']
+
+# Final position and peak velocity of the DW for a pulse of amplitude J and length width, and samples points
+# of the trajectory if samples > 0.  params may also be a list of parameter dicts.
+def simulate(params, J, width = 100e-9, t_stop = 200e-9, dt = 1e-11, samples = 0, url = DEFAULT_URL):
+    payload = {'params': params, 'J': J, 'width': width, 't_stop': t_stop, 'dt': dt, 'samples': samples}
+    result = request('/simulate', payload, url)
+    return result['results'] if isinstance(params, list) else check(result)
+
+def stats(url = DEFAULT_URL):
+    return request('/stats', url=url)
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import numpy as np
+
+# NumPy-only counterpart of kdw6_lookup for scripts that look up model parameters many times, e.g. as
+# subprocesses or from a daemon.  Results match kdw6_lookup: a simulated corner within 2.5% of every given
+# parameter returns its fitted constants, otherwise the constants are linearly interpolated over the Delaunay
+# triangulation griddata would use.  The triangulation needs scipy once; it is cached next to the lookup table
+# so later lookups only import numpy.
+
+MODEL_PARAM_NAMES = ['c0', 'c1', 'c2', 'c3', 'd0', 'd1', 'k0', 'k1', 'k2', 'k3', 'k4']
+INTERP_PARAM_NAMES = ['c0', 'c1', 'c2', 'c3', 'd0', 'd1']
+
+_tables = {}  # Parsed tables by path and modification time; only the latest version of each path is kept
+_triangulations = {}  # Loaded triangulations by cache file
+
+# Reads a numeric .csv table with a header row into a dict of columns
+def read_table(path):
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Error: The file {path} does not exist.")
+    key = (path, os.path.getmtime(path))
+    if key not in _tables:
+        with open(path, mode='r') as infile:
+            header = infile.readline().strip().split(',')
+        data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+        for old_key in [k for k in _tables if k[0] == path]:
+            del _tables[old_key]
+        _tables[key] = {name: data[:, i] for i, name in enumerate(header)}
+    return _tables[key]
+
+def table_paths(home_folder, lookup_table_folder = '', error_tables_folder = ''):
+    if not os.path.isdir(home_folder):
+        raise FileNotFoundError(f"Error: The folder {home_folder} does not exist.")
+
+    if not lookup_table_folder:
+        lookup_table_folder = os.path.join(home_folder, 'lookup_tables')
+    if not os.path.isdir(lookup_table_folder):
+        raise FileNotFoundError(f"Error: The folder {lookup_table_folder} does not exist.")
+
+    if not error_tables_folder:
+        error_tables_folder = os.path.join(home_folder, 'error_tables')
+    error_table_path = os.path.join(error_tables_folder, 'all_corners_error.csv')
+    return os.path.join(lookup_table_folder, 'lookup_all.csv'), error_table_path if os.path.isfile(error_table_path) else ''
+
+# Indices of the rows of table within 2.5% of values in every param, for each query (row) of values
+def matching_rows(table, param_names, values):
+    points = np.column_stack([table[param] for param in param_names])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        match = np.all(np.abs((points[None, :, :] - values[:, None, :]) / values[:, None, :]) <= 0.025, axis=2)
+    return [np.flatnonzero(row) for row in match]
+
+# Delaunay triangulation of the rescaled lookup table points, as built by griddata(..., rescale=True).  Cached
+# in a .npz file in the lookup table folder and rebuilt whenever the table points change.
+def triangulation(lookup_table_path, param_names, points):
+    cache_file = os.path.join(os.path.dirname(lookup_table_path), f".lookup_all_{'_'.join(param_names)}.tri.npz")
+    cache = _triangulations.get(cache_file)
+    if cache is None and os.path.isfile(cache_file):
+        with np.load(cache_file) as npz:
+            cache = {k: npz[k] for k in npz.files}
+    if cache is not None and cache['points'].shape == points.shape and np.array_equal(cache['points'], points):
+        _triangulations[cache_file] = cache
+        return cache
+
+    from scipy.spatial import Delaunay  # Only needed until the cache exists
+
+    offset = np.mean(points, axis=0)
+    scale = np.ptp(points, axis=0)
+    scale[~(scale > 0)] = 1.0
+    tri = Delaunay((points - offset) / scale)
+    cache = {'points': points, 'offset': offset, 'scale': scale, 'simplices': tri.simplices, 'transform': tri.transform}
+    try:
+        np.savez(cache_file, **cache)
+    except OSError as e:
+        print(f"WARNING: Could not cache the lookup table triangulation in {cache_file}: {e}")
+    _triangulations[cache_file] = cache
+    return cache
+
+# Barycentric linear interpolation of values at the points of tri for each query; nan outside the hull
+def interpolate(tri, values, queries, eps = 100 * np.finfo(float).eps):
+    ndim = queries.shape[1]
+    x = (queries - tri['offset']) / tri['scale']
+    transform = tri['transform']
+    with np.errstate(invalid='ignore'):
+        c = np.einsum('sij,msj->msi', transform[:, :ndim, :], x[:, None, :] - transform[None, :, ndim, :])
+        barycentric = np.concatenate([c, 1 - np.sum(c, axis=2, keepdims=True)], axis=2)
+        inside = np.all(barycentric >= -eps, axis=2)
+    result = np.full((len(queries), values.shape[1]), np.nan)
+    found = inside.any(axis=1)
+    simplex = np.argmax(inside, axis=1)[found]
+    weights = barycentric[np.flatnonzero(found), simplex]
+    result[found] = np.einsum('mi,mij->mj', weights, values[tri['simplices'][simplex]])
+    return result
+
+def quartic_constants(model_params):
+    c0, c1, c2, c3, d0, d1 = [model_params[k] for k in INTERP_PARAM_NAMES]
+    model_params['k0'] = d0 * c0
+    model_params['k1'] = d0 * c1 + d1 * c0
+    model_params['k2'] = d0 * c2 + d1 * c1
+    model_params['k3'] = d0 * c3 + d1 * c2
+    model_params['k4'] = d1 * c3
+    return model_params
+
+# Model parameters for each query (row) of values, given in the order of param_names, as a dict of arrays.
+# Queries outside the convex hull of the table are nan; queries matching several corners raise ValueError.
+def lookup_batch(lookup_table_path, param_names, values):
+    table = read_table(lookup_table_path)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    model_params = {k: np.full(len(values), np.nan) for k in MODEL_PARAM_NAMES}
+
+    matches = matching_rows(table, param_names, values)
+    for i, rows in enumerate(matches):
+        if len(rows) > 1:
+            raise ValueError(f"Error: Multiple lookup table rows matched the parameters: {dict(zip(param_names, values[i]))}.  You must specify more parameters to uniquely identify a row.")
+        if len(rows) == 1:
+            for k in MODEL_PARAM_NAMES:
+                model_params[k][i] = table[k][rows[0]]
+
+    interpolated = np.array([len(rows) == 0 for rows in matches])
+    if interpolated.any():
+        points = np.column_stack([table[param] for param in param_names])
+        tri = triangulation(lookup_table_path, param_names, points)
+        result = interpolate(tri, np.column_stack([table[k] for k in INTERP_PARAM_NAMES]), values[interpolated])
+        quartic = quartic_constants({k: result[:, j] for j, k in enumerate(INTERP_PARAM_NAMES)})
+        for k in MODEL_PARAM_NAMES:
+            model_params[k][interpolated] = quartic[k]
+    model_params['interpolated'] = interpolated
+    return model_params
+
+# Scaled cityblock distance from each query to its nearest simulated corner, and that corner's parameters
+def nearest_corner(lookup_table_path, param_names, values):
+    table = read_table(lookup_table_path)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    points = np.column_stack([table[param] for param in param_names])
+    points_min = points.min(axis=0)
+    points_range = points.max(axis=0) - points_min
+    distances = np.sum(np.abs((points[None, :, :] - values[:, None, :]) / points_range), axis=2)
+    nearest = np.argmin(distances, axis=1)
+    return distances[np.arange(len(values)), nearest], points[nearest]
+
+# Expected error and confidence of each query from all_corners_error.csv, as reported by kdw6_lookup
+def confidence_batch(lookup_table_path, error_table_path, param_names, values, interpolated):
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    error_table = read_table(error_table_path)
+    distances, nearest_points = nearest_corner(lookup_table_path, param_names, values)
+    corner_values = np.where(interpolated[:, None], nearest_points, values)
+
+    err_mean = np.full(len(values), np.nan)
+    err_conf_95 = np.full(len(values), np.nan)
+    for i, rows in enumerate(matching_rows(error_table, param_names, corner_values)):
+        if len(rows) > 0:
+            err_mean[i] = error_table['err_mean_mean'][rows[0]]
+            err_conf_95[i] = error_table['err_conf_95'][rows[0]]
+
+    level = np.where(distances <= 0.51, 'High', np.where(distances <= 1.51, 'Medium', 'Low'))
+    return {'err_mean_mean': err_mean, 'err_conf_95': np.where(interpolated, np.nan, err_conf_95),
+            'distance': np.where(interpolated, distances, 0.0), 'confidence': level}
+
+def lookup(home_folder, params, lookup_table_folder = '', error_tables_folder = '', verbose = False):
+    lookup_table_path, error_table_path = table_paths(home_folder, lookup_table_folder, error_tables_folder)
+    param_names = list(params.keys())
+    values = [[float(params[param]) for param in param_names]]
+
+    batch = lookup_batch(lookup_table_path, param_names, values)
+    if batch['interpolated'][0] and np.isnan(batch['c0'][0]):
+        raise ValueError(f"Error: Micromagnetic parameters outside convex hull of lookup table.")
+    model_params = {k: float(batch[k][0]) for k in MODEL_PARAM_NAMES}
+
+    if verbose:
+        if not batch['interpolated'][0]:
+            print(f"Found a row matching desired parameters in the lookup table.")
+        print(f"Model parameters:")
+        for param, value in model_params.items():
+            print(f"\t{param}: {value}")
+        if error_table_path:
+            confidence = confidence_batch(lookup_table_path, error_table_path, param_names, values, batch['interpolated'])
+            print_confidence({k: v[0] for k, v in confidence.items()}, batch['interpolated'][0])
+        else:
+            print(f"Warning: Error table all_corners_error.csv not found.  Precise confidence will not be reported.")
+    return model_params
+
+def print_confidence(confidence, interpolated):
+    if np.isnan(confidence['err_mean_mean']):
+        return
+    if interpolated:
+        print(f"Error of nearest simulated corner: {round(confidence['err_mean_mean'] * 100, 2)}%")
+        print(f"Confidence: {confidence['confidence']} - Scaled distance to nearest corner: {round(confidence['distance'], 2)}")
+    else:
+        print(f"Expected error: {round(confidence['err_mean_mean'] * 100, 2)}%")
+        print(f"Confidence: 95% that error < {round(confidence['err_conf_95'] * 100, 2)}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Returns model parameters for given micromagnetic parameter set, using numpy only.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--lookup_table_folder", type=str, default='', help="Lookup table folder")  # Optional argument
+    parser.add_argument("--error_tables_folder", type=str, default='', help="Folder storing all_corners_error.csv")  # Optional argument
+    parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--json", action='store_true', help="Print only the model parameters as JSON")  # Optional argument
+
+    args = parser.parse_args()
+
+    params = {}
+    for i in range (0, len(args.params), 2):
+        params[args.params[i]] = float(args.params[i+1])
+
+    model_params = lookup(args.home_folder, params, args.lookup_table_folder, args.error_tables_folder, verbose=not args.json)
+    if args.json:
+        print(json.dumps(model_params))
@@ -0,0 +1,81 @@
+import argparse
+import numpy as np
+import kdw.runtime.lookup as runtime_lookup
+
+def kinematic_model(k0, k1, k2, k3, k4, d0, d1, time, current, init_x = 0, init_v = 0, init_a = 0):
+    x = np.zeros_like(time)
+    x[0] = init_x
+    v = np.zeros_like(time)
+    v[0] = init_v
+    a = np.zeros_like(time)
+    a[0] = init_a
+    for i in range(1, len(time)):
+        dt = time[i] - time[i-1]
+        if current[i] > 0:
+            a_j = k4 * current[i]**4 + k3 * current[i]**3 + k2 * current[i]**2 + k1 * current[i] + k0
+        elif current[i] < 0:
+            a_j = -k4 * current[i]**4 + k3 * current[i]**3 - k2 * current[i]**2 + k1 * current[i] - k0
+        else:
+            a_j = 0
+        a_damp = -v[i-1] * (d1 * abs(current[i]) + d0)
+        a[i] = a_j + a_damp
+        v[i] = v[i-1] + a[i] * dt
+        x[i] = x[i-1] + v[i] * dt
+    return x, v, a
+
+# kinematic_model for many devices sharing one time axis.  The model constants are arrays over devices and
+# current is a (devices, samples) array; the devices are stepped together, with the same arithmetic per device.
+def kinematic_model_batch(k0, k1, k2, k3, k4, d0, d1, time, current):
+    k0, k1, k2, k3, k4, d0, d1 = [np.asarray(k, dtype=float)[:, None] for k in (k0, k1, k2, k3, k4, d0, d1)]
+    a_j = np.where(current > 0, k4 * current**4 + k3 * current**3 + k2 * current**2 + k1 * current + k0,
+                   np.where(current < 0, -k4 * current**4 + k3 * current**3 - k2 * current**2 + k1 * current - k0, 0.0))
+    damping = d1 * np.abs(current) + d0
+    dt = np.diff(time)
+
+    # Time-major so that each step works on contiguous rows
+    a_j = np.ascontiguousarray(a_j.T)
+    damping = np.ascontiguousarray(damping.T)
+    x = np.zeros(a_j.shape)
+    v = np.zeros(a_j.shape)
+    a = np.zeros(a_j.shape)
+    for i in range(1, len(time)):
+        a[i] = a_j[i] + -v[i-1] * damping[i]
+        v[i] = v[i-1] + a[i] * dt[i-1]
+        x[i] = x[i-1] + v[i] * dt[i-1]
+    return x.T, v.T, a.T
+
+# Current of a single pulse of amplitude J and length width, sampled every dt until t_stop, as in the mumax
+# simulations the model is fit to
+def pulse(J, width, t_stop, dt):
+    time = dt * np.arange(int(np.floor(t_stop / dt + 1e-9)) + 1)
+    return time, np.where(time <= width, J, 0.0)
+
+def simulate_pulse(model_params, J, width, t_stop, dt = 1e-11):
+    time, current = pulse(J, width, t_stop, dt)
+    x, v, a = kinematic_model(*[float(model_params[k]) for k in ['k0', 'k1', 'k2', 'k3', 'k4', 'd0', 'd1']], time, current)
+    return {'time': time, 'current': current, 'x': x, 'v': v, 'a': a}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates DW motion for a current pulse, using numpy only.")
+    parser.add_argument("home_folder", type=str, help="The master directory")  # Positional argument
+    parser.add_argument("--params", type=str, default='', nargs='+', help="Pass in target parameter values like: Msat 5e7 Aex 3e4")  # Optional argument
+    parser.add_argument("--J", type=float, required=True, help="Pulse amplitude (A/m^2)")  # Optional argument
+    parser.add_argument("--width", type=float, default=100e-9, help="Pulse length (s)")  # Optional argument
+    parser.add_argument("--t_stop", type=float, default=200e-9, help="Simulated time (s)")  # Optional argument
+    parser.add_argument("--dt", type=float, default=1e-11, help="Time step (s)")  # Optional argument
+    parser.add_argument("--output_file", type=str, default='', help="Optional .csv file to write time, current, x, v and a to")  # Optional argument
+
+    args = parser.parse_args()
+
+    params = {}
+    for i in range (0, len(args.params), 2):
+        params[args.params[i]] = float(args.params[i+1])
+    model_params = runtime_lookup.lookup(args.home_folder, params)
+
+    result = simulate_pulse(model_params, args.J, args.width, args.t_stop, args.dt)
+    if args.output_file:
+        np.savetxt(args.output_file, np.column_stack([result[k] for k in ['time', 'current', 'x', 'v', 'a']]),
+                   delimiter=',', header='time,current,x,v,a', comments='')
+        print(f"INFO: Wrote {len(result['time'])} samples to {args.output_file}")
+    print(f"Final DW position: {result['x'][-1]} m")
+    print(f"Max DW velocity: {result['v'][np.argmax(np.abs(result['v']))]} m/s")